@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas@vitvar.com
+
+"""
+Rule dispatch benchmark of the ja2mqtt bridge.
+
+The benchmark creates the bridge with the ja2mqtt definition in the config directory and
+a topology of the given number of peripherals (and one section per eight peripherals),
+and calls the bridge with serial lines the way the bridge worker does. The lines are a mix
+of `OK` heartbeats, `STATE` lines of sections that change their states and `PRFSTATE` lines
+where one peripheral changes its state. Published messages are counted and dropped.
+It reports the number of lines processed per second for each topology size, in total and
+for each kind of lines.
+
+    python bin/bridge-bench.py -n 20000 8 128 512
+"""
+
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import ja2mqtt.config as ja2mqtt_config  # noqa: E402
+from ja2mqtt.components import SerialMQTTBridge  # noqa: E402
+from ja2mqtt.config import Config  # noqa: E402
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "config")
+
+
+class MQTT:
+    """
+    A stand-in for the MQTT client that counts published messages.
+    """
+
+    connected = True
+    spool = None
+    v5 = False
+
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, topic, payload, retain=False, properties=None):
+        self.published += 1
+
+
+def write_config(config_dir, peripherals):
+    """
+    Write the configuration with the topology of `peripherals` peripherals to the `config_dir`
+    directory and return the path of the configuration file and the number of prfstate bits.
+    """
+    bits = max(24, (peripherals + 7) // 8 * 8)
+    with open(os.path.join(CONFIG_DIR, "ja2mqtt.yaml")) as f:
+        definition = f.read().replace("prfstate_bits: 24", f"prfstate_bits: {bits}")
+    with open(os.path.join(config_dir, "ja2mqtt.yaml"), "w") as f:
+        f.write(definition)
+
+    config = {
+        "version": "1.0",
+        "ja2mqtt": "ja2mqtt.yaml",
+        "logs": "logs",
+        "mqtt-broker": {"address": "localhost", "port": 1883},
+        "serial": {"use_simulator": True, "port": "/dev/ttyUSB0"},
+        "topology": {
+            "section": [
+                {"name": f"section{i}", "code": i}
+                for i in range(1, (peripherals + 7) // 8 + 1)
+            ],
+            "peripheral": [
+                {"name": f"area{i // 8}/motion{i}", "type": "motion", "pos": i}
+                for i in range(peripherals)
+            ],
+        },
+    }
+    config_file = os.path.join(config_dir, "config.yaml")
+    with open(config_file, "w") as f:
+        yaml.safe_dump(config, f)
+    return config_file, bits
+
+
+def serial_lines(peripherals, bits, n):
+    """
+    Return `n` serial lines, a third of them are `OK`, `STATE` and `PRFSTATE` lines each.
+    """
+    rnd = random.Random(1)
+    sections = (peripherals + 7) // 8
+    states = ["READY", "ARMED"]
+    mask = 0
+    lines = []
+    for i in range(n):
+        if i % 3 == 0:
+            lines.append("OK")
+        elif i % 3 == 1:
+            lines.append(
+                f"STATE {i // 3 % sections + 1} {states[i // 3 // sections % 2]}"
+            )
+        else:
+            mask ^= 1 << rnd.randrange(peripherals)
+            lines.append("PRFSTATE " + mask.to_bytes(bits // 8, "little").hex().upper())
+    return lines
+
+
+def bench(peripherals, n):
+    """
+    Process `n` lines by the bridge with the topology of `peripherals` peripherals.
+    Return the number of lines per second, a dictionary with the numbers of lines per second
+    by kinds of lines and the number of published messages.
+    """
+    config_dir = tempfile.mkdtemp(prefix="ja2mqtt-bridge-")
+    try:
+        config_file, bits = write_config(config_dir, peripherals)
+        config = Config(config_file, None, schema="config-schema.yaml")
+        config.validate()
+        bridge = SerialMQTTBridge(config)
+        bridge.mqtt = MQTT()
+        lines = serial_lines(peripherals, bits, n)
+        durations, counts = {}, {}
+        for line in lines:
+            kind = line.split(" ")[0]
+            start_time = time.perf_counter()
+            bridge.on_serial_data(line)
+            durations[kind] = durations.get(kind, 0) + time.perf_counter() - start_time
+            counts[kind] = counts.get(kind, 0) + 1
+        rates = {k: counts[k] / durations[k] for k in counts}
+        return n / sum(durations.values()), rates, bridge.mqtt.published
+    finally:
+        shutil.rmtree(config_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "-n", type=int, default=20000, help="Number of serial lines to process."
+    )
+    parser.add_argument(
+        "sizes",
+        nargs="*",
+        type=int,
+        default=[8, 128, 512],
+        help="Numbers of peripherals to measure.",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    ja2mqtt_config.CACHE_DIR = None
+
+    for peripherals in args.sizes:
+        rate, rates, published = bench(peripherals, args.n)
+        print(
+            f"peripherals={peripherals:<5d} lines/s={rate:,.0f} "
+            + " ".join(f"{k}={v:,.0f}" for k, v in rates.items())
+            + f" published={published}"
+        )
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas@vitvar.com
+
+"""
+Encode and decode benchmark of the ja2mqtt payload codecs.
+
+The benchmark emits payloads of a section state and a peripheral state event from compiled
+templates the same way as the bridge does, decodes them as a consumer would, and reports
+the payload size and the CPU time per message for each codec given on the command line.
+Codecs whose Python packages are not installed are skipped.
+
+    python bin/codec-bench.py -n 100000 json cbor msgpack
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ja2mqtt.codec import CODECS, get_codec  # noqa: E402
+from ja2mqtt.utils import JSONEmitter  # noqa: E402
+
+
+class Value:
+    """
+    A stand-in for a Python expression of a template that reads the value from the scope.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def eval(self, scope):
+        return scope[self.key]
+
+
+TEMPLATES = {
+    "section": {
+        "section_code": 1,
+        "section_name": "house",
+        "state": Value("state"),
+        "updated": Value("updated"),
+    },
+    "peripheral": {
+        "name": "house/upperfloor/livingroom",
+        "type": "motion",
+        "pos": 3,
+        "state": Value("state"),
+        "updated": Value("updated"),
+    },
+}
+
+
+def bench(codec, template, n):
+    emitter = JSONEmitter(template)
+    scopes = [
+        {"state": "ON" if i % 2 else "OFF", "updated": time.time() + i}
+        for i in range(100)
+    ]
+    correlation = {"corrid": "a22c186af2e1"}
+
+    start_time = time.process_time()
+    for i in range(n):
+        _, payload = codec.emit(emitter, scopes[i % 100], correlation)
+    encode_time = time.process_time() - start_time
+
+    payloads = [codec.emit(emitter, scope, correlation)[1] for scope in scopes]
+    if not codec.binary:
+        payloads = [x.encode("utf-8") for x in payloads]
+    start_time = time.process_time()
+    for i in range(n):
+        codec.decode(payloads[i % 100])
+    decode_time = time.process_time() - start_time
+
+    return (
+        sum(len(x) for x in payloads) / len(payloads),
+        encode_time / n * 1e6,
+        decode_time / n * 1e6,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-n", type=int, default=100000, help="Number of messages.")
+    parser.add_argument(
+        "codecs", nargs="*", default=list(CODECS.keys()), help="Codecs to measure."
+    )
+    args = parser.parse_args()
+
+    for name in args.codecs:
+        try:
+            codec = get_codec(name)
+        except Exception as e:
+            print(f"{name:8s} skipped. {str(e)}")
+            continue
+        for kind, template in TEMPLATES.items():
+            size, encode_us, decode_us = bench(codec, template, args.n)
+            print(
+                f"{name:8s} {kind:10s} size={size:.0f} bytes "
+                + f"encode={encode_us:.2f}us decode={decode_us:.2f}us"
+            )
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas@vitvar.com
+
+"""
+Throughput benchmark of the ja2mqtt MQTT client against a local stand-in broker.
+
+The benchmark measures the rate of messages the client publishes, the rate of messages
+it receives and the rate of received messages that are answered by a publish (echo),
+for each network loop given on the command line. It also reports the average size of
+a published packet that MQTT 5 topic aliases reduce.
+
+    python bin/mqtt-bench.py -n 20000 batch paho
+    python bin/mqtt-bench.py -n 20000 --protocol MQTTv5 batch
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ja2mqtt.components import MQTT  # noqa: E402
+from ja2mqtt.config import Config  # noqa: E402
+
+PAYLOAD = b'{"section_code": 1, "section_name": "house", "state": "ARMED"}'
+
+# a topic with a name of the length typical for ja2mqtt topics
+OUT_TOPIC = "ja2mqtt/section/house/upperfloor/livingroom"
+
+
+def encode_length(n):
+    out = bytearray()
+    while True:
+        b, n = n % 128, n // 128
+        out.append(b | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def decode_length(data, i):
+    """
+    Decode the variable byte integer at the position `i` of `data`. Return the value
+    and the position after the integer.
+    """
+    n, mult = 0, 1
+    while True:
+        b = data[i]
+        n, mult, i = n + (b & 127) * mult, mult * 128, i + 1
+        if not b & 128:
+            return n, i
+
+
+def publish_packet(topic, payload):
+    body = struct.pack(">H", len(topic)) + topic.encode() + payload
+    return bytes([0x30]) + encode_length(len(body)) + body
+
+
+# sizes of MQTT v5 properties of a publish packet, 0 is a string or binary data
+# and -1 is a variable byte integer
+PUBLISH_PROPERTIES = {1: 1, 2: 4, 3: 0, 8: 0, 9: 0, 11: -1, 35: 2}
+
+TOPIC_ALIAS = 35
+TOPIC_ALIAS_MAXIMUM = 34
+
+
+def parse_properties(data):
+    """
+    Return a list of (id, value) of MQTT v5 publish properties in `data`.
+    """
+    i, props = 0, []
+    while i < len(data):
+        id, i = data[i], i + 1
+        size = PUBLISH_PROPERTIES.get(id)
+        if size is None:
+            # a user property with two strings
+            n = struct.unpack(">H", data[i : i + 2])[0]
+            m = struct.unpack(">H", data[i + 2 + n : i + 4 + n])[0]
+            size = 4 + n + m
+        elif size == 0:
+            size = 2 + struct.unpack(">H", data[i : i + 2])[0]
+        elif size == -1:
+            size = decode_length(data, i)[1] - i
+        props.append((id, data[i : i + size]))
+        i += size
+    return props
+
+
+class Broker:
+    """
+    A minimal MQTT 3.1.1 and MQTT 5 broker with QoS 0 and exact topic subscriptions.
+    It accepts `alias_maximum` topic aliases from MQTT 5 clients and forwards properties
+    of messages to MQTT 5 subscribers. It notifies the `last` event when it receives
+    a message on a topic ending with `/last`. It counts the bytes of publish packets
+    it receives and it records the messages in `messages` when it is not None. It records
+    the protocol versions and the flags of connect packets in `connects` and counts
+    the messages published by an alias of their topic in `aliased`.
+    """
+
+    def __init__(self, alias_maximum=100):
+        self.alias_maximum = alias_maximum
+        self.subscriptions = {}
+        self.last = threading.Event()
+        self.last_time = None
+        self.port = None
+        self.ready = threading.Event()
+        self.received_bytes = 0
+        self.messages = None
+        self.connects = []
+        self.aliased = 0
+
+    async def handle(self, reader, writer):
+        self.subscriptions[writer] = set()
+        version, aliases = 4, {}
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                length, mult, size = 0, 1, 1
+                while True:
+                    b = (await reader.readexactly(1))[0]
+                    length, mult, size = length + (b & 127) * mult, mult * 128, size + 1
+                    if not b & 128:
+                        break
+                body = await reader.readexactly(length)
+                kind = header >> 4
+                if kind == 1:
+                    version = body[6]
+                    writer.version = version
+                    self.connects.append((version, body[7]))
+                    if version == 5:
+                        props = bytes([TOPIC_ALIAS_MAXIMUM]) + struct.pack(
+                            ">H", self.alias_maximum
+                        )
+                        writer.write(
+                            bytes([0x20, 3 + len(props), 0, 0, len(props)]) + props
+                        )
+                    else:
+                        writer.write(bytes([0x20, 2, 0, 0]))
+                elif kind == 8:
+                    i, codes = 2, b""
+                    if version == 5:
+                        n, i = decode_length(body, 2)
+                        i += n
+                    while i < len(body):
+                        n = struct.unpack(">H", body[i : i + 2])[0]
+                        self.subscriptions[writer].add(body[i + 2 : i + 2 + n].decode())
+                        i, codes = i + 3 + n, codes + b"\0"
+                    if version == 5:
+                        codes = b"\0" + codes
+                    writer.write(bytes([0x90, 2 + len(codes)]) + body[:2] + codes)
+                elif kind == 3:
+                    self.received_bytes += size + length
+                    n = struct.unpack(">H", body[:2])[0]
+                    topic, i, props = body[2 : 2 + n].decode(), 2 + n, []
+                    if version == 5:
+                        n, i = decode_length(body, i)
+                        props, i = parse_properties(body[i : i + n]), i + n
+                        for id, value in props:
+                            if id == TOPIC_ALIAS:
+                                alias = struct.unpack(">H", value)[0]
+                                if topic == "":
+                                    topic = aliases[alias]
+                                    self.aliased += 1
+                                else:
+                                    aliases[alias] = topic
+                        props = [x for x in props if x[0] != TOPIC_ALIAS]
+                    payload = body[i:]
+                    if self.messages is not None:
+                        self.messages.append((topic, payload, dict(props)))
+                    if topic.endswith("/last"):
+                        self.last_time = time.time()
+                        self.last.set()
+                    packets = {}
+                    for w, topics in self.subscriptions.items():
+                        if topic in topics:
+                            v = getattr(w, "version", 4)
+                            if v not in packets:
+                                b = struct.pack(">H", len(topic)) + topic.encode()
+                                if v == 5:
+                                    p = b"".join(bytes([id]) + x for id, x in props)
+                                    b += encode_length(len(p)) + p
+                                b += payload
+                                packets[v] = (
+                                    bytes([header & 0xF1]) + encode_length(len(b)) + b
+                                )
+                            w.write(packets[v])
+                elif kind == 12:
+                    writer.write(bytes([0xD0, 0]))
+                elif kind == 14:
+                    break
+                if writer.transport.get_write_buffer_size() > 65536:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscriptions.pop(writer, None)
+            writer.close()
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(
+            asyncio.start_server(self.handle, "127.0.0.1", 0)
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        loop.run_forever()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        self.ready.wait()
+
+    def wait_last(self, timeout=120):
+        if not self.last.wait(timeout):
+            raise Exception("The broker did not receive the last message!")
+        self.last.clear()
+        return self.last_time
+
+
+def raw_publisher(port, topic, n):
+    """
+    Connect to the broker and publish `n` messages on the `topic` at once.
+    """
+    s = socket.create_connection(("127.0.0.1", port))
+    s.sendall(bytes([0x10, 12, 0, 4]) + b"MQTT" + bytes([4, 2, 0, 60, 0, 0]))
+    s.recv(4)
+    s.sendall(publish_packet(topic, PAYLOAD) * n)
+    return s
+
+
+def bench(broker, network_loop, n, protocol="MQTTv311"):
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+        f.write(
+            f'version: "1.0"\nmqtt-broker:\n  address: 127.0.0.1\n  port: {broker.port}\n'
+            + f"  network_loop: {network_loop}\n  protocol: {protocol}\n"
+        )
+    mqtt = MQTT("ja2mqtt-bench", Config(f.name).get_part("mqtt-broker"))
+    os.unlink(f.name)
+
+    received, done, echo = [0], threading.Event(), [False]
+
+    def _on_message(topic, payload, properties=None):
+        received[0] += 1
+        if echo[0]:
+            mqtt._publish(
+                "bench/echo" if received[0] < n else "bench/echo/last", payload
+            )
+        if received[0] == n:
+            done.set()
+
+    mqtt.on_message_ext = _on_message
+    mqtt.on_connect_ext = lambda *args: mqtt.client.subscribe("bench/in")
+    exit_event = threading.Event()
+    mqtt.start(exit_event)
+    mqtt.wait_is_connected(exit_event, timeout=10)
+    time.sleep(0.5)
+
+    result = {}
+    received_bytes, start_time = broker.received_bytes, time.time()
+    for _ in range(n - 1):
+        mqtt._publish(OUT_TOPIC, PAYLOAD)
+    mqtt._publish(OUT_TOPIC + "/last", PAYLOAD)
+    result["publish"] = n / (broker.wait_last() - start_time)
+    result["packet"] = (broker.received_bytes - received_bytes) / n
+
+    received[0], start_time = 0, time.time()
+    s = raw_publisher(broker.port, "bench/in", n)
+    done.wait(120)
+    result["receive"] = n / (time.time() - start_time)
+    s.close()
+
+    received[0], echo[0], start_time = 0, True, time.time()
+    s = raw_publisher(broker.port, "bench/in", n)
+    result["echo"] = n / (broker.wait_last() - start_time)
+    s.close()
+
+    exit_event.set()
+    mqtt.join()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-n", type=int, default=20000, help="Number of messages.")
+    parser.add_argument(
+        "--protocol",
+        default="MQTTv311",
+        choices=["MQTTv311", "MQTTv5"],
+        help="MQTT protocol of the client.",
+    )
+    parser.add_argument(
+        "loops", nargs="*", default=["batch", "paho"], help="Network loops to measure."
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    broker = Broker()
+    broker.start()
+    for network_loop in args.loops:
+        r = bench(broker, network_loop, args.n, args.protocol)
+        print(
+            f"{network_loop:8s} {args.protocol} n={args.n} publish={r['publish']:,.0f}/s "
+            + f"({r['packet']:.0f} bytes/packet) receive={r['receive']:,.0f}/s echo={r['echo']:,.0f}/s"
+        )
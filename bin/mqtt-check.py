@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas@vitvar.com
+
+"""
+Behaviour check of the ja2mqtt MQTT client against a local stand-in broker.
+
+The check connects the client with MQTT 3.1.1 and MQTT 5 and verifies the clean session
+and clean start flags of the connect packets, the topic aliases of MQTT 5 publishes and the
+correlation data, response topic and message expiry properties of published and received
+messages. It exits with a non-zero status when a check fails.
+
+    python bin/mqtt-check.py
+"""
+
+import importlib.util
+import logging
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import ja2mqtt.config as ja2mqtt_config  # noqa: E402
+from ja2mqtt.components import MQTT  # noqa: E402
+from ja2mqtt.config import Config  # noqa: E402
+from ja2mqtt.utils import Map  # noqa: E402
+
+# the stand-in broker of the MQTT client benchmark
+spec = importlib.util.spec_from_file_location(
+    "mqtt_bench", os.path.join(os.path.dirname(__file__), "mqtt-bench.py")
+)
+mqtt_bench = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mqtt_bench)
+
+CLEAN_FLAG = 0x02
+
+# ids of MQTT v5 publish properties
+MESSAGE_EXPIRY_INTERVAL = 2
+RESPONSE_TOPIC = 8
+CORRELATION_DATA = 9
+
+failures = []
+
+
+def check(name, value, expected):
+    ok = value == expected
+    print(
+        f"{'PASS' if ok else 'FAIL'} {name}"
+        + ("" if ok else f": {value} != {expected}")
+    )
+    if not ok:
+        failures.append(name)
+
+
+def client(broker, options):
+    """
+    Create the MQTT client for the broker with the `options` of the mqtt-broker configuration,
+    start it and wait until it is connected. Return the client and its exit event.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+        f.write(
+            f'version: "1.0"\nmqtt-broker:\n  address: 127.0.0.1\n  port: {broker.port}\n'
+            + "".join(f"  {k}: {v}\n" for k, v in options.items())
+        )
+    mqtt = MQTT("ja2mqtt-check", Config(f.name).get_part("mqtt-broker"))
+    os.unlink(f.name)
+    exit_event = threading.Event()
+    mqtt.start(exit_event)
+    if not mqtt.wait_is_connected(exit_event, timeout=10):
+        raise Exception("The client did not connect to the broker!")
+    return mqtt, exit_event
+
+
+def stop(mqtt, exit_event):
+    exit_event.set()
+    mqtt.join()
+
+
+def wait_messages(broker, n, timeout=5):
+    start_time = time.time()
+    while len(broker.messages) < n and time.time() - start_time < timeout:
+        time.sleep(0.01)
+    return broker.messages
+
+
+def check_sessions(broker):
+    for protocol in ("MQTTv311", "MQTTv5"):
+        for clean_session, expected in (("True", True), ("False", False), (None, True)):
+            options = dict(protocol=protocol)
+            if clean_session is not None:
+                options["clean_session"] = clean_session
+            broker.connects.clear()
+            stop(*client(broker, options))
+            version, flags = broker.connects[-1]
+            check(
+                f"{protocol} clean_session={clean_session} sets the clean flag to {expected}",
+                (version, bool(flags & CLEAN_FLAG)),
+                (5 if protocol == "MQTTv5" else 4, expected),
+            )
+
+
+def check_aliases(broker):
+    topics = ["check/a", "check/b", "check/a", "check/a", "check/b"]
+    for topic_aliases, expected in ((True, 3), (False, 0)):
+        broker.messages, broker.aliased = [], 0
+        mqtt, exit_event = client(
+            broker, dict(protocol="MQTTv5", topic_aliases=topic_aliases)
+        )
+        for topic in topics:
+            mqtt.publish(topic, b"{}")
+        messages = wait_messages(broker, len(topics))
+        stop(mqtt, exit_event)
+        check(
+            f"topic_aliases={topic_aliases} keeps the topics of messages",
+            [x[0] for x in messages],
+            topics,
+        )
+        check(
+            f"topic_aliases={topic_aliases} publishes {expected} messages by an alias",
+            broker.aliased,
+            expected,
+        )
+
+
+def check_properties(broker):
+    broker.messages = []
+    mqtt, exit_event = client(broker, dict(protocol="MQTTv5"))
+    received = []
+    mqtt.on_message_ext = lambda topic, payload, properties=None: received.append(
+        properties
+    )
+    mqtt.client.subscribe("check/in")
+    time.sleep(0.2)
+    properties = Map(correlation_data=b"a22c", response_topic="check/in", expiry=1.5)
+    mqtt.publish("check/in", b"{}", properties=properties)
+    mqtt.publish("check/in", b"{}", properties=properties)
+    messages = wait_messages(broker, 2)
+    start_time = time.time()
+    while len(received) < 2 and time.time() - start_time < 5:
+        time.sleep(0.01)
+    stop(mqtt, exit_event)
+
+    for i, message in enumerate(messages):
+        props = message[2]
+        check(
+            f"message {i + 1} has the correlation data",
+            props.get(CORRELATION_DATA),
+            struct.pack(">H", 4) + b"a22c",
+        )
+        check(
+            f"message {i + 1} has the response topic",
+            props.get(RESPONSE_TOPIC),
+            struct.pack(">H", 8) + b"check/in",
+        )
+        check(
+            f"message {i + 1} expires after the rounded up expiry",
+            props.get(MESSAGE_EXPIRY_INTERVAL),
+            struct.pack(">I", 2),
+        )
+    check(
+        "received messages have the correlation data and response topic",
+        [(x.correlation_data, x.response_topic) for x in received if x is not None],
+        [(b"a22c", "check/in")] * 2,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.CRITICAL)
+    ja2mqtt_config.CACHE_DIR = None
+
+    broker = mqtt_bench.Broker()
+    broker.start()
+    check_sessions(broker)
+    check_aliases(broker)
+    check_properties(broker)
+    print(f"{len(failures)} checks failed." if failures else "All checks passed.")
+    sys.exit(1 if failures else 0)
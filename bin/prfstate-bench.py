@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas@vitvar.com
+
+"""
+Microbenchmark of the prfstate codec.
+
+The benchmark decodes and encodes random `PRFSTATE` frames of the given sizes in bits with
+the functions of the serial component and reports the time per frame in microseconds.
+It checks that the decoded frames encode back to the same frames. The batch decoding is
+measured for a list of all frames, its time is also reported per frame.
+
+    python bin/prfstate-bench.py -n 2000 24 128 1024
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ja2mqtt.components.serial import (  # noqa: E402
+    decode_prfstate,
+    decode_prfstate_batch,
+    decode_prfstate_mask,
+    encode_prfstate,
+)
+
+
+def measure(fn, items, repeat=5):
+    """
+    Call the function with every item and return the best time per item in microseconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for x in items:
+            fn(x)
+        duration = time.perf_counter() - start_time
+        best = duration if best is None else min(best, duration)
+    return best / len(items) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-n", type=int, default=2000, help="Number of frames.")
+    parser.add_argument(
+        "sizes",
+        nargs="*",
+        type=int,
+        default=[24, 128, 1024],
+        help="Sizes of frames in bits.",
+    )
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    for bits in args.sizes:
+        frames = [
+            rnd.getrandbits(bits).to_bytes(bits // 8, "little").hex().upper()
+            for _ in range(args.n)
+        ]
+        decoded = [decode_prfstate(x) for x in frames]
+        if [encode_prfstate(x, bits) for x in decoded] != frames:
+            raise Exception(f"The frames of {bits} bits do not round-trip!")
+        results = dict(
+            decode=measure(decode_prfstate, frames),
+            encode=measure(lambda x: encode_prfstate(x, bits), decoded),
+            decode_mask=measure(decode_prfstate_mask, frames),
+            decode_batch=measure(decode_prfstate_batch, [frames], repeat=5) / args.n,
+        )
+        print(
+            f"bits={bits:<5d} "
+            + " ".join(f"{k}={v:,.2f}us" for k, v in results.items())
+        )
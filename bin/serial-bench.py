@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas@vitvar.com
+
+"""
+Serial to MQTT benchmark of ja2mqtt against a fake panel on a pseudo-terminal.
+
+The benchmark opens a pseudo-terminal that acts as the serial interface of JA-121T, runs
+the serial, bridge and MQTT components in the threads or the asyncio runtime with the
+stand-in broker of the MQTT client benchmark, and writes `STATE` lines of a section that
+changes its state to the terminal, so that the bridge publishes a message for every line.
+It reports the throughput when all lines are written at once, and latencies between writing
+a line to the terminal and receiving its message by the broker when the lines are written
+at the given rate.
+
+    python bin/serial-bench.py --runtime threads -n 2000 --rate 100
+    python bin/serial-bench.py --runtime asyncio -n 2000 --rate 100
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+import pty
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import ja2mqtt.config as ja2mqtt_config  # noqa: E402
+from ja2mqtt.commands.run import create_components  # noqa: E402
+from ja2mqtt.config import Config  # noqa: E402
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "config")
+
+# the stand-in broker of the MQTT client benchmark
+spec = importlib.util.spec_from_file_location(
+    "mqtt_bench", os.path.join(os.path.dirname(__file__), "mqtt-bench.py")
+)
+mqtt_bench = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mqtt_bench)
+
+STATES = ["ARMED", "READY"]
+
+
+class Messages(list):
+    """
+    Messages received by the broker with the times when they were received.
+    """
+
+    def append(self, message):
+        super().append((time.perf_counter(), message))
+
+
+def write_config(config_dir, port, broker_port):
+    """
+    Write the configuration of the bridge with the serial `port` and the broker port to
+    the `config_dir` directory and return the path of the configuration file.
+    """
+    shutil.copy(os.path.join(CONFIG_DIR, "ja2mqtt.yaml"), config_dir)
+    config = {
+        "version": "1.0",
+        "ja2mqtt": "ja2mqtt.yaml",
+        "logs": "logs",
+        "mqtt-broker": {"address": "127.0.0.1", "port": broker_port},
+        # the serial buffer is not bounded so that no lines are dropped
+        "serial": {"port": port, "buffer_size": 0},
+        "topology": {
+            "section": [{"name": "house", "code": 1}],
+            "peripheral": [{"name": "house/door", "type": "magnet", "pos": 1}],
+        },
+    }
+    config_file = os.path.join(config_dir, "config.yaml")
+    with open(config_file, "w") as f:
+        yaml.safe_dump(config, f)
+    return config_file
+
+
+def wait_messages(broker, n, timeout):
+    start_time = time.time()
+    while len(broker.messages) < n and time.time() - start_time < timeout:
+        time.sleep(0.001)
+    return len(broker.messages) >= n
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench(broker, runtime, n, rate, timeout):
+    """
+    Run the components with the fake panel and return the throughput in lines per second
+    and a list of latencies in milliseconds.
+    """
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    config_dir = tempfile.mkdtemp(prefix="ja2mqtt-serial-")
+    exit_event = threading.Event()
+    components = []
+    try:
+        config_file = write_config(config_dir, os.ttyname(slave), broker.port)
+        config = Config(config_file, None, schema="config-schema.yaml")
+        config.validate()
+        mqtt, panels, components = create_components(
+            config, logging.getLogger("bench"), runtime
+        )
+        for x in components:
+            x.start(exit_event)
+        if not mqtt.wait_is_connected(exit_event, timeout=10):
+            raise Exception("The client did not connect to the broker!")
+
+        def _line(i):
+            return f"STATE 1 {STATES[i % 2]}\n".encode()
+
+        # throughput of lines written at once
+        broker.messages = Messages()
+        start_time = time.perf_counter()
+        os.write(master, b"".join(_line(i) for i in range(n)))
+        if not wait_messages(broker, n, timeout):
+            raise Exception(f"The broker received {len(broker.messages)} of {n}!")
+        throughput = n / (broker.messages[-1][0] - start_time)
+
+        # latencies of lines written at the rate
+        broker.messages = Messages()
+        written = []
+        start_time = time.perf_counter()
+        for i in range(n):
+            delay = start_time + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            written.append(time.perf_counter())
+            os.write(master, _line(i))
+        if not wait_messages(broker, n, timeout):
+            raise Exception(f"The broker received {len(broker.messages)} of {n}!")
+        latencies = [(m[0] - w) * 1000 for w, m in zip(written, broker.messages)]
+        return throughput, latencies
+    finally:
+        exit_event.set()
+        for x in components:
+            x.join()
+        os.close(master)
+        os.close(slave)
+        shutil.rmtree(config_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--runtime",
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="Runtime of the components.",
+    )
+    parser.add_argument("-n", type=int, default=2000, help="Number of lines.")
+    parser.add_argument(
+        "--rate", type=float, default=100, help="Lines per second of the latency run."
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60, help="Timeout of a run in seconds."
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    ja2mqtt_config.CACHE_DIR = None
+
+    broker = mqtt_bench.Broker()
+    broker.start()
+    throughput, latencies = bench(broker, args.runtime, args.n, args.rate, args.timeout)
+    print(
+        f"runtime={args.runtime} lines={args.n} throughput={throughput:,.0f} lines/s "
+        + f"latency p50={percentile(latencies, 50):.2f}ms "
+        + f"p99={percentile(latencies, 99):.2f}ms max={max(latencies):.2f}ms"
+    )
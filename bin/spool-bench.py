@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas@vitvar.com
+
+"""
+Recovery benchmark of the ja2mqtt spool against a local stand-in broker.
+
+The benchmark measures the rate of messages appended to the spool while the broker is down,
+the time to recover the spool from disk after a restart and the rate of messages replayed
+to the broker after the client connects, for each replay rate given on the command line
+(0 is unlimited).
+
+    python bin/spool-bench.py -n 20000 0 1000
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ja2mqtt.components import MQTT, Spool  # noqa: E402
+from ja2mqtt.config import Config  # noqa: E402
+
+# the stand-in broker of the MQTT client benchmark
+spec = importlib.util.spec_from_file_location(
+    "mqtt_bench", os.path.join(os.path.dirname(__file__), "mqtt-bench.py")
+)
+mqtt_bench = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mqtt_bench)
+
+
+def bench(broker, replay_rate, n):
+    spool_dir = tempfile.mkdtemp(prefix="ja2mqtt-spool-")
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+        f.write(
+            f'version: "1.0"\nmqtt-broker:\n  address: 127.0.0.1\n  port: {broker.port}\n'
+            + f"spool:\n  dir: {spool_dir}\n  replay_rate: {replay_rate}\n"
+        )
+    config = Config(f.name)
+    os.unlink(f.name)
+
+    result = {}
+    spool = Spool(config.get_part("spool"))
+    start_time = time.time()
+    for i in range(n):
+        spool.append("bench/out" if i < n - 1 else "bench/out/last", mqtt_bench.PAYLOAD)
+    result["append"] = n / (time.time() - start_time)
+    spool.close()
+
+    # the spool is recovered from disk as after a restart of ja2mqtt
+    start_time = time.time()
+    spool = Spool(config.get_part("spool"))
+    result["recover"] = time.time() - start_time
+
+    mqtt = MQTT("ja2mqtt-bench", config.get_part("mqtt-broker"))
+    mqtt.set_spool(spool)
+    exit_event = threading.Event()
+    mqtt.start(exit_event)
+    mqtt.wait_is_connected(exit_event, timeout=10)
+    start_time = time.time()
+    result["replay"] = n / (
+        broker.wait_last(timeout=max(120, 2 * n / (replay_rate or n))) - start_time
+    )
+
+    exit_event.set()
+    mqtt.join()
+    shutil.rmtree(spool_dir)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-n", type=int, default=20000, help="Number of messages.")
+    parser.add_argument(
+        "rates",
+        nargs="*",
+        type=int,
+        default=[0],
+        help="Replay rates to measure, 0 is unlimited.",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    broker = mqtt_bench.Broker()
+    broker.start()
+    for replay_rate in args.rates:
+        r = bench(broker, replay_rate, args.n)
+        print(
+            f"replay_rate={replay_rate} n={args.n} append={r['append']:,.0f}/s "
+            + f"recover={r['recover'] * 1000:,.1f}ms replay={r['replay']:,.0f}/s"
+        )
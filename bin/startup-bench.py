@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas@vitvar.com
+
+"""
+Startup benchmark of ja2mqtt with and without the configuration cache.
+
+The benchmark generates a configuration with a topology of the given number of peripherals
+(and one section per eight peripherals) that uses the ja2mqtt definition in the config
+directory, and measures the time to read and validate the configuration and create the
+bridge when the cache is empty (cold) and when the cache has entries of all files (warm).
+It also reports durations of startup phases of the cold start. The `--pure` option uses
+the pure Python YAML loader instead of the libyaml loader. The `--loads` option reads the
+configuration the given number of times without the cache and reports the time of a read
+in batches of reads, which should stay flat in a long-running process.
+
+Before the benchmark, it checks that the libyaml and the pure Python loaders, with and
+without the cache, read the same configuration from a template that uses the `!py` and
+`!env` tags, environment variables in plain (not quoted) strings, and a Jinja2 loop and include.
+The `--check` option only runs the check. It exits with a non-zero status when the check fails.
+
+    python bin/startup-bench.py 8 128 1024
+    python bin/startup-bench.py --pure 8 128 1024
+    python bin/startup-bench.py --loads 500 8
+    python bin/startup-bench.py --check
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import ja2mqtt.config as ja2mqtt_config  # noqa: E402
+from ja2mqtt.components import SerialMQTTBridge  # noqa: E402
+from ja2mqtt.config import Config, format_timings  # noqa: E402
+from ja2mqtt.utils import Map, PythonExpression  # noqa: E402
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "config")
+
+# the template of the loader check and its expected configuration
+CHECK_TEMPLATE = """
+version: "1.0"
+address: ${CHECK_HOST}:${CHECK_PORT}
+explicit: !env "host-${CHECK_HOST}"
+plain: no variables
+expr: !py data.value + 1
+expr_env: !py "'${CHECK_HOST}'.upper()"
+sections:
+{% for s in topology.section %}
+  - name: {{ s.name }}
+    code: {{ s.code }}
+    read: !py section_state('STATE ({{ s.code }}) (READY|ARMED)',1,2)
+{% endfor %}
+values:
+  - 1
+  - 2.5
+  - true
+  - null
+  - ${CHECK_PORT}
+  - "${CHECK_PORT} is quoted"
+{% include "%s" %}
+"""
+CHECK_INCLUDE = """
+included:
+  name: {{ topology.section[0].name }}
+  port: !env "${CHECK_PORT}"
+"""
+CHECK_EXPECTED = {
+    "version": "1.0",
+    "address": "localhost:1883",
+    "explicit": "host-localhost",
+    "plain": "no variables",
+    "expr": ("!py", "data.value + 1", 2),
+    "expr_env": ("!py", "'localhost'.upper()", "LOCALHOST"),
+    "sections": [
+        {
+            "name": name,
+            "code": code,
+            "read": (
+                "!py",
+                f"section_state('STATE ({code}) (READY|ARMED)',1,2)",
+                (f"STATE ({code}) (READY|ARMED)", 1, 2),
+            ),
+        }
+        for name, code in (("house", 1), ("garage", 2))
+    ],
+    "included": {"name": "house", "port": "1883"},
+    "values": [1, 2.5, True, None, "1883", "${CHECK_PORT} is quoted"],
+}
+
+
+def write_config(config_dir, peripherals):
+    """
+    Write the configuration with the topology of `peripherals` peripherals to the `config_dir`
+    directory and return the path of the configuration file.
+    """
+    with open(os.path.join(CONFIG_DIR, "ja2mqtt.yaml")) as f:
+        definition = f.read().replace(
+            "prfstate_bits: 24", f"prfstate_bits: {max(24, peripherals)}"
+        )
+    with open(os.path.join(config_dir, "ja2mqtt.yaml"), "w") as f:
+        f.write(definition)
+
+    config = {
+        "version": "1.0",
+        "ja2mqtt": "ja2mqtt.yaml",
+        "logs": "logs",
+        "mqtt-broker": {"address": "localhost", "port": 1883},
+        "serial": {"use_simulator": True, "port": "/dev/ttyUSB0"},
+        "topology": {
+            "section": [
+                {"name": f"section{i}", "code": i}
+                for i in range(1, (peripherals + 7) // 8 + 1)
+            ],
+            "peripheral": [
+                {"name": f"area{i // 8}/motion{i}", "type": "motion", "pos": i}
+                for i in range(peripherals)
+            ],
+        },
+    }
+    config_file = os.path.join(config_dir, "config.yaml")
+    with open(config_file, "w") as f:
+        yaml.safe_dump(config, f)
+    return config_file
+
+
+def plain(value):
+    """
+    Return the configuration where Python expressions are replaced with tuples of the tag,
+    the expression and the value of the expression evaluated with the check scope.
+    """
+    if isinstance(value, PythonExpression):
+        scope = dict(data=Map(value=1), section_state=lambda *x: x)
+        return ("!py", value.expr_str, value.eval(scope))
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [plain(x) for x in value]
+    return value
+
+
+def check_loaders():
+    """
+    Read the check template with both loaders without and with the cache (when the cache
+    entry is written and when it is read) and compare the results with the expected
+    configuration. Return True when all results are as expected.
+    """
+    config_dir = tempfile.mkdtemp(prefix="ja2mqtt-check-")
+    loader, cache_dir = ja2mqtt_config.YAML_LOADER, ja2mqtt_config.CACHE_DIR
+    ok = True
+    try:
+        include_file = os.path.join(config_dir, "include.yaml")
+        with open(include_file, "w") as f:
+            f.write(CHECK_INCLUDE)
+        config_file = os.path.join(config_dir, "check.yaml")
+        with open(config_file, "w") as f:
+            f.write(CHECK_TEMPLATE.replace('"%s"', f'"{include_file}"'))
+        env_file = os.path.join(config_dir, "check.env")
+        with open(env_file, "w") as f:
+            f.write("CHECK_HOST=localhost\nCHECK_PORT=1883\n")
+        scope = dict(
+            topology=dict(
+                section=[dict(name="house", code=1), dict(name="garage", code=2)]
+            )
+        )
+        for loader_class in (ja2mqtt_config.ConfigLoader, ja2mqtt_config.CConfigLoader):
+            ja2mqtt_config.YAML_LOADER = loader_class
+            ja2mqtt_config.CACHE_DIR = os.path.join(
+                config_dir, "cache-" + loader_class.__name__
+            )
+            for run in ("no cache", "cache write", "cache read"):
+                if run == "no cache":
+                    ja2mqtt_config.CACHE_DIR, cache = None, ja2mqtt_config.CACHE_DIR
+                ja2mqtt_config.TIMINGS.clear()
+                config = Config(config_file, env_file, scope=scope, use_template=True)
+                if run == "no cache":
+                    ja2mqtt_config.CACHE_DIR = cache
+                # the configuration is only parsed when it is not read from the cache
+                result = plain(config.raw_config) == CHECK_EXPECTED and (
+                    "parse" in ja2mqtt_config.TIMINGS
+                ) == (run != "cache read")
+                ok = ok and result
+                print(
+                    f"{'PASS' if result else 'FAIL'} {loader_class.__name__} {run}"
+                    + ("" if result else f": {plain(config.raw_config)}")
+                )
+    finally:
+        ja2mqtt_config.YAML_LOADER, ja2mqtt_config.CACHE_DIR = loader, cache_dir
+        shutil.rmtree(config_dir)
+    return ok
+
+
+def startup(config_file):
+    """
+    Read and validate the configuration and create the bridge. Return the time in seconds.
+    """
+    ja2mqtt_config.TIMINGS.clear()
+    start_time = time.perf_counter()
+    config = Config(config_file, None, schema="config-schema.yaml")
+    config.validate()
+    SerialMQTTBridge(config)
+    return time.perf_counter() - start_time
+
+
+def repeated_loads(config_file, n, batch=100):
+    """
+    Read the configuration `n` times without the cache. Return a list of average times
+    of a read in milliseconds for batches of `batch` reads.
+    """
+    cache_dir, ja2mqtt_config.CACHE_DIR = ja2mqtt_config.CACHE_DIR, None
+    result = []
+    for _ in range(n // batch):
+        start_time = time.perf_counter()
+        for _ in range(batch):
+            Config(config_file, None, schema="config-schema.yaml")
+        result.append((time.perf_counter() - start_time) / batch * 1000)
+    ja2mqtt_config.CACHE_DIR = cache_dir
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "-r", type=int, default=3, help="Number of warm starts to average."
+    )
+    parser.add_argument(
+        "--pure",
+        action="store_true",
+        default=False,
+        help="Use the pure Python YAML loader.",
+    )
+    parser.add_argument(
+        "--loads",
+        type=int,
+        default=0,
+        help="Number of repeated reads of the configuration to measure.",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        default=False,
+        help="Only check that the loaders read the same configuration.",
+    )
+    parser.add_argument(
+        "sizes",
+        nargs="*",
+        type=int,
+        default=[8, 32, 128],
+        help="Numbers of peripherals to measure.",
+    )
+    args = parser.parse_args()
+    if not check_loaders():
+        sys.exit(1)
+    if args.check:
+        sys.exit(0)
+    if args.pure:
+        ja2mqtt_config.YAML_LOADER = ja2mqtt_config.ConfigLoader
+
+    print(f"loader={ja2mqtt_config.YAML_LOADER.__name__}")
+    for peripherals in args.sizes:
+        config_dir = tempfile.mkdtemp(prefix="ja2mqtt-startup-")
+        ja2mqtt_config.CACHE_DIR = os.path.join(config_dir, "cache")
+        config_file = write_config(config_dir, peripherals)
+        cold = startup(config_file)
+        cold_timings = dict(ja2mqtt_config.TIMINGS)
+        warm = sum(startup(config_file) for _ in range(args.r)) / args.r
+        print(
+            f"peripherals={peripherals:<5d} cold={cold * 1000:,.1f}ms "
+            + f"warm={warm * 1000:,.1f}ms speedup={cold / warm:.1f}x"
+        )
+        print(f"  cold phases: {format_timings(cold_timings)}")
+        if args.loads:
+            times = repeated_loads(config_file, args.loads)
+            print("  repeated reads: " + " ".join(f"{x:.2f}ms" for x in times))
+        shutil.rmtree(config_dir)
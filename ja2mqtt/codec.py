@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas@vitvar.com
+
+from __future__ import absolute_import, unicode_literals
+
+import importlib
+import json
+from abc import ABC, abstractmethod
+
+from ja2mqtt.utils import JSONEmitter
+
+
+class PayloadCodec(ABC):
+    """
+    PayloadCodec encodes data of events to MQTT payloads and decodes MQTT payloads of requests.
+    The binary codecs use Python packages that ja2mqtt does not require, they are installed
+    with the extras of ja2mqtt named after the codecs, and the package is imported when
+    the codec is used for the first time.
+    """
+
+    name = None
+    package = None
+    binary = True
+
+    def __init__(self):
+        self.module = None
+        if self.package is not None:
+            try:
+                self.module = importlib.import_module(self.package)
+            except ImportError:
+                raise Exception(
+                    f"The payload codec '{self.name}' requires the Python package '{self.package}'. "
+                    + f"Install it using 'pip install ja2mqtt[{self.name}]'."
+                )
+
+    @abstractmethod
+    def encode(self, data):
+        pass
+
+    @abstractmethod
+    def decode(self, payload):
+        pass
+
+    def emit(self, emitter, scope, data=None):
+        """
+        Emit the payload of the `emitter` for the scope. Return a tuple `(parts, payload)`
+        where `parts` is a list of `(key, value)` of properties of the payload.
+        """
+        parts = emitter.values(scope, data)
+        return parts, self.encode(dict(parts))
+
+
+class JSONCodec(PayloadCodec):
+    name = "json"
+    binary = False
+
+    def encode(self, data):
+        return json.dumps(data)
+
+    def decode(self, payload):
+        return json.loads(payload)
+
+    def emit(self, emitter, scope, data=None):
+        # the parts are JSON strings of properties, the template is serialized at compile time
+        parts = emitter.parts(scope, data)
+        return parts, JSONEmitter.join(parts)
+
+
+class CBORCodec(PayloadCodec):
+    name = "cbor"
+    package = "cbor2"
+
+    def encode(self, data):
+        return self.module.dumps(data)
+
+    def decode(self, payload):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        return self.module.loads(payload)
+
+
+class MsgPackCodec(PayloadCodec):
+    name = "msgpack"
+    package = "msgpack"
+
+    def encode(self, data):
+        return self.module.packb(data, use_bin_type=True)
+
+    def decode(self, payload):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        return self.module.unpackb(payload, raw=False)
+
+
+CODECS = {x.name: x for x in [JSONCodec, CBORCodec, MsgPackCodec]}
+
+# codec instances by names
+_codecs = {}
+
+
+def get_codec(name):
+    """
+    Return the payload codec with the name.
+    """
+    codec = _codecs.get(name)
+    if codec is None:
+        if name not in CODECS:
+            raise Exception(
+                f"Invalid payload codec '{name}'! "
+                + f"The value must be one of {', '.join(CODECS.keys())}."
+            )
+        codec = CODECS[name]()
+        _codecs[name] = codec
+    return codec
+
+
+def display_payload(payload, codec):
+    """
+    Return the payload as a string for display. Binary payloads are displayed as JSON.
+    """
+    if not codec.binary:
+        return payload if isinstance(payload, str) else payload.decode("utf-8")
+    try:
+        return json.dumps(codec.decode(payload), default=str)
+    except Exception:
+        return repr(payload)
@@ -14,18 +14,26 @@ from ja2mqtt.config import Config, init_logging
 
 
 class BaseCommand(click.core.Command):
+    # the command reads the main configuration given by the --config option
+    use_config = True
+
+    # the name of the log file and the handlers of the log
+    log_name = "run"
+    log_handlers = ["file", "console"]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.params.insert(
-            0,
-            Option(
-                ("-c", "--config"),
-                metavar="<file>",
-                required=True,
-                help="Configuration file",
-                default=ja2mqtt_config.CONFIG_FILE,
-            ),
-        )
+        if self.use_config:
+            self.params.insert(
+                0,
+                Option(
+                    ("-c", "--config"),
+                    metavar="<file>",
+                    required=True,
+                    help="Configuration file",
+                    default=ja2mqtt_config.CONFIG_FILE,
+                ),
+            )
         self.params.insert(
             0,
             Option(
@@ -37,23 +45,33 @@ class BaseCommand(click.core.Command):
             ),
         )
 
-    def init_logging(self, config):
-        init_logging(
-            config.get_dir_path(config.root("logs")),
-            "run",
-            log_level="DEBUG" if ja2mqtt_config.DEBUG else "INFO",
-        )
+    def read_config(self, params):
+        """
+        Read and validate the main configuration from the options of the command in `params`.
+        """
+        config_file = params.pop("config")
+        env_file = params.pop("env")
+        config = Config(config_file, env_file, schema="config-schema.yaml")
+        self.validate_config(config)
+        return config
 
     def validate_config(self, config):
         config.validate()
 
-    def invoke(self, ctx):
-        config_file = ctx.params.pop("config")
-        env_file = ctx.params.pop("env")
-        config = Config(config_file, env_file, schema="config-schema.yaml")
-        self.validate_config(config)
+    def logs_dir(self, config, params):
+        return config.get_dir_path(config.root("logs"))
+
+    def init_logging(self, config, params):
+        init_logging(
+            self.logs_dir(config, params),
+            self.log_name,
+            log_level="DEBUG" if ja2mqtt_config.DEBUG else "INFO",
+            handlers=self.log_handlers,
+        )
 
-        self.init_logging(config)
+    def invoke(self, ctx):
+        config = self.read_config(ctx.params)
+        self.init_logging(config, ctx.params)
         log = logging.getLogger(ctx.command.name + "-loop")
         log.info(f"ja2mqtt, Jablotron JA-121 Serial MQTT bridge, version {__version__}")
 
@@ -63,13 +81,7 @@ class BaseCommand(click.core.Command):
 
 
 class BaseCommandLogOnly(BaseCommand):
-    def init_logging(self, config):
-        init_logging(
-            config.get_dir_path(config.root("logs")),
-            "run",
-            log_level="DEBUG" if ja2mqtt_config.DEBUG else "INFO",
-            handlers=["file"],
-        )
+    log_handlers = ["file"]
 
 
 class BaseCommandLogOnlyNoValidate(BaseCommandLogOnly):
@@ -28,13 +28,16 @@ def config_main(config, log):
     "ja2mqtt", help="Show the ja2mqtt definition configuration.", cls=BaseCommandLogOnly
 )
 def config_ja2mqtt(config, log):
-    ja2mqtt_file = config.get_dir_path(config.root("ja2mqtt"))
-    scope = Map(topology=config.root("topology"))
-    ja2mqtt = Config(
-        ja2mqtt_file, scope=scope, use_template=True, schema="ja2mqtt-schema.yaml"
-    )
-    ja2mqtt.validate(throw_ex=True)
-    print(json.dumps(ja2mqtt.root._config, indent=4, default=str))
+    for panel in config.panels():
+        ja2mqtt_file = panel.get_dir_path(panel.root("ja2mqtt"))
+        scope = Map(topology=panel.root("topology"))
+        ja2mqtt = Config(
+            ja2mqtt_file, scope=scope, use_template=True, schema="ja2mqtt-schema.yaml"
+        )
+        ja2mqtt.validate(throw_ex=True)
+        if panel.panel_name is not None:
+            print(f"Panel {panel.panel_name}:")
+        print(json.dumps(ja2mqtt.root._config, indent=4, default=str))
 
 
 @click.command("env", help="Show environment varialbes.")
@@ -48,16 +51,19 @@ def config_env():
 
 @click.command("topics", help="Show MQTT topics.", cls=BaseCommandLogOnly)
 def config_topics(config, log):
-    ja2mqtt_file = config.get_dir_path(config.root("ja2mqtt"))
-    scope = Map(topology=config.root("topology"))
-    ja2mqtt = Config(ja2mqtt_file, scope=scope, use_template=True)
+    for panel in config.panels():
+        ja2mqtt_file = panel.get_dir_path(panel.root("ja2mqtt"))
+        scope = Map(topology=panel.root("topology"))
+        ja2mqtt = Config(ja2mqtt_file, scope=scope, use_template=True)
 
-    print("Publishing:")
-    for t in ja2mqtt("serial2mqtt"):
-        print(f"- {t['name']}")
-    print("Subscribing:")
-    for t in ja2mqtt("mqtt2serial"):
-        print(f"- {t['name']}")
+        if panel.panel_name is not None:
+            print(f"Panel {panel.panel_name}:")
+        print("Publishing:")
+        for t in ja2mqtt("serial2mqtt"):
+            print(f"- {t['name']}")
+        print("Subscribing:")
+        for t in ja2mqtt("mqtt2serial"):
+            print(f"- {t['name']}")
 
 
 @click.command(
@@ -78,13 +84,17 @@ def config_validate(config, log):
     res, errors = config.validate(throw_ex=False)
     _display_validation(res, errors, config.config_file)
     try:
-        ja2mqtt_file = config.get_dir_path(config.root("ja2mqtt"))
-        scope = Map(topology=config.root("topology"))
-        ja2mqtt = Config(
-            ja2mqtt_file, scope=scope, use_template=True, schema="ja2mqtt-schema.yaml"
-        )
-        res, errors = ja2mqtt.validate(throw_ex=False)
-        _display_validation(res, errors, ja2mqtt_file)
+        for panel in config.panels():
+            ja2mqtt_file = panel.get_dir_path(panel.root("ja2mqtt"))
+            scope = Map(topology=panel.root("topology"))
+            ja2mqtt = Config(
+                ja2mqtt_file,
+                scope=scope,
+                use_template=True,
+                schema="ja2mqtt-schema.yaml",
+            )
+            res, errors = ja2mqtt.validate(throw_ex=False)
+            _display_validation(res, errors, ja2mqtt_file)
     except:
         _display_validation(False, None, None)
 
@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas@vitvar.com
+
+from __future__ import absolute_import, unicode_literals
+
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from queue import Empty
+
+import click
+
+import ja2mqtt.config as ja2mqtt_config
+from ja2mqtt import __version__
+from ja2mqtt.config import Config, init_logging
+from ja2mqtt.utils import Map
+
+from . import BaseCommand
+from .run import create_components
+
+# restart backoff of crashed workers in seconds
+RESTART_BACKOFF = 1
+RESTART_BACKOFF_MAX = 300
+
+# a worker that runs longer than this time in seconds is considered stable
+# and its next crash is restarted with the initial backoff
+STABLE_TIME = 600
+
+
+def find_installations(configs_dir, pattern, default_env_file, log):
+    """
+    Return a list of (config_file, env_file) tuples of installations in the `configs_dir` directory.
+    A file that matches the `pattern` is a configuration of an installation when it is a main
+    configuration, other files such as ja2mqtt definitions are skipped. The environment file
+    of the installation is a file with the same name and `.env` extension if it exists,
+    otherwise it is the `default_env_file`.
+    """
+    installations = []
+    for config_file in sorted(glob.glob(os.path.join(configs_dir, pattern))):
+        env_file = os.path.splitext(config_file)[0] + ".env"
+        env_file = env_file if os.path.exists(env_file) else default_env_file
+        try:
+            config = Config(config_file, env_file, schema="config-schema.yaml")
+        except Exception as e:
+            log.debug(f"The file {config_file} is skipped. {str(e)}")
+            continue
+        if (
+            not isinstance(config.raw_config, dict)
+            or "mqtt-broker" not in config.raw_config
+        ):
+            continue
+        try:
+            config.validate()
+        except Exception as e:
+            log.error(f"The installation {config_file} will not run. {str(e)}")
+            continue
+        installations.append((config_file, env_file))
+    return installations
+
+
+class RestartBackoff:
+    """
+    RestartBackoff holds restarts of a fleet worker or an installation and computes
+    the exponential backoff of the next restart.
+    """
+
+    def __init__(self):
+        self.started = None
+        self.failures = 0
+        self.restarts = 0
+        self.restart_at = None
+
+    def backoff(self):
+        """
+        Register the crash and return the time in seconds after which the worker or
+        the installation should be restarted.
+        """
+        if self.started is not None and time.time() - self.started > STABLE_TIME:
+            self.failures = 0
+        self.failures += 1
+        return min(RESTART_BACKOFF_MAX, RESTART_BACKOFF * 2 ** (self.failures - 1))
+
+
+class Installation(RestartBackoff):
+    """
+    Installation is a bridge of one installation run by a fleet worker. Components of the
+    installation run with their own exit event so that the installation can be stopped and
+    restarted when one of its components ends or when it cannot start.
+    """
+
+    def __init__(self, config_file, env_file):
+        super().__init__()
+        self.config_file = config_file
+        self.env_file = env_file
+        self.name = os.path.basename(config_file)
+        self.exit_event = None
+        self.mqtt = None
+        self.panels = []
+        self.components = []
+        self.error = None
+        self.start_failures = 0
+
+    def start(self, runtime, log):
+        """
+        Start the components of the installation. When the installation cannot start,
+        the components that were started are stopped.
+        """
+        self.started = time.time()
+        self.exit_event = threading.Event()
+        self.components = []
+        try:
+            config = Config(
+                self.config_file, self.env_file, schema="config-schema.yaml"
+            )
+            config.validate()
+            self.mqtt, self.panels, self.components = create_components(
+                config, log, runtime
+            )
+            for x in self.components:
+                x.start(self.exit_event)
+        except Exception:
+            self.stop()
+            raise
+
+    def ended(self):
+        """
+        Return a list of components of the running installation whose threads ended.
+        """
+        return [x for x in self.components if not x.is_alive()]
+
+    def stop(self):
+        if self.exit_event is not None:
+            self.exit_event.set()
+        for x in self.components:
+            x.join()
+
+
+def installation_health(installation):
+    """
+    Return health and metrics of an installation.
+    """
+    if installation.error is not None:
+        return Map(name=installation.name, error=installation.error)
+    running = installation.restart_at is None
+    return Map(
+        name=installation.name,
+        alive=running and len(installation.ended()) == 0,
+        restarts=installation.restarts,
+        start_failures=installation.start_failures,
+        components=[
+            Map(name=x.name, alive=running and x.is_alive())
+            for x in installation.components
+        ],
+        mqtt_connected=running and installation.mqtt.connected,
+        panels=[
+            Map(
+                name=bridge.config.panel_name,
+                serial_ready=running and serial.is_ready(),
+                metrics=serial.metrics(),
+            )
+            for serial, bridge in installation.panels
+        ],
+    )
+
+
+def start_installation(installation, runtime, start_retries, log):
+    """
+    Start the installation. When it cannot start, its next start is scheduled with a backoff,
+    unless it failed to start more than `start_retries` times in a row (0 means no limit).
+    """
+    try:
+        installation.start(runtime, log)
+        installation.start_failures = 0
+        installation.restart_at = None
+        return True
+    except Exception as e:
+        installation.start_failures += 1
+        if start_retries > 0 and installation.start_failures > start_retries:
+            log.error(
+                f"The installation {installation.name} cannot run. {str(e)} "
+                + f"It failed to start {installation.start_failures} times, it will not be started again."
+            )
+            installation.error = str(e)
+        else:
+            backoff = installation.backoff()
+            log.error(
+                f"The installation {installation.name} cannot run. {str(e)} "
+                + f"It will be started again in {backoff} seconds."
+            )
+            installation.restart_at = time.time() + backoff
+        return False
+
+
+def fleet_worker(
+    index,
+    installations,
+    runtime,
+    logs_dir,
+    debug,
+    status_queue,
+    interval,
+    start_retries,
+):
+    """
+    The worker process that runs bridges of the `installations` and reports their health
+    and metrics to the `status_queue` every `interval` seconds. An installation whose component
+    ends or that cannot start is stopped and started again with a backoff.
+    """
+    exit_event = ja2mqtt_config.exit_event
+    for sig in ("TERM", "HUP", "INT"):
+        signal.signal(getattr(signal, "SIG" + sig), lambda x, y: exit_event.set())
+    init_logging(
+        logs_dir,
+        f"fleet-{index}",
+        log_level="DEBUG" if debug else "INFO",
+        handlers=["file"],
+    )
+    log = logging.getLogger(f"fleet-{index}")
+    log.info(f"ja2mqtt fleet worker {index}, version {__version__}")
+
+    running = []
+    for config_file, env_file in installations:
+        installation = Installation(config_file, env_file)
+        if start_installation(installation, runtime, start_retries, log):
+            log.info(f"The installation {installation.name} was started.")
+        running.append(installation)
+
+    last_report = None
+    try:
+        while not exit_event.is_set():
+            now = time.time()
+            for x in running:
+                if x.error is not None:
+                    continue
+                if x.restart_at is None:
+                    ended = x.ended()
+                    if len(ended) > 0:
+                        backoff = x.backoff()
+                        log.error(
+                            f"The component {', '.join(c.name for c in ended)} of the installation "
+                            + f"{x.name} ended. The installation will be restarted in {backoff} seconds."
+                        )
+                        x.stop()
+                        x.restart_at = now + backoff
+                elif now >= x.restart_at:
+                    if start_installation(x, runtime, start_retries, log):
+                        x.restarts += 1
+                        log.info(f"The installation {x.name} was restarted.")
+
+            if last_report is None or now - last_report >= interval:
+                last_report = now
+                # reports are sent as json, Map objects cannot be pickled
+                report = Map(
+                    worker=index,
+                    pid=os.getpid(),
+                    time=now,
+                    installations=[installation_health(x) for x in running],
+                )
+                status_queue.put(json.dumps(report, default=str))
+            exit_event.wait(min(1, interval))
+    finally:
+        for x in running:
+            x.stop()
+        log.info("Fleet worker ended.")
+
+
+class FleetWorker(RestartBackoff):
+    """
+    FleetWorker is a worker process of the fleet supervisor with a shard of installations.
+    """
+
+    def __init__(self, index, installations):
+        super().__init__()
+        self.index = index
+        self.installations = installations
+        self.process = None
+
+    def start(self, context, args):
+        self.process = context.Process(
+            target=fleet_worker, args=(self.index, self.installations) + args
+        )
+        self.process.start()
+        self.started = time.time()
+
+
+def fleet_status(workers, status, interval):
+    """
+    Aggregate the latest health reports of workers. A report that is older than two report
+    intervals is stale and its installations are not counted as connected or ready.
+    """
+    now = time.time()
+    installations = []
+    for index, report in sorted(status.items()):
+        stale = now - report.time > 2 * interval
+        for x in report.installations:
+            installations.append(Map(x, worker=index, stale=stale))
+    live = [x for x in installations if not x.stale and x.error is None]
+    return Map(
+        time=now,
+        workers=[
+            Map(
+                index=w.index,
+                pid=w.process.pid if w.process is not None else None,
+                alive=w.process is not None and w.process.is_alive(),
+                restarts=w.restarts,
+                installations=[os.path.basename(x[0]) for x in w.installations],
+            )
+            for w in workers
+        ],
+        installations=installations,
+        summary=Map(
+            installations=len(installations),
+            mqtt_connected=len([x for x in live if x.mqtt_connected]),
+            serial_ready=len(
+                [x for x in live if all(p.serial_ready for p in x.panels)]
+            ),
+            errors=len([x for x in installations if x.error is not None]),
+            not_alive=len([x for x in live if not x.alive]),
+            installation_restarts=sum(x.get("restarts", 0) for x in installations),
+            dropped_lines=sum(
+                p.metrics.buffer.get("dropped", 0)
+                for x in installations
+                for p in x.get("panels", [])
+            ),
+        ),
+    )
+
+
+class FleetCommand(BaseCommand):
+    """
+    The fleet command does not have a main configuration, the environment file is the default
+    environment file of installations and logs are written to the logs directory of the fleet.
+    """
+
+    use_config = False
+    log_name = "fleet"
+
+    def read_config(self, params):
+        return None
+
+    def logs_dir(self, config, params):
+        if params["logs_dir"] is not None:
+            return params["logs_dir"]
+        return os.path.join(params["configs_dir"], "logs")
+
+
+@click.command("fleet", help="Run bridges of many installations.", cls=FleetCommand)
+@click.option(
+    "-d",
+    "--dir",
+    "configs_dir",
+    metavar="<dir>",
+    required=True,
+    help="Directory with configuration files of installations.",
+)
+@click.option(
+    "-p",
+    "--pattern",
+    "pattern",
+    metavar="<pattern>",
+    default="*.yaml",
+    help="Pattern of configuration files in the directory (default is *.yaml).",
+)
+@click.option(
+    "-w",
+    "--workers",
+    "workers",
+    metavar="<number>",
+    type=int,
+    default=None,
+    help="Number of worker processes. The default is the number of CPUs.",
+)
+@click.option(
+    "--runtime",
+    "runtime",
+    type=click.Choice(["threads", "asyncio"]),
+    default="threads",
+    help="Run the components in threads (default) or in a single asyncio event loop.",
+)
+@click.option(
+    "--logs",
+    "logs_dir",
+    metavar="<dir>",
+    default=None,
+    help="Directory for logs. The default is the logs directory in the configuration directory.",
+)
+@click.option(
+    "--report",
+    "interval",
+    metavar="<seconds>",
+    type=float,
+    default=60,
+    help="Interval of health reports (default is 60 seconds).",
+)
+@click.option(
+    "--status",
+    "status_file",
+    metavar="<file>",
+    default=None,
+    help="File where the aggregated status of the fleet is written.",
+)
+@click.option(
+    "--start-retries",
+    "start_retries",
+    metavar="<number>",
+    type=int,
+    default=10,
+    help="Number of failed starts in a row after which an installation is not started again "
+    + "(default is 10, 0 means no limit).",
+)
+def command_fleet(
+    env,
+    configs_dir,
+    pattern,
+    workers,
+    runtime,
+    logs_dir,
+    interval,
+    status_file,
+    start_retries,
+    config,
+    log,
+):
+    exit_event = ja2mqtt_config.exit_event
+    logs_dir = logs_dir if logs_dir is not None else os.path.join(configs_dir, "logs")
+
+    installations = find_installations(configs_dir, pattern, env, log)
+    if len(installations) == 0:
+        raise Exception(f"There are no installations in {configs_dir}!")
+
+    # shard installations across workers
+    n = min(workers or os.cpu_count() or 1, len(installations))
+    fleet = [FleetWorker(i, installations[i::n]) for i in range(n)]
+    log.info(f"Running {len(installations)} installations in {n} worker processes.")
+
+    context = multiprocessing.get_context()
+    status_queue = context.Queue()
+    args = (
+        runtime,
+        logs_dir,
+        ja2mqtt_config.DEBUG,
+        status_queue,
+        interval,
+        start_retries,
+    )
+    for w in fleet:
+        w.start(context, args)
+
+    status = {}
+    last_report = time.time()
+    try:
+        while not exit_event.is_set():
+            # wait for reports and read all that are available
+            try:
+                data = status_queue.get(timeout=1)
+                while True:
+                    report = json.loads(data, object_hook=Map)
+                    status[report.worker] = report
+                    data = status_queue.get_nowait()
+            except Empty:
+                pass
+
+            now = time.time()
+            for w in fleet:
+                if w.process is not None and not w.process.is_alive():
+                    if exit_event.is_set():
+                        break
+                    backoff = w.backoff()
+                    log.error(
+                        f"The worker {w.index} ended with exit code {w.process.exitcode}. "
+                        + f"It will be restarted in {backoff} seconds."
+                    )
+                    w.process = None
+                    w.restart_at = now + backoff
+                elif w.process is None and now >= w.restart_at:
+                    w.restarts += 1
+                    w.start(context, args)
+                    log.info(f"The worker {w.index} was restarted.")
+
+            if now - last_report >= interval:
+                last_report = now
+                s = fleet_status(fleet, status, interval)
+                log.info(
+                    f"The fleet status: {s.summary.installations} installations, "
+                    + f"{s.summary.mqtt_connected} connected to MQTT, {s.summary.serial_ready} with "
+                    + f"serial ready, {s.summary.errors} errors, {s.summary.not_alive} not alive, "
+                    + f"{s.summary.dropped_lines} dropped lines, {s.summary.installation_restarts} "
+                    + f"installation restarts, {sum(w.restarts for w in fleet)} worker restarts."
+                )
+                if status_file is not None:
+                    with open(status_file, "w") as f:
+                        json.dump(s, f, indent=4, default=str)
+    finally:
+        for w in fleet:
+            if w.process is not None and w.process.is_alive():
+                w.process.terminate()
+        for w in fleet:
+            if w.process is not None:
+                w.process.join()
+        log.info("Done.")
@@ -12,6 +12,7 @@ import click
 import ja2mqtt.config as ja2mqtt_config
 from ja2mqtt import __version__
 from ja2mqtt.commands.config import command_config
+from ja2mqtt.commands.fleet import command_fleet
 from ja2mqtt.commands.run import command_run
 from ja2mqtt.commands.query import command_publish, command_states
 from ja2mqtt.utils import bcolors, format_str_color
@@ -21,6 +22,8 @@ class CoreCommand(click.core.Group):
     def invoke(self, ctx):
         ja2mqtt_config.ANSI_COLORS = not ctx.params.get("no-ansi", False)
         ja2mqtt_config.DEBUG = ctx.params.get("debug", False)
+        if ctx.params.get("no_cache", False):
+            ja2mqtt_config.CACHE_DIR = None
         try:
             for sig in ("TERM", "HUP", "INT"):
                 signal.signal(
@@ -49,8 +52,15 @@ class CoreCommand(click.core.Group):
 @click.group(cls=CoreCommand)
 @click.option("--no-ansi", "no_ansi", is_flag=True, default=False, help="No colors.")
 @click.option("-d", "--debug", "debug", is_flag=True, default=False, help="Be verbose.")
+@click.option(
+    "--no-cache",
+    "no_cache",
+    is_flag=True,
+    default=False,
+    help="Do not use the cache of parsed configuration files.",
+)
 @click.version_option(version=__version__)
-def ja2mqtt(debug, no_ansi):
+def ja2mqtt(debug, no_ansi, no_cache):
     pass
 
 
@@ -58,3 +68,4 @@ ja2mqtt.add_command(command_run)
 ja2mqtt.add_command(command_config)
 ja2mqtt.add_command(command_publish)
 ja2mqtt.add_command(command_states)
+ja2mqtt.add_command(command_fleet)
@@ -6,9 +6,10 @@ from __future__ import absolute_import, unicode_literals
 import json
 import logging
 import sys
+import threading
 import time
 
-#from datetime import datetime, timezone, timedelta
+# from datetime import datetime, timezone, timedelta
 import datetime
 
 import pytz
@@ -17,6 +18,7 @@ import click
 
 import ja2mqtt.config as ja2mqtt_config
 from ja2mqtt import __version__ as version
+from ja2mqtt.codec import display_payload
 from ja2mqtt.components import MQTT, SerialMQTTBridge, JA2MQTTConfig
 from ja2mqtt.config import Config, init_logging
 from ja2mqtt.utils import Map, dict_from_string, randomString
@@ -53,9 +55,12 @@ from . import BaseCommandLogOnly
     help="Timeout to wait for responses. The default is correlation timeout from the ja2mqtt configuration.",
 )
 def command_publish(config, topic, data, log, timeout):
-    bridge = SerialMQTTBridge(config)
-    _topic = next(filter(lambda x: x.name == topic, bridge.topics_mqtt2serial), None)
-    if _topic is None:
+    bridge = None
+    for panel in config.panels():
+        bridge = SerialMQTTBridge(panel)
+        if bridge.topic_exists(topic):
+            break
+    else:
         raise Exception(
             f"The topic with name '{topic}' does not exist in the ja2mqtt definition file!"
         )
@@ -64,27 +69,48 @@ def command_publish(config, topic, data, log, timeout):
     for d in data:
         _data = dict_from_string(d, _data)
 
+    mqtt = MQTT(f"ja2mqtt-test-{randomString(5)}", config.get_part("mqtt-broker"))
+
+    # MQTT v5 requests are correlated by the correlation data property
     field, id = bridge.corr_id()
-    if field is not None:
+    properties = None
+    if mqtt.v5:
+        id = randomString(12, letters="abcdef0123456789")
+        properties = Map(
+            correlation_data=id.encode("utf-8"), expiry=bridge.correlation_timeout
+        )
+    elif field is not None:
         _data[field] = id
 
-    def _wait_for_response(topic, payload):
-        data = Map(json.loads(payload))
-        if field is None or data.get(field) == id:
-            print(f"--> recv: {topic}: {payload}")
+    # payloads are encoded and decoded by codecs of topics
+    codec = bridge.topic_router.route(topic)[0][0].codec
+    codecs = {x.name: x.codec for x in bridge.topics_serial2mqtt}
+
+    def _wait_for_response(topic, payload, props=None):
+        response_codec = codecs.get(topic, codec)
+        if properties is not None:
+            correlated = (
+                props is not None
+                and props.correlation_data == properties.correlation_data
+            )
+        else:
+            correlated = (
+                field is None or Map(response_codec.decode(payload)).get(field) == id
+            )
+        if correlated:
+            print(f"--> recv: {topic}: {display_payload(payload, response_codec)}")
 
     def _on_connect(client, userdata, flags, rc):
         for topic in bridge.topics_serial2mqtt:
             client.subscribe(topic.name)
 
-    mqtt = MQTT(f"ja2mqtt-test-{randomString(5)}", config.get_part("mqtt-broker"))
     mqtt.on_message_ext = _wait_for_response
     mqtt.on_connect_ext = _on_connect
     mqtt.start(ja2mqtt_config.exit_event)
     try:
         mqtt.wait_is_connected(ja2mqtt_config.exit_event)
-        print(f"<-- send: {_topic.name}: {json.dumps(_data)}")
-        mqtt.publish(_topic.name, json.dumps(_data))
+        print(f"<-- send: {topic}: {json.dumps(_data)}")
+        mqtt.publish(topic, codec.encode(_data), properties=properties)
         time.sleep(bridge.correlation_timeout if timeout is None else timeout)
     finally:
         ja2mqtt_config.exit_event.set()
@@ -139,9 +165,7 @@ class StatesTable:
             return "N/A"
 
     def add(self, topic):
-        self.data.append(
-            {"topic": topic.name, "count": 0, "updated": 0, "state": None}
-        )
+        self.data.append({"topic": topic.name, "count": 0, "updated": 0, "state": None})
 
     def topic_data(self, name):
         for inx, d in enumerate(self.data):
@@ -159,6 +183,12 @@ class StatesTable:
                     updated = True
         return updated
 
+    def complete(self):
+        """
+        Return True when states of all topics were received.
+        """
+        return all(d["state"] is not None for d in self.data)
+
     def refresh(self):
         if self.sort:
             data = sorted(self.data, key=lambda x: x["updated"], reverse=True)
@@ -169,7 +199,9 @@ class StatesTable:
             if sys.stdout.isatty():
                 print("".join(["\033[A" for i in range(len(data) + 2)]))
             else:
-                print(f"---- {datetime.datetime.now().strftime('%d-%m-%y %H:%M:%S')} ----")
+                print(
+                    f"---- {datetime.datetime.now().strftime('%d-%m-%y %H:%M:%S')} ----"
+                )
         self.table.display(data)
         self.displayed = True
 
@@ -230,27 +262,34 @@ class StatesTable:
 )
 def command_states(config, log, data, init_topic, timeout, watch, time_diff, sort):
     states = None
+    complete = threading.Event()
 
-    def _on_message(topic, payload):
-        if states.update(topic, Map(json.loads(payload))) and watch:
-            states.refresh()
+    def _on_message(topic, payload, properties=None):
+        if states.update(topic, Map(codecs[topic].decode(payload))):
+            if watch:
+                states.refresh()
+            if states.complete():
+                complete.set()
 
     def _on_connect(client, userdata, flags, rc):
         for d in states.data:
             client.subscribe(d["topic"])
 
-    # configuration
-    ja2mqtt = JA2MQTTConfig(config)
-    if init_topic is not None and not ja2mqtt.topic_exists(init_topic):
+    # configuration of all panels
+    panels = [JA2MQTTConfig(panel) for panel in config.panels()]
+    if init_topic is not None and not any(x.topic_exists(init_topic) for x in panels):
         raise Exception(f"The topic {init_topic} does not exist!")
 
-    # states table
+    # states table and codecs of topics
     states = StatesTable(time_diff, sort)
-    for topic in ja2mqtt.topics_serial2mqtt:
-        if not topic.disabled:
-            # only topics with `state` property in data payload
-            if len([x for x in [r.write for r in topic.rules] if "state" in x]) > 0:
-                states.add(topic)
+    codecs = {}
+    for ja2mqtt in panels:
+        for topic in ja2mqtt.topics_serial2mqtt:
+            codecs[topic.name] = topic.codec
+            if not topic.disabled:
+                # only topics with `state` property in data payload
+                if len([x for x in [r.write for r in topic.rules] if "state" in x]) > 0:
+                    states.add(topic)
     if watch:
         states.refresh()
 
@@ -266,11 +305,17 @@ def command_states(config, log, data, init_topic, timeout, watch, time_diff, sor
         _data = {}
         for d in data:
             _data = dict_from_string(d, _data)
-        mqtt.publish(init_topic, json.dumps(_data))
+        codec = [t.codec for x in panels for t, _ in x.topic_router.route(init_topic)][
+            0
+        ]
+        mqtt.publish(init_topic, codec.encode(_data))
 
     if not watch:
+        # retained states are received right after subscribing, do not wait for the timeout then
         click.echo("Waiting for states to be updated...")
-        time.sleep(ja2mqtt.correlation_timeout if timeout is None else timeout)
+        complete.wait(
+            max(x.correlation_timeout for x in panels) if timeout is None else timeout
+        )
         states.refresh()
     else:
         try:
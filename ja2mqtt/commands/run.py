@@ -9,35 +9,86 @@ import time
 import click
 
 import ja2mqtt.config as ja2mqtt_config
-from ja2mqtt.components import MQTT, Serial, SerialMQTTBridge, Simulator
-from ja2mqtt.config import Config, init_logging
+from ja2mqtt.components import (
+    MQTT,
+    AsyncRuntime,
+    BridgeGroup,
+    Serial,
+    SerialMQTTBridge,
+    Simulator,
+    Spool,
+)
+from ja2mqtt.config import YAML_LOADER, Config, format_timings, init_logging, timing
 from ja2mqtt.utils import Map, randomString
 
 from . import BaseCommand
 
 
-@click.command("run", help="Run command.", cls=BaseCommand)
-def command_run(config, log):
-    bridge = SerialMQTTBridge(config)
-
-    simulator = None
-    if config("simulator") is not None:
-        simulator = Simulator(config.get_part("simulator"), bridge.prfstate_bits)
-    elif config("serial.use_simulator", True):
-        log.error(
-            "The serial interface is set to be simulated but the simulator configuration does not exist!"
-        )
-
-    serial = Serial(config.get_part("serial"), simulator)
+def create_components(config, log, runtime="threads"):
+    """
+    Create the components of the bridge for the configuration. Return the MQTT client,
+    a list of (serial, bridge) tuples of panels and a list of components to be started.
+    """
+    panels = []
+    for panel in config.panels():
+        if panel.panel_name is not None:
+            log.info(f"Configuring the panel {panel.panel_name}.")
+        bridge = SerialMQTTBridge(panel)
+
+        simulator = None
+        if panel("simulator") is not None:
+            simulator = Simulator(panel.get_part("simulator"), bridge.prfstate_bits)
+        elif panel("serial.use_simulator", True):
+            log.error(
+                "The serial interface is set to be simulated but the simulator configuration does not exist!"
+            )
+
+        serial = Serial(panel.get_part("serial"), simulator)
+        bridge.set_serial(serial)
+        panels.append((serial, bridge))
+
+    # all panels share a single connection to the MQTT broker
     mqtt = MQTT(f"ja2mqtt-client+{randomString(10)}", config.get_part("mqtt-broker"))
+    if config("spool") is not None:
+        mqtt.set_spool(Spool(config.get_part("spool")))
+    if len(panels) == 1:
+        panels[0][1].set_mqtt(mqtt)
+    else:
+        BridgeGroup([bridge for _, bridge in panels]).set_mqtt(mqtt)
 
-    bridge.set_mqtt(mqtt)
-    bridge.set_serial(serial)
+    components = [mqtt] + [x for panel in panels for x in panel]
+    if runtime == "asyncio":
+        components = [AsyncRuntime(config, mqtt, panels)]
+    return mqtt, panels, components
+
+
+@click.command("run", help="Run command.", cls=BaseCommand)
+@click.option(
+    "--runtime",
+    "runtime",
+    type=click.Choice(["threads", "asyncio"]),
+    default="threads",
+    required=False,
+    help="Run the components in threads (default) or in a single asyncio event loop.",
+)
+@click.option(
+    "--timings",
+    "timings",
+    is_flag=True,
+    default=False,
+    help="Log durations of startup phases.",
+)
+def command_run(config, log, runtime, timings):
+    with timing("components"):
+        _, _, components = create_components(config, log, runtime)
+    (log.info if timings else log.debug)(
+        f"Startup timings ({YAML_LOADER.__name__}): {format_timings()}"
+    )
 
-    for x in (mqtt, serial, bridge):
+    for x in components:
         x.start(ja2mqtt_config.exit_event)
 
-    for x in (mqtt, serial, bridge):
+    for x in components:
         x.join()
 
     log.info("Done.")
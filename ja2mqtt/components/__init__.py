@@ -21,6 +21,12 @@ class Component:
         if self.thread is not None and self.thread.is_alive():
             self.thread.join()
 
+    def is_alive(self):
+        """
+        Return True when the threads of the component are running.
+        """
+        return self.thread is not None and self.thread.is_alive()
+
     def start(self, exit_event):
         self.thread = threading.Thread(
             target=self.worker, args=(exit_event,), daemon=True
@@ -28,7 +34,9 @@ class Component:
         self.thread.start()
 
 
-from .bridge import SerialMQTTBridge, JA2MQTTConfig
+from .bridge import BridgeGroup, SerialMQTTBridge, JA2MQTTConfig
 from .mqtt import MQTT
+from .runtime import AsyncRuntime
 from .serial import Serial
 from .simulator import Simulator
+from .spool import Spool
@@ -3,6 +3,8 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import base64
+import functools
 import json
 import logging
 import re
@@ -12,10 +14,14 @@ from queue import Empty, Queue
 
 import paho.mqtt.client as mqtt
 
-from ja2mqtt.config import Config
+from ja2mqtt.codec import get_codec
+from ja2mqtt.config import Config, timing
 from ja2mqtt.utils import (
+    JSONEmitter,
     Map,
+    PathDef,
     PythonExpression,
+    TimerWheel,
     deep_eval,
     deep_merge,
     merge_dicts,
@@ -23,9 +29,12 @@ from ja2mqtt.utils import (
 )
 
 from . import Component
-from .serial import SerialJA121TException, decode_prfstate
+from .serial import SerialJA121TException, decode_prfstate, decode_prfstate_mask
 
 PRFSTATE_RE = re.compile("PRFSTATE ([0-9A-F]+)")
+TOPIC_PARAM_RE = re.compile("\\{[a-zA-Z0-9_\\.]+\\}")
+STATE_KEY_RE = re.compile("(STATE [0-9]+|PRFSTATE) ")
+LITERAL_PREFIX_RE = re.compile("\\^?([A-Za-z0-9_:,\\- ]*)")
 
 
 class Pattern:
@@ -49,6 +58,80 @@ class Pattern:
         return self.match is not None
 
 
+class PrfStateFrame:
+    """
+    PrfStateFrame decodes `PRFSTATE` lines to integer bitmasks, where the bit `n` represents
+    the state of the peripheral at position `n`, and shares the result with all peripheral
+    matchers and the bridge. A line is decoded again only when it differs from the last
+    decoded line. The `update` method advances the frame with a new line received from the
+    serial interface and XORs it with the previous frame to find the changed positions.
+    The property `seq` is a sequence number that is incremented with every frame. The
+    `transitions` is a bitmask of positions that changed in frames that were dropped by
+    the backlog compaction before the current frame.
+    """
+
+    def __init__(self):
+        self.line = None
+        self.hex = None
+        self.mask = None
+        self.bits = 0
+        self._state = None
+        self.prev_mask = None
+        self.changed = 0
+        self.report_on_next = False
+        self.seq = 0
+        self.transitions = 0
+        self.pending_transitions = 0
+
+    def decode(self, line):
+        """
+        Return the bitmask of peripheral states for the line or None when the line is
+        not a `PRFSTATE` line. When the line cannot be decoded, the exception is raised
+        only once and the line is treated as a line that is not a `PRFSTATE` line.
+        """
+        if line != self.line:
+            self.line, self.hex, self.mask, self._state = line, None, None, None
+            m = PRFSTATE_RE.match(line)
+            if m:
+                self.mask = decode_prfstate_mask(m.group(1))
+                self.hex = m.group(1)
+                self.bits = len(self.hex) * 4
+        return self.mask
+
+    def state(self, line):
+        """
+        Return the peripheral states for the line as a dict (a result of `decode_prfstate`)
+        or None when the line is not a `PRFSTATE` line.
+        """
+        if self.decode(line) is None:
+            return None
+        if self._state is None:
+            self._state = decode_prfstate(self.hex)
+        return self._state
+
+    def update(self, line):
+        """
+        Advance to the next frame when the line is a `PRFSTATE` line. Return a bitmask
+        of positions whose peripheral rules need to be evaluated, i.e. the positions that
+        changed since the previous frame or all positions for the first frame and
+        for the frame that follows `write_prf_state`, together with positions that changed
+        in frames dropped by the backlog compaction. Return None when the line is not
+        a `PRFSTATE` line.
+        """
+        mask = self.decode(line)
+        if mask is None:
+            return None
+        all_bits = (1 << self.bits) - 1
+        self.changed = all_bits if self.prev_mask is None else mask ^ self.prev_mask
+        self.prev_mask = mask
+        self.seq += 1
+        self.transitions = self.pending_transitions
+        self.pending_transitions = 0
+        positions = all_bits if self.report_on_next else self.changed | self.transitions
+        self.report_on_next = False
+        return positions
+
+
 class PrfStateChange:
     """
     PrfStateChange evaluates a state change in a peripheral at position `pos`. It uses
@@ -60,9 +143,10 @@ class PrfStateChange:
     time of the peripheral.
     """
 
-    def __init__(self, pos, current_state):
+    def __init__(self, pos, current_state, frame=None):
         self.pos = pos
         self.current_state = current_state
+        self.frame = frame if frame is not None else PrfStateFrame()
         self.state = None
         self.updated = None
 
@@ -76,11 +160,8 @@ class PrfStateChange:
         """
         Decode line to dict where keys are codes and values are states.
         """
-        if line.startswith("PRFSTATE"):
-            d = decode_prfstate(line.split(" ")[1])
-            return True, d
-        else:
-            return False, None
+        d = self.frame.state(line)
+        return d is not None, d
 
     def __eq__(self, other):
         res, d = self.decode(other)
@@ -96,10 +177,11 @@ class PrfStateChange:
 
 
 class SectionState:
-    def __init__(self, pattern, section_group=1, state_group=2):
+    def __init__(self, pattern, section_group=1, state_group=2, transitions=None):
         self.re = re.compile(pattern)
         self.section_group = section_group
         self.state_group = state_group
+        self.transitions = transitions if transitions is not None else set()
         self.state = None
         self.match = None
         self.updated = None
@@ -109,26 +191,30 @@ class SectionState:
         if self.match:
             section = self.match.group(self.section_group)
             state = self.match.group(self.state_group)
-            if self.state != state:
+            if self.state != state or section in self.transitions:
                 self.updated = time.time()
                 self.state = state
+                self.transitions.discard(section)
             return True
         else:
             return False
 
 
 class PrfState:
-    def __init__(self, pos):
+    def __init__(self, pos, frame=None):
         self.state = None
         self.pos = str(pos)
+        self.bit = int(pos)
+        self.frame = frame if frame is not None else PrfStateFrame()
         self.report_on_next = False
 
     def __eq__(self, other):
         res = False
-        if other.startswith("PRFSTATE"):
-            d = decode_prfstate(other.split(" ")[1])
-            if self.state != d[self.pos]:
-                self.state = d[self.pos]
+        mask = self.frame.decode(other)
+        if mask is not None:
+            state = "ON" if (mask >> self.bit) & 1 else "OFF"
+            if self.state != state or (self.frame.transitions >> self.bit) & 1:
+                self.state = state
                 self.updated = time.time()
                 res = True
             if self.report_on_next:
@@ -137,8 +223,268 @@ class PrfState:
         return res
 
 
+def literal_prefix(pattern):
+    """
+    Return the literal prefix of a regular expression pattern, i.e. the string that every
+    line matching the pattern must start with. The result is an empty string when
+    the prefix cannot be determined, such as for patterns with a top-level alternation.
+    """
+    depth, escape = 0, False
+    for ch in pattern:
+        if escape:
+            escape = False
+        elif ch == "\\":
+            escape = True
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "|" and depth == 0:
+            return ""
+    m = LITERAL_PREFIX_RE.match(pattern)
+    prefix = m.group(1)
+    if prefix != "" and pattern[m.end() : m.end() + 1] in ("?", "*", "{"):
+        prefix = prefix[:-1]
+    return prefix
+
+
+class SectionStateTable:
+    """
+    SectionStateTable selects `section_state` matchers for a line by the literal text that lines
+    matching their patterns start with. When the section group of a pattern is a literal, such as
+    in `STATE (1) (READY|ARMED)`, the text includes the section code (`STATE 1 `), so that the line
+    is looked up in a dict once for every distinct length of the texts and only matchers of its
+    section are returned. Matchers whose patterns do not start with a literal text are returned
+    for every line.
+    """
+
+    def __init__(self, entries):
+        self.literals = {}
+        self.other = []
+        for entry in entries:
+            key = self.literal(entry[3].matcher)
+            if key:
+                self.literals.setdefault(key, []).append(entry)
+            else:
+                self.other.append(entry)
+        self.lengths = sorted(set(len(x) for x in self.literals.keys()))
+
+    @classmethod
+    def group_span(cls, pattern, group):
+        """
+        Return the start and the end of the capturing `group` in the pattern or None when
+        the pattern does not have the group.
+        """
+        n, depth, escape, charset, start = 0, 0, False, False, None
+        for i, ch in enumerate(pattern):
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif charset:
+                charset = ch != "]"
+            elif ch == "[":
+                charset = True
+            elif ch == "(":
+                depth += 1
+                if pattern[i + 1 : i + 2] != "?" or pattern[i + 1 : i + 4] == "?P<":
+                    n += 1
+                    if n == group:
+                        start, start_depth = i, depth
+            elif ch == ")":
+                if start is not None and depth == start_depth:
+                    return start, i
+                depth -= 1
+        return None
+
+    @classmethod
+    def literal(cls, matcher):
+        """
+        Return the literal text that lines matching the pattern of the matcher start with,
+        including the section group when it is a literal.
+        """
+        pattern = matcher.re.pattern
+        span = cls.group_span(pattern, matcher.section_group)
+        if span is not None:
+            content = pattern[span[0] + 1 : span[1]]
+            if (
+                content != ""
+                and LITERAL_PREFIX_RE.match(content).group(1) == content
+                and pattern[span[1] + 1 : span[1] + 2] not in ("?", "*", "+", "{")
+            ):
+                pattern = pattern[: span[0]] + content + pattern[span[1] + 1 :]
+        return literal_prefix(pattern)
+
+    def match(self, line):
+        """
+        Return the index entries of matchers that can match the line.
+        """
+        result = list(self.other)
+        for n in self.lengths:
+            result.extend(self.literals.get(line[:n], ()))
+        return result
+
+
+class BacklogCompactor:
+    """
+    BacklogCompactor collapses superseded state lines in a batch of lines taken from the serial
+    buffer. Only the latest `PRFSTATE` line and the latest `STATE <code>` line of every section
+    are kept at the position of their last occurrence, all other lines are kept as they are.
+    Lines for which the `keep` function passed to `compact` returns True, such as responses
+    to pending requests, are never dropped.
+    When `keep_transitions` is True, the `compact` method also returns a bitmask of peripheral
+    positions and a set of section codes whose states changed in the dropped lines, so that
+    these transitions can be reported as flags with the kept lines.
+    """
+
+    def __init__(self, keep_transitions=True):
+        self.keep_transitions = keep_transitions
+
+    def key(self, item):
+        if isinstance(item, tuple):
+            return None
+        m = STATE_KEY_RE.match(item)
+        return m.group(1) if m else None
+
+    def compact(self, items, prev_mask=None, keep=None):
+        """
+        Compact the items, the `prev_mask` is the bitmask of peripheral states before the
+        batch and `keep` is a function of a line that returns True when the line must be kept.
+        Return a tuple of the compacted items, the bitmask of peripheral positions
+        with transitions and the set of section codes with transitions.
+        """
+        keys = [self.key(item) for item in items]
+        kept = [
+            key is None or (keep is not None and keep(item))
+            for item, key in zip(items, keys)
+        ]
+        last = {key: i for i, key in enumerate(keys) if not kept[i]}
+        prf_transitions, section_transitions = 0, set()
+        if len(last) == kept.count(False):
+            return items, prf_transitions, section_transitions
+        result = []
+        for i, (item, key) in enumerate(zip(items, keys)):
+            if kept[i] or last[key] == i:
+                result.append(item)
+            if key is None or not self.keep_transitions:
+                continue
+            if key == "PRFSTATE":
+                try:
+                    mask = decode_prfstate_mask(PRFSTATE_RE.match(item).group(1))
+                except (AttributeError, SerialJA121TException):
+                    continue
+                if prev_mask is not None:
+                    prf_transitions |= prev_mask ^ mask
+                prev_mask = mask
+            elif key in last and item != items[last[key]]:
+                section_transitions.add(key.split(" ")[1])
+        return result, prf_transitions, section_transitions
+
+
+class RuleIndex:
+    """
+    RuleIndex is a compiled dispatch index for serial2mqtt rules. Rules with constant
+    `read` strings are stored in a hash table, rules with `pattern`, `section_state`
+    and `prf_state` matchers are grouped by the literal prefix of lines they can match
+    (such as `STATE` or `PRFSTATE`) and disabled topics are pruned. The remaining rules
+    whose `read` cannot be analyzed are evaluated for every line. Rules with `prf_state`
+    matchers are indexed by the peripheral position and they are only routed to when
+    their position is in the bitmask of positions passed to `candidates`. Rules with
+    `section_state` matchers are selected by a `SectionStateTable`. The `candidates`
+    method returns the rules that can match a line in the order they are defined in the topics.
+    """
+
+    def __init__(self, topics, scope):
+        self.exact = {}
+        self.prefixes = {}
+        self.positions = {}
+        self.sections = None
+        self.dynamic = []
+        self.cache = {}
+        sections = []
+        for topic_inx, topic in enumerate(topics):
+            if topic.disabled:
+                continue
+            for rule_inx, rule in enumerate(topic.rules):
+                entry = (topic_inx, rule_inx, topic, rule)
+                if not isinstance(rule.read, PythonExpression):
+                    self.exact.setdefault(rule.read, []).append(entry)
+                    continue
+                try:
+                    matcher = rule.read.eval(scope)
+                except Exception:
+                    matcher = None
+                prefix = self.matcher_prefix(matcher)
+                if isinstance(matcher, PrfState):
+                    rule.matcher = matcher
+                    self.positions.setdefault(matcher.bit, []).append(entry)
+                elif isinstance(matcher, SectionState):
+                    rule.matcher = matcher
+                    sections.append(entry)
+                elif prefix:
+                    rule.matcher = matcher
+                    self.prefixes.setdefault(prefix, []).append(entry)
+                else:
+                    self.dynamic.append(entry)
+        if len(sections) > 0:
+            self.sections = SectionStateTable(sections)
+
+    @classmethod
+    def matcher_prefix(cls, matcher):
+        """
+        Return the literal prefix of lines the matcher can be equal to or None if
+        the matcher is not known.
+        """
+        if isinstance(matcher, (PrfState, PrfStateChange)):
+            return "PRFSTATE"
+        if isinstance(matcher, Pattern):
+            return literal_prefix(matcher.pattern)
+        if isinstance(matcher, SectionState):
+            return literal_prefix(matcher.re.pattern)
+        return None
+
+    def candidates(self, line, positions=0):
+        """
+        Return a list of `(topic, rules)` tuples with rules that can match the line.
+        The `positions` is a bitmask of peripheral positions whose `prf_state` rules
+        should be included.
+        """
+        exact = line if line in self.exact else None
+        key = (exact, tuple(p for p in self.prefixes.keys() if line.startswith(p)))
+        entries = self.cache.get(key)
+        if entries is None:
+            entries = [] if exact is None else list(self.exact[exact])
+            for p in key[1]:
+                entries.extend(self.prefixes[p])
+            entries.extend(self.dynamic)
+            entries.sort(key=lambda x: (x[0], x[1]))
+            entries = self.cache[key] = (entries, self.group(entries))
+        sections = self.sections.match(line) if self.sections is not None else []
+        if (not positions or not self.positions) and len(sections) == 0:
+            return entries[1]
+        routed = entries[0] + sections
+        while positions and self.positions:
+            bit = positions & -positions
+            routed.extend(self.positions.get(bit.bit_length() - 1, []))
+            positions ^= bit
+        routed.sort(key=lambda x: (x[0], x[1]))
+        return self.group(routed)
+
+    @classmethod
+    def group(cls, entries):
+        """
+        Group the sorted index entries to a list of `(topic, rules)` tuples.
+        """
+        result = []
+        for _, _, topic, rule in entries:
+            if len(result) == 0 or result[-1][0] is not topic:
+                result.append((topic, []))
+            result[-1][1].append(rule)
+        return result
+
+
 class Topic:
-    def __init__(self, prefix, topic):
+    def __init__(self, prefix, topic, codec="json"):
         if topic["name"].startswith(prefix):
             self.name = topic["name"]
         else:
@@ -147,9 +493,35 @@ class Topic:
                 sep = ""
             self.name = prefix + sep + topic["name"]
         self.disabled = topic.get("disabled", False)
+        self.codec = get_codec(topic.get("codec", codec))
+
+        # parameterised topics, the parameters are replaced with `+` in the subscription
+        self.path_def = None
+        self.subscription = self.name
+        if TOPIC_PARAM_RE.search(self.name) or "+" in self.name or "#" in self.name:
+            self.subscription = "/".join(
+                "+" if TOPIC_PARAM_RE.search(x) else x for x in self.name.split("/")
+            )
+            self.path_def = PathDef(
+                self.name.replace("+", "[^/]+")
+                .replace("/#", "(?:/.*)?")
+                .replace("#", ".*")
+            )
         self.rules = []
         for rule_def in topic["rules"]:
-            self.rules.append(Map(rule_def))
+            rule = Map(rule_def)
+            if isinstance(rule.write, dict):
+                rule.emitter = JSONEmitter(rule.write)
+            # the pattern of responses to requests of mqtt2serial rules
+            rule.response_pattern = None
+            if rule.response is not None:
+                try:
+                    rule.response_pattern = re.compile(rule.response)
+                except re.error as e:
+                    raise Exception(
+                        f"Invalid response pattern '{rule.response}' of the topic {self.name}. {str(e)}"
+                    )
+            self.rules.append(rule)
 
     def check_rule_data(self, read, data, scope, path=None):
         if path is None:
@@ -185,9 +557,240 @@ class Topic:
         )
 
 
+class TopicRouter:
+    """
+    TopicRouter finds mqtt2serial topics for names of received MQTT topics. Topics with
+    exact names are stored in a hash map, topics with MQTT wildcards (`+`, `#`) or parameters
+    (`{param}`) are stored in a trie of topic levels. The parameter values are extracted
+    from the topic name using the topic's path definition.
+    """
+
+    def __init__(self, topics):
+        self.exact = {}
+        self.trie = {}
+        for inx, topic in enumerate(topics):
+            if topic.path_def is None:
+                self.exact.setdefault(topic.name, []).append((inx, topic))
+            else:
+                node = self.trie
+                for level in topic.subscription.split("/"):
+                    node = node.setdefault(level, {})
+                node.setdefault(None, []).append((inx, topic))
+
+    def _match(self, node, levels, i, found):
+        if "#" in node:
+            found.extend(node["#"].get(None, []))
+        if i == len(levels):
+            found.extend(node.get(None, []))
+            return
+        for key in (levels[i], "+") if levels[i] != "+" else ("+",):
+            child = node.get(key)
+            if child is not None:
+                self._match(child, levels, i + 1, found)
+
+    def route(self, name):
+        """
+        Return a list of `(topic, params)` tuples for the topic name in the order the topics
+        are defined, where `params` is a `Map` of parameter values extracted from the name.
+        """
+        found = list(self.exact.get(name, []))
+        if len(self.trie) > 0:
+            self._match(self.trie, name.split("/"), 0, found)
+            found.sort(key=lambda x: x[0])
+        result = []
+        for _, topic in found:
+            if topic.path_def is None:
+                result.append((topic, Map()))
+            else:
+                params = topic.path_def.params(name)
+                if params is not None:
+                    result.append((topic, params.params))
+        return result
+
+
+class CorrelationTable:
+    """
+    CorrelationTable holds requests received from MQTT that wait for responses from the serial
+    interface. Every request has a correlation id, a TTL that is the maximum number of responses
+    correlated with the request, a deadline given by the correlation timeout and an optional
+    `response` pattern that lines of the responses must match. A line is correlated with the oldest
+    pending request whose pattern matches the line. Expired requests are removed using
+    a timing wheel.
+    """
+
+    def __init__(self, timeout):
+        self.log = logging.getLogger("bridge")
+        self.timeout = timeout
+        self.pending = {}
+        self.wheel = TimerWheel()
+        self.lock = threading.Lock()
+        self.seq = 0
+
+    def add(self, cor_id, ttl=1, response=None, command=None, properties=None):
+        """
+        Add a new pending request. The `response` is the compiled pattern of lines of
+        the responses. The `command` is the command written to the serial
+        interface when responses to the request should be recorded in the state cache.
+        The `properties` are the MQTT v5 correlation data and response topic of the request.
+        """
+        with self.lock:
+            self.seq += 1
+            created_time = time.time()
+            request = Map(
+                id=self.seq,
+                cor_id=cor_id,
+                created_time=created_time,
+                deadline=created_time + self.timeout,
+                ttl=ttl,
+                response=response,
+                command=command,
+                properties=properties,
+            )
+            self.pending[request.id] = request
+            self.wheel.add(request.id, request.deadline)
+            return request
+
+    def match(self, line, published=False):
+        """
+        Return the oldest pending request the line is a response for and decrease its TTL,
+        or return None when there is no such request. Requests with a `response` pattern are
+        matched with lines that match the pattern. Requests without the pattern are only
+        matched with lines that are published by a rule, when `published` is True.
+        """
+        with self.lock:
+            for id in self.wheel.expire(time.time()):
+                request = self.pending.pop(id, None)
+                if request is not None:
+                    self.log.debug(
+                        f"Discarding the request {request.cor_id} for correlation. "
+                        + "The correlation timeout expired."
+                    )
+            for id, request in self.pending.items():
+                if (
+                    published
+                    if request.response is None
+                    else not published and request.response.match(line)
+                ):
+                    request.ttl -= 1
+                    if request.ttl <= 0:
+                        del self.pending[id]
+                        self.wheel.remove(id, request.deadline)
+                    return request
+            return None
+
+    def expects(self, line):
+        """
+        Return True when the line is a response for a pending request that did not expire.
+        Unlike `match`, the TTL of the request is not decreased.
+        """
+        with self.lock:
+            current_time = time.time()
+            for request in self.pending.values():
+                if request.deadline > current_time and (
+                    request.response is None or request.response.match(line)
+                ):
+                    return True
+            return False
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class StateCache:
+    """
+    StateCache is a read-through cache for query commands such as `STATE` or `PRFSTATE`.
+    It keeps the latest `STATE <code>` and `PRFSTATE` lines received from the serial interface
+    and, for every query command written to the serial interface, the entities (sections
+    or peripherals) of its responses. A query command can be answered from the cache by
+    the latest lines of its entities when the command was executed within `max_age` seconds.
+    The cache is keyed by the whole command including the pin, so only commands that
+    Jablotron answered without an error can be answered from the cache.
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.latest = {}
+        self.queries = {}
+        self.lock = threading.Lock()
+
+    def update(self, line):
+        """
+        Update the latest line of the entity the line is about.
+        """
+        m = STATE_KEY_RE.match(line)
+        if m:
+            with self.lock:
+                self.latest[m.group(1)] = line
+
+    def executed(self, command):
+        """
+        Start recording responses of the command written to the serial interface.
+        """
+        with self.lock:
+            self.queries[command] = Map(time=time.time(), keys={})
+
+    def record(self, command, line):
+        """
+        Record the line that was correlated with the command. An error invalidates
+        the command.
+        """
+        with self.lock:
+            query = self.queries.get(command)
+            if query is not None:
+                m = STATE_KEY_RE.match(line)
+                if m:
+                    query.keys[m.group(1)] = True
+                elif line.startswith("ERROR"):
+                    del self.queries[command]
+
+    def lines(self, command):
+        """
+        Return the latest lines of entities of the command or None when the command
+        cannot be answered from the cache.
+        """
+        with self.lock:
+            query = self.queries.get(command)
+            if (
+                query is None
+                or len(query.keys) == 0
+                or time.time() - query.time > self.max_age
+            ):
+                return None
+            return [self.latest[k] for k in query.keys if k in self.latest]
+
+
+class ChangeFilter:
+    """
+    ChangeFilter suppresses publishes of payloads that did not change. It keeps the last
+    payload of every topic without the volatile properties, such as the time of the last
+    update, that change with every publish.
+    """
+
+    def __init__(self, volatile_fields):
+        self.volatile_fields = set(volatile_fields)
+        self.last = {}
+
+    def changed(self, topic, parts):
+        """
+        Return True if the payload of the `topic` given by its `parts` emitted
+        by the payload codec differs from the last payload of the topic.
+        """
+        payload = [x for k, x in parts if k not in self.volatile_fields]
+        if self.last.get(topic) == payload:
+            return False
+        self.last[topic] = payload
+        return True
+
+    def reset(self):
+        self.last.clear()
+
+
 class JA2MQTTConfig:
     def __init__(self, config):
         self._scope = None
+        self.prfstate_frame = PrfStateFrame()
+        self.prf_states = {}
+        self.section_transitions = set()
         self.config = config
         self.topics_serial2mqtt = []
         self.topics_mqtt2serial = []
@@ -201,35 +804,71 @@ class JA2MQTTConfig:
 
         # system properties
         self.topic_prefix = self.ja2mqtt("system.topic_prefix", "ja2mqtt")
+        if config.panel_name is not None:
+            self.topic_prefix = config(
+                "topic_prefix", f"{self.topic_prefix}/{config.panel_name}"
+            )
         self.correlation_id = self.ja2mqtt("system.correlation_id", None)
         self.correlation_timeout = self.ja2mqtt("system.correlation_timeout", 0)
         self.topic_sys_error = self.ja2mqtt("system.topic_sys_error", None)
         self.prfstate_bits = self.ja2mqtt("system.prfstate_bits", 128)
+        self.state_cache_max_age = self.ja2mqtt("system.state_cache", 0, required=False)
+        self.backlog_compaction = self.ja2mqtt(
+            "system.backlog_compaction", "none", required=False
+        )
+        self.publish_on_change = self.ja2mqtt(
+            "system.publish_on_change", False, required=False
+        )
+        self.volatile_fields = self.ja2mqtt(
+            "system.volatile_fields", ["updated"], required=False
+        )
+        self.codec = self.ja2mqtt("system.codec", "json", required=False)
+        snapshot = self.ja2mqtt("system.prfstate_snapshot", None, required=False)
 
         # topics
-        for topic_def in self.ja2mqtt("serial2mqtt"):
-            self.topics_serial2mqtt.append(Topic(self.topic_prefix, topic_def))
-        for topic_def in self.ja2mqtt("mqtt2serial"):
-            self.topics_mqtt2serial.append(Topic(self.topic_prefix, topic_def))
+        with timing("topics"):
+            for topic_def in self.ja2mqtt("serial2mqtt"):
+                self.topics_serial2mqtt.append(
+                    Topic(self.topic_prefix, topic_def, self.codec)
+                )
+            for topic_def in self.ja2mqtt("mqtt2serial"):
+                self.topics_mqtt2serial.append(
+                    Topic(self.topic_prefix, topic_def, self.codec)
+                )
+
+            # the topic with snapshots of all peripheral states
+            self.prfstate_snapshot = None
+            if snapshot is not None:
+                self.prfstate_snapshot = Map(
+                    topic=Topic(
+                        self.topic_prefix,
+                        Map(name=snapshot.get("topic", "prfstate"), rules=[]),
+                        self.codec,
+                    ),
+                    encoding=snapshot.get("encoding", "hex"),
+                    retain=snapshot.get("retain", False),
+                    peripheral_topics=snapshot.get("peripheral_topics", True),
+                )
+                self.topics_serial2mqtt.append(self.prfstate_snapshot.topic)
+            self.rule_index = RuleIndex(self.topics_serial2mqtt, self.scope())
+            self.topic_router = TopicRouter(self.topics_mqtt2serial)
 
     def scope(self):
         section_states = {}
 
         def _section_state(pattern, g1, g2):
             if pattern not in section_states:
-                section_states[pattern] = SectionState(pattern, g1, g2)
+                section_states[pattern] = SectionState(
+                    pattern, g1, g2, self.section_transitions
+                )
             return section_states[pattern]
 
-        prf_states = {}
-
         def _prf_state(pos):
-            if pos not in prf_states:
-                prf_states[pos] = PrfState(pos)
-            return prf_states[pos]
+            if pos not in self.prf_states:
+                self.prf_states[pos] = PrfState(pos, self.prfstate_frame)
+            return self.prf_states[pos]
 
         def _write_prf_state():
-            for k, v in prf_states.items():
-                v.report_on_next = True
             return "PRFSTATE"
 
         if self._scope is None:
@@ -243,13 +882,23 @@ class JA2MQTTConfig:
             )
         return self._scope
 
+    def report_prf_states(self):
+        """
+        Report states of all peripherals on the next `PRFSTATE` line. This is called when
+        the `PRFSTATE` command is written to the serial interface, which can be later than
+        when the command is queued.
+        """
+        for x in self.prf_states.values():
+            x.report_on_next = True
+        self.prfstate_frame.report_on_next = True
+
     def corr_id(self):
         corrid_field = self.ja2mqtt("system.correlation_id", None)
         corr_id = randomString(12, letters="abcdef0123456789")
         return corrid_field, corr_id if corrid_field is not None else None
 
     def topic_exists(self, name):
-        return name in [x.name for x in self.topics_mqtt2serial]
+        return len(self.topic_router.route(name)) > 0
 
 
 class SerialMQTTBridge(Component, JA2MQTTConfig):
@@ -258,9 +907,22 @@ class SerialMQTTBridge(Component, JA2MQTTConfig):
         JA2MQTTConfig.__init__(self, config)
         self.mqtt = None
         self.serial = None
-        self._scope = None
-        self.request_queue = Queue()
+        self.correlation = CorrelationTable(self.correlation_timeout)
         self.request = None
+        self.line_published = False
+        self.state_cache = None
+        if self.state_cache_max_age > 0:
+            self.state_cache = StateCache(self.state_cache_max_age)
+        self.change_filter = None
+        if self.publish_on_change:
+            self.change_filter = ChangeFilter(
+                self.volatile_fields + [self.correlation_id]
+            )
+        self.compactor = None
+        if self.backlog_compaction != "none":
+            self.compactor = BacklogCompactor(
+                keep_transitions=self.backlog_compaction == "flags"
+            )
 
         self.log.info(f"The ja2mqtt definition file is {self.ja2mqtt_file}")
         self.log.info(
@@ -274,28 +936,56 @@ class SerialMQTTBridge(Component, JA2MQTTConfig):
             f"The mqtt2serial topics are: {Topic.list(self.topics_mqtt2serial)}"
         )
 
-        # states of perihperals
-        self.prfstate = [decode_prfstate("".zfill(self.prfstate_bits))]
+        # states of perihperals as a bitmask and positions changed in the last frame
+        self.prfstate = 0
+        self.prfstate_changed = 0
+        self.snapshot_seq = 0
 
-    def update_correlation(self, data):
-        if self.request_queue.qsize() > 0:
-            self.request = self.request_queue.get()
+    def update_correlation(self, line, request=None, published=False):
+        """
+        Correlate the line with the `request` or with a pending request whose response pattern
+        matches the line. When the line is not correlated, it is correlated with a pending request
+        without the response pattern when it is `published` for the first time. The correlation
+        consumes the TTL of the request, so that this is done at most once for every line.
+        """
+        if not published:
+            self.line_published = False
+            self.request = (
+                request if request is not None else self.correlation.match(line)
+            )
+        elif self.request is None and not self.line_published:
+            self.line_published = True
+            self.request = self.correlation.match(line, published=True)
+        else:
+            return
         if self.request is not None:
-            if (
-                time.time() - self.request.created_time < self.correlation_timeout
-                and self.request.ttl > 0
-            ):
-                if self.request.cor_id is not None:
-                    data[self.correlation_id] = self.request.cor_id
-                self.request.ttl -= 1
-            else:
-                self.log.debug(
-                    "Discarding the request for correlation. The correlation timeout "
-                    + "or TTL expired."
-                )
-                self.request = None
+            if self.request.command is not None and self.state_cache is not None:
+                self.state_cache.record(self.request.command, line)
+
+    def correlation_data(self):
+        data = Map()
+        if self.request is not None and self.request.cor_id is not None:
+            data[self.correlation_id] = self.request.cor_id
         return data
 
+    def on_serial_write(self, command, cor_id, rule, properties=None):
+        """
+        Register the request for correlation when the command is written to the serial interface.
+        After the `PRFSTATE` command, states of all peripherals are reported on the next `PRFSTATE` line.
+        """
+        if command == "PRFSTATE":
+            self.report_prf_states()
+        cache = rule.cache and self.state_cache is not None
+        if cache:
+            self.state_cache.executed(command)
+        self.correlation.add(
+            cor_id,
+            ttl=rule.get("request_ttl", 1),
+            response=rule.response_pattern,
+            command=command if cache else None,
+            properties=properties,
+        )
+
     def update_scope(self, key, value=None, remove=False):
         if self._scope is None:
             self.scope()
@@ -306,36 +996,54 @@ class SerialMQTTBridge(Component, JA2MQTTConfig):
                 del self._scope[key]
 
     def update_prfstate(self, data_str):
+        """
+        Update the peripheral states from the `PRFSTATE` line and return a bitmask of
+        positions whose peripheral rules need to be evaluated.
+        """
         try:
-            m = PRFSTATE_RE.match(data_str)
-            if m:
-                self.prfstate.append(decode_prfstate(m.group(1)))
-                if len(self.prfstate) > 1:
-                    self.prfstate = self.prfstate[-2:]
-                self.log.debug(f"prfstate_decoded={self.prfstate[-1]}")
+            positions = self.prfstate_frame.update(data_str)
+            if positions is None:
+                return 0
+            self.prfstate = self.prfstate_frame.mask
+            self.prfstate_changed = self.prfstate_frame.changed
+            self.log.debug(
+                f"prfstate={self.prfstate:x}, changed={self.prfstate_changed:x}"
+            )
+            return positions
         except SerialJA121TException as e:
-            self.log.error({str(e)})
+            self.log.error(str(e))
+            return 0
 
     def on_mqtt_connect(self, client, userdata, flags, rc):
-        for topic in self.topics_mqtt2serial:
-            self.mqtt.subscribe(topic.name)
+        # publish all states again after the client connects
+        if self.change_filter is not None:
+            self.change_filter.reset()
+        for subscription in dict.fromkeys(
+            x.subscription for x in self.topics_mqtt2serial
+        ):
+            self.mqtt.subscribe(subscription)
 
-    def on_mqtt_message(self, topic_name, payload):
+    def on_mqtt_message(self, topic_name, payload, properties=None):
         if not self.serial.is_ready():
             self.log.warn(
                 "No messages will be processed. The serial interface is not available."
             )
             return
-        try:
-            data = Map(json.loads(payload))
-        except Exception as e:
-            raise Exception(f"Cannot parse the event data. {str(e)}")
-
-        self.log.debug(f"The event data parsed as JSON object: {data}")
-        for topic in self.topics_mqtt2serial:
-            if topic.name == topic_name:
-                if topic.disabled:
-                    continue
+        decoded = {}
+        for topic, params in self.topic_router.route(topic_name):
+            if topic.disabled:
+                continue
+            # the payload is decoded by the codec of the topic
+            data = decoded.get(topic.codec.name)
+            if data is None:
+                try:
+                    data = Map(topic.codec.decode(payload))
+                except Exception as e:
+                    raise Exception(f"Cannot parse the event data. {str(e)}")
+                decoded[topic.codec.name] = data
+                self.log.debug(f"The event data parsed as {topic.codec.name}: {data}")
+            self.update_scope("params", params)
+            try:
                 for rule in topic.rules:
                     if rule.read is not None:
                         topic.check_rule_data(rule.read, data, self.scope())
@@ -346,50 +1054,158 @@ class SerialMQTTBridge(Component, JA2MQTTConfig):
                     self.update_scope("data", _data)
                     try:
                         s = deep_eval(rule.write, self._scope)
-                        self.request_queue.put(
-                            Map(
-                                cor_id=_data.get(self.correlation_id),
-                                created_time=time.time(),
-                                ttl=rule.get("request_ttl", 1),
-                            )
+                        # MQTT v5 correlation data replace the correlation id in the data
+                        if (
+                            properties is not None
+                            and properties.correlation_data is not None
+                        ):
+                            cor_id = None
+                        else:
+                            cor_id = _data.get(self.correlation_id)
+                        lines = None
+                        if rule.cache and self.state_cache is not None:
+                            lines = self.state_cache.lines(s)
+                        # the cached lines are added to the serial buffer without waiting,
+                        # the command is written when the buffer is full; states of all
+                        # peripherals are reported when the bridge processes the cached lines
+                        request = Map(
+                            cor_id=cor_id,
+                            command=None,
+                            properties=properties,
+                            report_prf_states=s == "PRFSTATE",
                         )
-                        self.serial.writeline(s)
+                        if lines and self.serial.buffer.offer(
+                            [(line, request) for line in lines]
+                        ):
+                            self.log.debug(
+                                f"Answering the request from the state cache: {lines}"
+                            )
+                        else:
+                            self.serial.writeline(
+                                s,
+                                priority=rule.get("priority", "normal"),
+                                on_write=functools.partial(
+                                    self.on_serial_write, s, cor_id, rule, properties
+                                ),
+                            )
                     finally:
                         self.update_scope("data", remove=True)
+            finally:
+                self.update_scope("params", remove=True)
+
+    def publish(self, topic_name, payload, retain=False):
+        """
+        Publish the payload. A response to an MQTT v5 request carries the correlation data
+        of the request, it is published to the response topic of the request when the request
+        has one, and it expires after the correlation timeout.
+        """
+        properties = None
+        if self.mqtt.v5 and self.request is not None:
+            properties = Map(expiry=self.correlation_timeout)
+            if self.request.properties is not None:
+                properties.correlation_data = self.request.properties.correlation_data
+                if self.request.properties.response_topic is not None:
+                    topic_name = self.request.properties.response_topic
+                    retain = False
+        self.mqtt.publish(topic_name, payload, retain=retain, properties=properties)
 
-    def on_serial_data(self, data):
-        if not self.mqtt.connected:
+    def publish_prfstate_snapshot(self):
+        """
+        Publish the snapshot of all peripheral states of the `PRFSTATE` line as a bitmap,
+        where the bit `n % 8` of the byte `n // 8` is the state of the peripheral at position `n`,
+        together with the positions that changed and the sequence number of the snapshot.
+        """
+        frame = self.prfstate_frame
+        snapshot = self.prfstate_snapshot
+        bitmap = frame.mask.to_bytes((frame.bits + 7) // 8, "little")
+        changed, positions = frame.changed | frame.transitions, []
+        while changed:
+            bit = changed & -changed
+            positions.append(bit.bit_length() - 1)
+            changed ^= bit
+        self.snapshot_seq += 1
+        data = self.correlation_data()
+        data.prfstate = (
+            bitmap.hex()
+            if snapshot.encoding == "hex"
+            else base64.b64encode(bitmap).decode("ascii")
+        )
+        data.bits = frame.bits
+        data.changed = positions
+        data.seq = self.snapshot_seq
+        data.updated = time.time()
+        self.publish(
+            snapshot.topic.name,
+            snapshot.topic.codec.encode(data),
+            retain=snapshot.retain,
+        )
+
+    def on_serial_data(self, data, request=None):
+        """
+        Process a line of data from the serial interface. The `request` is the request
+        the data must be correlated with, such as for data answered from the state cache.
+        States of all peripherals are reported for the `PRFSTATE` lines of the request
+        that answers the `PRFSTATE` command from the state cache.
+        """
+        if self.state_cache is not None:
+            self.state_cache.update(data)
+        # events are spooled when the client is not connected and the spool is configured
+        if not self.mqtt.connected and self.mqtt.spool is None:
             self.log.warn(
                 "No events will be published. The client is not connected to the MQTT broker."
             )
             return
 
-        self.update_prfstate(data)
+        self.update_correlation(data, request)
+        if request is not None and request.report_prf_states:
+            self.report_prf_states()
+        positions = self.update_prfstate(data)
+        if self.prfstate_snapshot is not None and positions:
+            self.update_correlation(data, published=True)
+            self.publish_prfstate_snapshot()
+            if not self.prfstate_snapshot.peripheral_topics:
+                positions = 0
         _rule = None
         current_time = time.time()
-        for topic in self.topics_serial2mqtt:
-            for rule in topic.rules:
-                if isinstance(rule.read, PythonExpression):
+        for topic, rules in self.rule_index.candidates(data, positions):
+            for rule in rules:
+                if rule.matcher is not None:
+                    _data = rule.matcher
+                elif isinstance(rule.read, PythonExpression):
                     _data = rule.read.eval(self.scope())
                 else:
                     _data = rule.read
                 if _data == data:
                     _rule = rule
-                    if not topic.disabled:
-                        self.update_scope("data", _data)
-                        try:
-                            d0 = self.update_correlation(Map())
-                            if not rule.require_request or self.request is not None:
-                                if rule.no_correlation:
-                                    d0 = {}
-                                d1 = deep_merge(rule.write, d0)
-                                d2 = deep_eval(d1, self._scope)
-                                write_data = json.dumps(d2)
-                                self.mqtt.publish(topic.name, write_data)
-                                if not _rule.process_next_rule:
-                                    break
-                        finally:
-                            self.update_scope("data", remove=True)
+                    self.update_scope("data", _data)
+                    try:
+                        self.update_correlation(data, published=True)
+                        d0 = self.correlation_data()
+                        if not rule.require_request or self.request is not None:
+                            if rule.no_correlation:
+                                d0 = {}
+                            parts, payload = topic.codec.emit(
+                                rule.emitter, self._scope, d0
+                            )
+                            # responses to requests are always published
+                            if (
+                                self.change_filter is None
+                                or self.change_filter.changed(topic.name, parts)
+                                or self.request is not None
+                            ):
+                                self.publish(
+                                    topic.name,
+                                    payload,
+                                    retain=rule.get("retain", False),
+                                )
+                            else:
+                                self.log.debug(
+                                    f"The payload of {topic.name} did not change, it is not published."
+                                )
+                            if not _rule.process_next_rule:
+                                break
+                    finally:
+                        self.update_scope("data", remove=True)
             if _rule is not None and not _rule.process_next_rule:
                 break
 
@@ -403,6 +1219,39 @@ class SerialMQTTBridge(Component, JA2MQTTConfig):
 
     def set_serial(self, serial):
         self.serial = serial
+        self.update_scope("serial_metrics", lambda: self.serial.metrics())
+
+    def process(self, data):
+        """
+        Process an item of the serial buffer, the item is either a line or a tuple of
+        a line and the request it belongs to.
+        """
+        if isinstance(data, tuple):
+            self.on_serial_data(*data)
+        else:
+            self.on_serial_data(data)
+
+    def process_batch(self, items):
+        """
+        Process a batch of items taken from the serial buffer. When the backlog compaction
+        is enabled, the superseded state lines are removed from the batch first, except
+        for the lines that are responses for pending requests.
+        """
+        if self.compactor is not None and len(items) > 1:
+            n = len(items)
+            items, prf_transitions, section_transitions = self.compactor.compact(
+                items,
+                self.prfstate_frame.prev_mask,
+                self.correlation.expects if len(self.correlation) > 0 else None,
+            )
+            self.prfstate_frame.pending_transitions |= prf_transitions
+            self.section_transitions.update(section_transitions)
+            if len(items) < n:
+                self.log.debug(
+                    f"The backlog was compacted from {n} to {len(items)} lines."
+                )
+        for data in items:
+            self.process(data)
 
     def worker(self, exit_event):
         self.log.info("Running bridge worker, reading events from the serial buffer.")
@@ -412,8 +1261,37 @@ class SerialMQTTBridge(Component, JA2MQTTConfig):
             while not exit_event.is_set():
                 try:
                     data = self.serial.buffer.get(timeout=1)
-                    self.on_serial_data(data)
+                    if self.compactor is None:
+                        self.process(data)
+                    else:
+                        self.process_batch([data] + self.serial.buffer.get_all())
                 except Empty as e:
                     pass
         finally:
             self.log.info("Bridge worker ended.")
+
+
+class BridgeGroup:
+    """
+    BridgeGroup shares a single MQTT client among bridges of several Jablotron panels.
+    It subscribes to the topics of all bridges when the client connects and passes
+    every message to the bridges that define its topic.
+    """
+
+    def __init__(self, bridges):
+        self.bridges = bridges
+
+    def set_mqtt(self, mqtt):
+        for bridge in self.bridges:
+            bridge.mqtt = mqtt
+        mqtt.on_connect_ext = self.on_mqtt_connect
+        mqtt.on_message_ext = self.on_mqtt_message
+
+    def on_mqtt_connect(self, client, userdata, flags, rc):
+        for bridge in self.bridges:
+            bridge.on_mqtt_connect(client, userdata, flags, rc)
+
+    def on_mqtt_message(self, topic_name, payload, properties=None):
+        for bridge in self.bridges:
+            if bridge.topic_exists(topic_name):
+                bridge.on_mqtt_message(topic_name, payload, properties)
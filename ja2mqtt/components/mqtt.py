@@ -3,22 +3,104 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import asyncio
 import json
 import logging
+import math
 import re
+import select
+import socket
 import threading
 import time
 from queue import Queue
 
 import paho.mqtt.client as mqtt
 import serial as py_serial
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 
 from ja2mqtt.config import Config
-from ja2mqtt.utils import Map, PythonExpression, deep_eval, deep_merge, merge_dicts
+from ja2mqtt.utils import (
+    Map,
+    PythonExpression,
+    deep_eval,
+    deep_merge,
+    merge_dicts,
+    wait_event,
+)
 
 from . import Component
 from .simulator import Simulator
 
+# size of the chunks read from the socket of the MQTT client
+RECV_SIZE = 65536
+
+# maximum number of packets read in one pass of the network loop
+MAX_READ_PACKETS = 1000
+
+NETWORK_LOOPS = ("batch", "paho")
+
+# interval in seconds of replaying the spooled messages
+REPLAY_INTERVAL = 0.1
+
+
+class BufferedClient(mqtt.Client):
+    """
+    BufferedClient is the paho MQTT client that reads data from the socket in chunks
+    instead of reading the header of every packet byte by byte and that can read all
+    available packets in one pass.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._recv_buffer = b""
+        self._recv_pos = 0
+
+    # _sock_recv is a private method of paho-mqtt 1.x, the version is pinned in setup.py
+    def _sock_recv(self, bufsize):
+        if self._recv_pos >= len(self._recv_buffer):
+            data = super()._sock_recv(RECV_SIZE)
+            if len(data) <= bufsize:
+                return data
+            self._recv_buffer, self._recv_pos = data, 0
+        data = self._recv_buffer[self._recv_pos : self._recv_pos + bufsize]
+        self._recv_pos += len(data)
+        return data
+
+    def pending(self):
+        """
+        Return True if there are data that were read from the socket and were not processed.
+        """
+        return self._recv_pos < len(self._recv_buffer)
+
+    def loop_read_all(self, max_packets=MAX_READ_PACKETS):
+        """
+        Read all packets that are available, at most `max_packets` packets.
+        """
+        rc = mqtt.MQTT_ERR_SUCCESS
+        for _ in range(max_packets):
+            rc = self.loop_read()
+            if rc != mqtt.MQTT_ERR_SUCCESS or not self.pending():
+                break
+        return rc
+
+
+class PublishProperties(Properties):
+    """
+    PublishProperties are MQTT v5 properties of a publish packet that are packed only once,
+    so that properties that do not change, such as a topic alias, can be reused by every
+    publish of the topic.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(PacketTypes.PUBLISH)
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+        object.__setattr__(self, "packed", super().pack())
+
+    def pack(self):
+        return self.packed
+
 
 class MQTT(Component):
     """
@@ -32,28 +114,52 @@ class MQTT(Component):
         self.port = self.config.value_int("port", default=1883)
         self.keepalive = self.config.value_int("keepalive", default=60)
         self.reconnect_after = self.config.value_int("reconnect_after", default=30)
-        self.loop_timeout = self.config.value_int("loop_timeout", default=1)
+        self.loop_timeout = self.config.value_float("loop_timeout", default=1)
         self.username = self.config.value_str("username", default=None)
         self.password = self.config.value_str("password", default=None)
         self.protocol = {
+            "MQTTv5": mqtt.MQTTv5,
             "MQTTv311": mqtt.MQTTv311,
             "MQTTv31": mqtt.MQTTv31,
             "default": None,
         }[self.config.value_str("protocol", default="MQTTv311")]
+        self.v5 = self.protocol == mqtt.MQTTv5
         self.transport = self.config.value_str("transport", default="tcp")
-        self.clean_session = self.config.value_str("clean_session", default=None)
+        self.clean_session = self.config.value_bool(
+            "clean_session", default=None, required=False
+        )
+        self.topic_aliases = self.config.value_bool(
+            "topic_aliases", default=True, required=False
+        )
+        self.network_loop = self.config.value_str("network_loop", default="batch")
+        if self.network_loop not in NETWORK_LOOPS:
+            raise Exception(
+                f"Invalid value of network_loop '{self.network_loop}'! "
+                + f"The value must be one of {', '.join(NETWORK_LOOPS)}."
+            )
         self.client = None
         self.connected = False
+        self.wakeup = None
+
+        # topic aliases of MQTT v5, the broker sets the maximum number of aliases
+        self.alias_maximum = 0
+        self.aliases = {}
+        self.alias_properties = {}
+        self.alias_lock = threading.Lock()
+
         self.on_connect_ext = None
         self.on_message_ext = None
         self.on_error_ext = None
+        self.spool = None
+        self.replay_thread = None
         self.log.info(f"The MQTT client configured for {self.address}.")
         self.log.debug(f"The MQTT object is {self}.")
 
     def __str__(self):
         return (
             f"{self.__class__}: name={self.name}, address={self.address}, port={self.port}, keepalive={self.keepalive}, "
-            + f"reconnect_after={self.reconnect_after}, loop_timeout={self.loop_timeout}, connected={self.connected}"
+            + f"reconnect_after={self.reconnect_after}, loop_timeout={self.loop_timeout}, network_loop={self.network_loop}, "
+            + f"v5={self.v5}, connected={self.connected}"
         )
 
     def on_error(self, exception):
@@ -61,27 +167,57 @@ class MQTT(Component):
         if self.on_error_ext is not None:
             self.on_error_ext(exception)
 
+    def message_properties(self, message):
+        """
+        Return the correlation data and the response topic of the MQTT v5 message
+        or None when the message does not have them.
+        """
+        props = getattr(message, "properties", None)
+        if not self.v5 or props is None:
+            return None
+        correlation_data = getattr(props, "CorrelationData", None)
+        response_topic = getattr(props, "ResponseTopic", None)
+        if correlation_data is None and response_topic is None:
+            return None
+        return Map(correlation_data=correlation_data, response_topic=response_topic)
+
     def on_message(self, client, userdata, message):
         topic_name = message._topic.decode("utf-8")
-        payload = str(message.payload.decode("utf-8"))
-        self.log.info(f"--> recv: {topic_name}, payload={payload}")
+        # payloads of binary codecs are passed as bytes
+        try:
+            payload = message.payload.decode("utf-8")
+        except UnicodeDecodeError:
+            payload = message.payload
+        properties = self.message_properties(message)
+        self.log.info(
+            f"--> recv: {topic_name}, payload={payload}"
+            + (f", properties={properties}" if properties is not None else "")
+        )
         if self.on_message_ext is not None:
             try:
-                self.on_message_ext(topic_name, payload)
+                self.on_message_ext(topic_name, payload, properties)
             except Exception as e:
                 self.on_error(e)
 
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        with self.alias_lock:
+            self.aliases = {}
+            self.alias_properties = {}
+            self.alias_maximum = 0
+            if self.topic_aliases and properties is not None:
+                self.alias_maximum = getattr(properties, "TopicAliasMaximum", 0)
         self.connected = True
         self.client.on_message = self.on_message
         self.log.info(f"Connected to the MQTT broker at {self.address}:{self.port}")
+        if self.alias_maximum > 0:
+            self.log.debug(f"The broker accepts {self.alias_maximum} topic aliases.")
         if self.on_connect_ext is not None:
             try:
                 self.on_connect_ext(client, userdata, flags, rc)
             except Exception as e:
                 self.on_error(e)
 
-    def on_disconnect(self, client, userdata, rc):
+    def on_disconnect(self, client, userdata, rc, properties=None):
         try:
             self.log.info(f"Disconnected from the MQTT broker.")
             self.connected = False
@@ -90,10 +226,15 @@ class MQTT(Component):
         except Exception as e:
             self.on_error(e)
 
-    def init_client(self):
-        self.client = mqtt.Client(
+    def init_client(self, client_class=None):
+        if client_class is None:
+            client_class = (
+                mqtt.Client if self.network_loop == "paho" else BufferedClient
+            )
+        # clean session is not used with MQTT v5, the clean start flag is set on connect
+        self.client = client_class(
             self.client_name,
-            clean_session=self.clean_session,
+            clean_session=self.clean_session if not self.v5 else None,
             protocol=self.protocol,
             transport=self.transport,
         )
@@ -106,26 +247,158 @@ class MQTT(Component):
             self.client.username_pw_set(username=self.username, password=self.password)
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
+        if self.network_loop == "batch":
+            self.watch_writes()
 
     def subscribe(self, topic):
         self.log.info(f"Subscribing to {topic}")
         self.client.subscribe(topic)
 
-    def publish(self, topic, data):
+    def set_spool(self, spool):
+        """
+        Set the spool where the messages are written when the client is not connected.
+        """
+        self.spool = spool
+
+    def connect(self):
+        clean_start = (
+            self.clean_session
+            if self.v5 and self.clean_session is not None
+            else mqtt.MQTT_CLEAN_START_FIRST_ONLY
+        )
+        self.client.connect(
+            self.address,
+            port=self.port,
+            keepalive=self.keepalive,
+            clean_start=clean_start,
+        )
+
+    def _publish(self, topic, data, retain=False, properties=None):
+        """
+        Publish the message with MQTT v5 `properties`, a map with `correlation_data`,
+        `response_topic` and `expiry` properties. The topic is replaced by its alias
+        when the broker accepts topic aliases.
+        """
+        if not self.v5:
+            return self.client.publish(topic, data, retain=retain)
+        values = {}
+        if properties is not None:
+            if properties.correlation_data is not None:
+                values["CorrelationData"] = properties.correlation_data
+            if properties.response_topic is not None:
+                values["ResponseTopic"] = properties.response_topic
+            if properties.expiry:
+                values["MessageExpiryInterval"] = int(math.ceil(properties.expiry))
+        if self.alias_maximum == 0:
+            props = PublishProperties(**values) if len(values) > 0 else None
+            return self.client.publish(topic, data, retain=retain, properties=props)
+        # the message that sets the alias must be queued before the messages that use it
+        with self.alias_lock:
+            alias = self.aliases.get(topic)
+            new_alias = alias is None and len(self.aliases) < self.alias_maximum
+            if new_alias:
+                alias = len(self.aliases) + 1
+                self.aliases[topic] = alias
+            if alias is None:
+                props = PublishProperties(**values) if len(values) > 0 else None
+                return self.client.publish(topic, data, retain=retain, properties=props)
+            if len(values) > 0:
+                props = PublishProperties(TopicAlias=alias, **values)
+            else:
+                props = self.alias_properties.get(alias)
+                if props is None:
+                    props = PublishProperties(TopicAlias=alias)
+                    self.alias_properties[alias] = props
+            return self.client.publish(
+                topic if new_alias else "", data, retain=retain, properties=props
+            )
+
+    def publish(self, topic, data, retain=False, properties=None):
+        if self.spool is not None:
+            # messages are spooled until all older messages are replayed to keep their order
+            with self.spool.lock:
+                if not self.connected or self.spool.pending():
+                    self.log.info(f"<-- spool: {topic}, data={data}")
+                    self.spool.append(topic, data, retain)
+                    return
+                self._publish(topic, data, retain, properties)
+            self.log.info(f"<-- send: {topic}, data={data}")
+            return
         self.log.info(f"<-- send: {topic}, data={data}")
-        self.client.publish(topic, data)
+        self._publish(topic, data, retain, properties)
+
+    def _replay_publish(self, topic, payload, retain):
+        if not self.connected:
+            return False
+        return self._publish(topic, payload, retain).rc == mqtt.MQTT_ERR_SUCCESS
+
+    def replay(self):
+        """
+        Replay the spooled messages that can be sent in one replay interval. Return True
+        when all messages were replayed.
+        """
+        if self.spool.replay_rate > 0:
+            max_messages = max(1, int(self.spool.replay_rate * REPLAY_INTERVAL))
+        else:
+            max_messages = MAX_READ_PACKETS
+        count = self.spool.replay(self._replay_publish, max_messages)
+        if count > 0:
+            self.log.debug(f"Replayed {count} spooled messages.")
+        if not self.spool.pending():
+            m = self.spool.metrics()
+            self.log.info(
+                f"The spool was replayed, {m.replayed} messages replayed, {m.expired} expired "
+                + f"and {m.dropped_segments} segments dropped."
+            )
+            return True
+        return False
+
+    def replay_worker(self, exit_event):
+        """
+        The worker that replays the spooled messages when the client is connected.
+        """
+        while not exit_event.is_set():
+            if self.connected and self.spool.pending():
+                self.log.info("Replaying the spooled messages.")
+                while self.connected and not exit_event.is_set():
+                    try:
+                        if self.replay():
+                            break
+                    except Exception as e:
+                        self.on_error(Exception(f"Cannot replay the spool. {str(e)}"))
+                        exit_event.wait(self.reconnect_after)
+                    if self.spool.replay_rate > 0:
+                        exit_event.wait(REPLAY_INTERVAL)
+            exit_event.wait(REPLAY_INTERVAL)
+
+    async def replay_async(self, stop):
+        """
+        The task that replays the spooled messages in the asyncio runtime.
+        """
+        while not stop.is_set():
+            if self.connected and self.spool.pending():
+                self.log.info("Replaying the spooled messages.")
+                while self.connected and not stop.is_set():
+                    try:
+                        if self.replay():
+                            break
+                    except Exception as e:
+                        self.on_error(Exception(f"Cannot replay the spool. {str(e)}"))
+                        await wait_event(stop, self.reconnect_after)
+                    if self.spool.replay_rate > 0:
+                        await wait_event(stop, REPLAY_INTERVAL)
+                    else:
+                        await asyncio.sleep(0)
+            await wait_event(stop, REPLAY_INTERVAL)
 
     def __wait_for_connection(self, exit_event, reconnect=False):
         if reconnect or self.client is None or not self.connected:
             if self.client is not None:
-                self.client.disconnect()
-                self.connected = False
+                self.disconnect()
             self.init_client()
             while not exit_event.is_set():
                 try:
-                    self.client.connect(
-                        self.address, port=self.port, keepalive=self.keepalive
-                    )
+                    self.connect()
                     break
                 except Exception as e:
                     self.on_error(
@@ -146,13 +419,113 @@ class MQTT(Component):
             exit_event.wait(0.2)
         return self.connected
 
+    def disconnect(self):
+        """
+        Disconnect the client from the broker. The disconnect packet is sent right away.
+        """
+        self.client.disconnect()
+        self.client.loop_write()
+        self.connected = False
+        self.close_wakeup()
+
+    def watch_writes(self):
+        """
+        Let the client wake up the batch network loop when there are packets to be sent.
+        Packets published by other threads are queued and the loop writes them in one pass.
+        """
+        self.close_wakeup()
+        self.wakeup = wakeup = socket.socketpair()
+        for x in wakeup:
+            x.setblocking(False)
+
+        def _register_write(client, userdata, sock):
+            # the socket pair is closed when the client disconnects
+            try:
+                wakeup[1].send(b"\0")
+            except OSError:
+                pass
+
+        self.client.on_socket_register_write = _register_write
+
+    def close_wakeup(self):
+        if self.wakeup is not None:
+            for x in self.wakeup:
+                x.close()
+            self.wakeup = None
+
+    def loop_batch(self, timeout):
+        """
+        Run one pass of the batch network loop. Wait at most `timeout` seconds for the socket
+        to be readable or for packets to be sent, read all available packets, write all queued
+        packets and handle keepalive pings.
+        """
+        sock = self.client.socket()
+        if sock is None:
+            return mqtt.MQTT_ERR_NO_CONN
+        if self.client.pending() or (hasattr(sock, "pending") and sock.pending() > 0):
+            timeout = 0
+        wlist = [sock] if self.client.want_write() else []
+        try:
+            rlist, wlist, _ = select.select([sock, self.wakeup[0]], wlist, [], timeout)
+        except (TypeError, ValueError, OSError):
+            return mqtt.MQTT_ERR_CONN_LOST
+        if self.wakeup[0] in rlist:
+            try:
+                self.wakeup[0].recv(RECV_SIZE)
+            except BlockingIOError:
+                pass
+        if sock in rlist or self.client.pending():
+            rc = self.client.loop_read_all()
+            if rc != mqtt.MQTT_ERR_SUCCESS or self.client.socket() is None:
+                return rc
+        if self.client.want_write():
+            rc = self.client.loop_write()
+            if rc != mqtt.MQTT_ERR_SUCCESS or self.client.socket() is None:
+                return rc
+        return self.client.loop_misc()
+
+    def start(self, exit_event):
+        super().start(exit_event)
+        if self.spool is not None:
+            self.replay_thread = threading.Thread(
+                target=self.replay_worker, args=(exit_event,), daemon=True
+            )
+            self.replay_thread.start()
+
+    def join(self):
+        super().join()
+        if self.replay_thread is not None and self.replay_thread.is_alive():
+            self.replay_thread.join()
+        if self.spool is not None:
+            self.spool.close()
+
+    def is_alive(self):
+        """
+        Return True when the worker thread and the replay thread of the spool are running.
+        """
+        return super().is_alive() and (
+            self.replay_thread is None or self.replay_thread.is_alive()
+        )
+
     def worker(self, exit_event):
+        if self.network_loop == "paho":
+            return self.worker_paho(exit_event)
         self.__wait_for_connection(exit_event)
+        connect_time = time.time()
         try:
             while not exit_event.is_set():
                 try:
-                    self.client.loop(timeout=self.loop_timeout, max_packets=1)
-                    if not self.connected:
+                    # the socket is closed when the broker refuses or drops the connection
+                    rc = self.loop_batch(self.loop_timeout)
+                    if rc != mqtt.MQTT_ERR_SUCCESS or self.client.socket() is None:
+                        raise Exception(
+                            f"The connection to the MQTT broker was lost, rc={rc}. "
+                        )
+                    # the broker has keepalive seconds to acknowledge the connection
+                    if (
+                        not self.connected
+                        and time.time() - connect_time > self.keepalive
+                    ):
                         raise Exception("Not connected to MQTT broker.")
                 except Exception as e:
                     self.on_error(
@@ -163,7 +536,119 @@ class MQTT(Component):
                     )
                     exit_event.wait(self.reconnect_after)
                     self.__wait_for_connection(exit_event, reconnect=True)
+                    connect_time = time.time()
+        finally:
+            if self.connected:
+                self.disconnect()
+            self.close_wakeup()
+            self.log.info("MQTT worker ended.")
+
+    def worker_paho(self, exit_event):
+        """
+        The worker that runs the network loop of the client in the paho's own thread.
+        The worker watches the connection and reconnects the client when it is lost.
+        """
+        try:
+            while not exit_event.is_set():
+                self.__wait_for_connection(exit_event, reconnect=True)
+                if exit_event.is_set():
+                    break
+                self.client.loop_start()
+                self.wait_is_connected(exit_event, timeout=self.keepalive)
+                while self.connected and not exit_event.wait(self.loop_timeout):
+                    pass
+                self.client.loop_stop()
+                if not exit_event.is_set():
+                    self.on_error(
+                        Exception(
+                            "Not connected to MQTT broker. "
+                            + f"Will attemmpt to reconnect after {self.reconnect_after} seconds."
+                        )
+                    )
+                    exit_event.wait(self.reconnect_after)
+        finally:
+            if self.connected:
+                self.disconnect()
+            self.log.info("MQTT worker ended.")
+
+    def watch_socket(self, loop):
+        """
+        Let the event `loop` watch the socket of the client. The loop calls the client's
+        `loop_read` when the socket is readable and `loop_write` when there are data to be sent.
+        """
+
+        def _read(client):
+            client.loop_read_all()
+            if client.pending():
+                loop.call_soon(_read, client)
+
+        def _on_socket_open(client, userdata, sock):
+            # publishes are sent as soon as they are made, do not delay them
+            if self.transport == "tcp":
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            loop.add_reader(sock, _read, client)
+
+        self.client.on_socket_open = _on_socket_open
+        self.client.on_socket_close = lambda client, userdata, sock: loop.remove_reader(
+            sock
+        )
+        self.client.on_socket_register_write = (
+            lambda client, userdata, sock: loop.add_writer(sock, client.loop_write)
+        )
+        self.client.on_socket_unregister_write = (
+            lambda client, userdata, sock: loop.remove_writer(sock)
+        )
+
+    async def worker_async(self, exit_event, stop):
+        """
+        The worker of the MQTT client for the asyncio runtime. The socket of the client is
+        watched by the event loop and the `loop_misc` of the client that handles keepalive
+        pings is called every `loop_timeout` seconds.
+        """
+        loop = asyncio.get_event_loop()
+        replay = None
+        if self.spool is not None:
+            replay = loop.create_task(self.replay_async(stop))
+        try:
+            while not stop.is_set():
+                if self.client is not None:
+                    self.client.disconnect()
+                    self.connected = False
+                # the event loop reads and writes all available packets in one pass
+                self.init_client(BufferedClient)
+                self.watch_socket(loop)
+                try:
+                    self.connect()
+                except Exception as e:
+                    self.on_error(
+                        Exception(
+                            f"Cannot connect to the MQTT broker at {self.address}:{self.port}. {str(e)}. "
+                            + f"Will attemmpt to reconnect after {self.reconnect_after} seconds."
+                        )
+                    )
+                    await wait_event(stop, self.reconnect_after)
+                    continue
+                # wait for the connection to be acknowledged
+                start_time = time.time()
+                while not self.connected and time.time() - start_time <= self.keepalive:
+                    if await wait_event(stop, 0.2):
+                        break
+                while self.connected and not stop.is_set():
+                    self.client.loop_misc()
+                    await wait_event(stop, self.loop_timeout)
+                if not stop.is_set():
+                    self.on_error(
+                        Exception(
+                            "Not connected to MQTT broker. "
+                            + f"Will attemmpt to reconnect after {self.reconnect_after} seconds."
+                        )
+                    )
+                    await wait_event(stop, self.reconnect_after)
         finally:
+            if replay is not None:
+                await replay
+                self.spool.close()
             if self.connected:
                 self.client.disconnect()
+                self.client.loop_write()
             self.log.info("MQTT worker ended.")
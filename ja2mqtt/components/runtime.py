@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas@vitvar.com
+
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+import collections
+import logging
+
+from ja2mqtt.utils import Map
+
+from . import Component
+from .simulator import Simulator
+
+
+class LoopBuffer:
+    """
+    LoopBuffer replaces the serial buffer queue in the asyncio runtime. Instead of queuing
+    the data for the bridge worker, it schedules the `callback` in the event loop that is
+    called with a batch of all data added to the buffer until then.
+    """
+
+    def __init__(self, loop, callback, log):
+        self.loop = loop
+        self.callback = callback
+        self.log = log
+        self.items = collections.deque()
+        self.scheduled = False
+        self.max_depth = 0
+        self.received = 0
+
+    def call(self):
+        self.scheduled = False
+        items = [self.items.popleft() for _ in range(len(self.items))]
+        try:
+            self.callback(items)
+        except Exception as e:
+            self.log.error(
+                f"Error occurred while processing the data {items}. {str(e)}"
+            )
+
+    def put(self, data):
+        self.received += 1
+        self.items.append(data)
+        self.max_depth = max(self.max_depth, len(self.items))
+        if not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon_threadsafe(self.call)
+
+    def offer(self, items):
+        for data in items:
+            self.put(data)
+        return True
+
+    def qsize(self):
+        return len(self.items)
+
+    def metrics(self):
+        return Map(
+            depth=len(self.items), max_depth=self.max_depth, received=self.received
+        )
+
+
+class AsyncRuntime(Component):
+    """
+    AsyncRuntime runs the MQTT client and the serial interfaces and bridges of `panels`, a list
+    of (serial, bridge) tuples, in a single asyncio event loop. The loop watches the serial ports
+    and the MQTT socket and the data read from a serial port are evaluated by the bridge in
+    the same thread, so there are no queue hops and thread switches between the components.
+    """
+
+    def __init__(self, config, mqtt, panels):
+        super().__init__(config, "runtime")
+        self.mqtt = mqtt
+        self.panels = panels
+        self.simulators = [
+            serial.ser for serial, _ in panels if isinstance(serial.ser, Simulator)
+        ]
+
+    def on_task_done(self, exit_event, task):
+        if not task.cancelled() and task.exception() is not None:
+            self.log.error(
+                f"The runtime task ended with an error. {str(task.exception())}"
+            )
+            exit_event.set()
+
+    async def main(self, exit_event):
+        loop = asyncio.get_event_loop()
+        stop = asyncio.Event()
+        tasks = [loop.create_task(self.mqtt.worker_async(exit_event, stop))]
+        for serial, bridge in self.panels:
+            serial.buffer = LoopBuffer(loop, bridge.process_batch, bridge.log)
+            tasks.append(loop.create_task(serial.worker_async(exit_event, stop)))
+            tasks.append(loop.create_task(serial.writer_async(stop)))
+        for task in tasks:
+            task.add_done_callback(lambda t: self.on_task_done(exit_event, t))
+        await loop.run_in_executor(None, exit_event.wait)
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def worker(self, exit_event):
+        self.log.info("Running the asyncio runtime.")
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.main(exit_event))
+        finally:
+            loop.close()
+            self.log.info("Asyncio runtime ended.")
+
+    def start(self, exit_event):
+        """
+        Start the event loop thread and the threads of simulators if they are used.
+        """
+        super().start(exit_event)
+        for simulator in self.simulators:
+            simulator.start(exit_event)
+
+    def join(self):
+        super().join()
+        for simulator in self.simulators:
+            simulator.join()
+
+    def is_alive(self):
+        return super().is_alive() and all(x.is_alive() for x in self.simulators)
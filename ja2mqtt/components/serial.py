@@ -3,19 +3,32 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import asyncio
+import collections
+import functools
+import heapq
+import itertools
 import json
 import logging
 import os
 import re
 import threading
 import time
-from queue import Queue
+from queue import Empty
 
 import paho.mqtt.client as mqtt
 import serial as py_serial
 
 from ja2mqtt.config import Config, ENCODING
-from ja2mqtt.utils import Map, PythonExpression, deep_eval, deep_merge, merge_dicts
+from ja2mqtt.utils import (
+    Map,
+    PythonExpression,
+    deep_eval,
+    deep_merge,
+    merge_dicts,
+    wait_any,
+    wait_event,
+)
 
 from . import Component
 from .simulator import Simulator
@@ -25,6 +38,28 @@ class SerialJA121TException(Exception):
     pass
 
 
+# prfstate codec tables; the item `n` of a byte entry is the state of the peripheral
+# at offset `n` in the byte (the least significant bit is the first peripheral)
+PRFSTATE_BYTE_STATES = tuple(
+    tuple("ON" if (b >> n) & 1 else "OFF" for n in range(8)) for b in range(256)
+)
+
+
+@functools.lru_cache(maxsize=None)
+def prfstate_keys(bits):
+    """
+    Return a tuple of peripheral IDs as strings for prfstate with `bits` bits.
+    """
+    return tuple(str(x) for x in range(bits))
+
+
+def prfstate_bytes(prfstate):
+    """
+    Convert the prfstate hexadecimal string to bytes. A trailing half byte is ignored.
+    """
+    return bytes.fromhex(prfstate[: len(prfstate) // 2 * 2])
+
+
 def decode_prfstate(prfstate):
     """
     Decode prfstate from a hexadecimal string to a dictionary, where the keys
@@ -32,44 +67,362 @@ def decode_prfstate(prfstate):
     of the respective peripherals. For details see JA-121T documentation.
     """
     try:
-        parts = [
-            bin(int(prfstate[i : i + 2], 16))[2:].zfill(8)
-            for i in range(0, len(prfstate), 2)
-        ]
-
-        peripherals = {}
-        for x in range(0, int(len(prfstate) / 2)):
-            j = 0
-            for y in range(x * 8 + 7, x * 8 - 1, -1):
-                peripherals[y] = parts[x][j]
-                j += 1
-
-        return {
-            str(k): ("ON" if peripherals[k] == "1" else "OFF")
-            for k in sorted(peripherals.keys())
-        }
+        data = prfstate_bytes(prfstate)
+        return dict(
+            zip(
+                prfstate_keys(len(data) * 8),
+                itertools.chain.from_iterable(PRFSTATE_BYTE_STATES[b] for b in data),
+            )
+        )
+    except Exception as e:
+        raise SerialJA121TException(
+            f"Cannot decode prfstate string {prfstate}. {str(e)}"
+        )
+
+
+def decode_prfstate_mask(prfstate):
+    """
+    Decode prfstate from a hexadecimal string to an integer bitmask, where the bit `n`
+    represents the state of the peripheral with ID `n` (1 is ON, 0 is OFF).
+    """
+    try:
+        return int.from_bytes(prfstate_bytes(prfstate), "little")
     except Exception as e:
         raise SerialJA121TException(
             f"Cannot decode prfstate string {prfstate}. {str(e)}"
         )
 
 
+def decode_prfstate_batch(prfstates, use_numpy=False):
+    """
+    Decode a list of prfstate hexadecimal strings of the same length. The result is
+    a two-dimensional memoryview with one row of packed bytes per prfstate, or a NumPy
+    bool matrix with one row per prfstate and one column per peripheral when `use_numpy`
+    is True. The NumPy matrix requires the `numpy` package to be installed.
+    """
+    try:
+        size = len(prfstates[0]) // 2 if len(prfstates) > 0 else 0
+        if any(len(x) // 2 != size for x in prfstates):
+            raise Exception("The prfstate strings must be of the same length.")
+        data = b"".join(prfstate_bytes(x) for x in prfstates)
+    except Exception as e:
+        raise SerialJA121TException(f"Cannot decode prfstate strings. {str(e)}")
+    if not use_numpy:
+        return memoryview(data).cast("B", shape=[len(prfstates), size])
+    try:
+        import numpy as np
+    except ImportError:
+        raise SerialJA121TException(
+            "The numpy package is required to decode prfstate strings to a matrix."
+        )
+    matrix = np.frombuffer(data, dtype=np.uint8).reshape(len(prfstates), size)
+    return np.unpackbits(matrix, axis=1, bitorder="little").astype(bool)
+
+
+def encode_prfstate_mask(mask, prf_state_bits=24):
+    """
+    Encode prfstate from an integer bitmask to a hexadecimal string. This is an inverse
+    function to decode_prfstate_mask.
+    """
+    size = prf_state_bits // 8
+    return (mask & ((1 << size * 8) - 1)).to_bytes(size, "little").hex().upper()
+
+
 def encode_prfstate(prf, prf_state_bits=24):
     """
     Encode prfstate from the prf state object. This is an inverse funtion to decode_prfstate,
     i.e. it must hold that `encode_prfstate(decode_prfstate(X)) == X`
     """
-    b = "".zfill(prf_state_bits)
-    for p in prf.keys():
-        if prf[p] == "ON":
-            index = int(p)
-            b = b[:index] + "1" + b[index + 1 :]
-    r = ""
-    for x in range(len(b) // 8):
-        h = hex(int(b[x * 8 : x * 8 + 8][::-1], 2))
-        h2 = h[2:].upper().zfill(2)
-        r += h2
-    return r
+    mask = 0
+    for p, state in prf.items():
+        if state == "ON":
+            mask |= 1 << int(p)
+    return encode_prfstate_mask(mask, prf_state_bits)
+
+
+# maximum length of a line read from the serial interface
+MAX_LINE_LENGTH = 4096
+
+# priority lanes of commands written to the serial interface
+WRITE_PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class WriteQueue:
+    """
+    WriteQueue is a bounded priority queue of lines to be written to the serial interface.
+    Lines with a higher priority are written first, lines with the same priority are written
+    in the order they were added. When the queue is full, the line with the lowest priority
+    that was added last is dropped. The queue tracks its depth, time lines spent waiting
+    in the queue, and the number of written and dropped lines. The optional `on_put` function
+    is called when a line is added to the queue.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.heap = []
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.written = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.wait_time_total = 0
+        self.wait_time_max = 0
+        self.on_put = None
+
+    def __len__(self):
+        with self.cond:
+            return len(self.heap)
+
+    def put(self, line, priority="normal", on_write=None):
+        """
+        Add the line to the queue. Return the item of the dropped line when the queue is full,
+        which can be the added line itself, or None.
+        """
+        lane = WRITE_PRIORITIES.get(priority)
+        if lane is None:
+            raise SerialJA121TException(f"Invalid write priority '{priority}'.")
+        with self.cond:
+            self.seq += 1
+            item = (lane, self.seq, time.time(), line, on_write, priority)
+            dropped = None
+            if self.maxsize > 0 and len(self.heap) >= self.maxsize:
+                dropped = max(self.heap)
+                if item < dropped:
+                    self.heap.remove(dropped)
+                    heapq.heapify(self.heap)
+                else:
+                    dropped = item
+                self.dropped += 1
+            if dropped is not item:
+                heapq.heappush(self.heap, item)
+                self.max_depth = max(self.max_depth, len(self.heap))
+                self.cond.notify()
+        if dropped is not item and self.on_put is not None:
+            self.on_put()
+        return dropped
+
+    def wait(self, timeout):
+        """
+        Wait until the queue is not empty. Return True if it is not empty.
+        """
+        with self.cond:
+            if len(self.heap) == 0:
+                self.cond.wait(timeout)
+            return len(self.heap) > 0
+
+    def pop(self):
+        """
+        Remove and return the item with the highest priority or None when the queue is empty.
+        """
+        with self.cond:
+            if len(self.heap) == 0:
+                return None
+            item = heapq.heappop(self.heap)
+            wait_time = time.time() - item[2]
+            self.written += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+            return item
+
+    def metrics(self):
+        """
+        Return the queue metrics.
+        """
+        with self.cond:
+            return Map(
+                depth=len(self.heap),
+                max_depth=self.max_depth,
+                written=self.written,
+                dropped=self.dropped,
+                wait_time_avg=self.wait_time_total / self.written
+                if self.written > 0
+                else 0,
+                wait_time_max=self.wait_time_max,
+            )
+
+
+# overflow policies of the serial buffer
+BUFFER_OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_class")
+
+
+class SerialBuffer:
+    """
+    SerialBuffer is a buffer of lines read from the serial interface that can be bounded. When
+    the buffer is full, the `overflow` policy determines how a new line is added: `block` waits until
+    the bridge takes a line from the buffer, `drop_oldest` drops the oldest line, and `drop_class`
+    drops the oldest line of the first of `drop_classes` patterns that has a line in the buffer,
+    or the oldest line when there is no such line. The buffer tracks its high-water mark and the
+    number of dropped lines. The `maxsize` of 0 means that the buffer is not bounded.
+    """
+
+    def __init__(self, maxsize, overflow="drop_class", drop_classes=(), log=None):
+        if overflow not in BUFFER_OVERFLOW_POLICIES:
+            raise SerialJA121TException(
+                f"Invalid serial buffer overflow policy '{overflow}'."
+            )
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.drop_classes = [re.compile(x) for x in drop_classes]
+        self.log = log if log is not None else logging.getLogger("serial")
+
+        # entries are lists [class, item, removed], the entries of drop classes are also
+        # in the deques of their classes, so that they can be dropped without a scan;
+        # dropped entries are marked as removed and skipped when the items are taken
+        self.items = collections.deque()
+        self.classes = [collections.deque() for _ in self.drop_classes]
+        self.size = 0
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.exit_event = None
+        self.received = 0
+        self.dropped = 0
+        self.dropped_classes = [0] * len(self.drop_classes)
+        self.max_depth = 0
+        self.blocked_time = 0
+        self.last_warning = None
+
+    def classify(self, item):
+        """
+        Return the index of the first drop class that matches the line of the item or None.
+        """
+        if self.overflow != "drop_class":
+            return None
+        line = item[0] if isinstance(item, tuple) else item
+        for i, pattern in enumerate(self.drop_classes):
+            if pattern.match(line):
+                return i
+        return None
+
+    def drop(self):
+        for i, entries in enumerate(self.classes):
+            if entries:
+                entry = entries.popleft()
+                entry[2] = True
+                self.size -= 1
+                self.dropped_classes[i] += 1
+                self.dropped += 1
+                # remove the dropped entries when they are the majority of the entries
+                if len(self.items) > 2 * self.size + 16:
+                    self.items = collections.deque(x for x in self.items if not x[2])
+                return
+        self.pop()
+        self.dropped += 1
+
+    def pop(self):
+        entry = self.items.popleft()
+        while entry[2]:
+            entry = self.items.popleft()
+        if entry[0] is not None:
+            self.classes[entry[0]].popleft()
+        self.size -= 1
+        return entry[1]
+
+    def warn(self, message):
+        now = time.time()
+        if self.last_warning is None or now - self.last_warning >= 10:
+            self.last_warning = now
+            self.log.warning(f"{message} The serial buffer metrics: {self._metrics()}")
+
+    def put(self, item):
+        """
+        Add the item to the buffer. The item is a line or a tuple of a line and a request.
+        """
+        cls = self.classify(item)
+        with self.lock:
+            self.received += 1
+            if self.maxsize > 0 and self.size >= self.maxsize:
+                if self.overflow == "block":
+                    start_time = time.time()
+                    self.warn("The serial buffer is full, reading is blocked.")
+                    while self.size >= self.maxsize:
+                        if self.exit_event is not None and self.exit_event.is_set():
+                            self.dropped += 1
+                            return
+                        self.not_full.wait(1)
+                    self.blocked_time += time.time() - start_time
+                else:
+                    self.drop()
+                    self.warn("The serial buffer is full, lines were dropped.")
+            self.append(cls, item)
+
+    def offer(self, items):
+        """
+        Add all items to the buffer without waiting. When the overflow policy is `block` and
+        there is no room for all items, no item is added and False is returned.
+        """
+        classes = [self.classify(item) for item in items]
+        with self.lock:
+            if (
+                self.overflow == "block"
+                and self.maxsize > 0
+                and self.size + len(items) > self.maxsize
+            ):
+                return False
+            for cls, item in zip(classes, items):
+                self.received += 1
+                if self.maxsize > 0 and self.size >= self.maxsize:
+                    self.drop()
+                    self.warn("The serial buffer is full, lines were dropped.")
+                self.append(cls, item)
+            return True
+
+    def append(self, cls, item):
+        entry = [cls, item, False]
+        self.items.append(entry)
+        if cls is not None:
+            self.classes[cls].append(entry)
+        self.size += 1
+        self.max_depth = max(self.max_depth, self.size)
+        self.not_empty.notify()
+
+    def get(self, timeout=None):
+        """
+        Remove and return the oldest item. Raise `Empty` when there is no item within the `timeout`.
+        """
+        with self.lock:
+            if self.size == 0:
+                self.not_empty.wait(timeout)
+                if self.size == 0:
+                    raise Empty()
+            item = self.pop()
+            self.not_full.notify()
+            return item
+
+    def get_all(self):
+        """
+        Remove and return all items in the buffer without waiting.
+        """
+        with self.lock:
+            items = [x[1] for x in self.items if not x[2]]
+            self.items.clear()
+            for entries in self.classes:
+                entries.clear()
+            self.size = 0
+            self.not_full.notify_all()
+            return items
+
+    def qsize(self):
+        return self.size
+
+    def _metrics(self):
+        return Map(
+            depth=self.size,
+            max_depth=self.max_depth,
+            received=self.received,
+            dropped=self.dropped,
+            dropped_classes={
+                p.pattern: n for p, n in zip(self.drop_classes, self.dropped_classes)
+            },
+            blocked_time=self.blocked_time,
+        )
+
+    def metrics(self):
+        """
+        Return the buffer metrics.
+        """
+        with self.lock:
+            return self._metrics()
 
 
 class Serial(Component):
@@ -84,13 +437,25 @@ class Serial(Component):
         `use_simulator` property in the configuration.
         """
         super().__init__(config, "serial")
-        self.buffer = Queue()
+        self.buffer = SerialBuffer(
+            self.config.value_int("buffer_size", default=0, min=0),
+            overflow=self.config.value_str("buffer_overflow", default="drop_class"),
+            drop_classes=self.config.value(
+                "buffer_drop_classes", default=["^OK$"], required=False
+            ),
+            log=self.log,
+        )
         self.wait_on_ready = self.config.value_int("wait_on_ready", default=10)
         self.use_simulator = self.config.value_bool("use_simulator", default=False)
         self.minimum_write_delay = self.config.value_int(
             "minimum_write_delay", default=1
         )
         self.last_write_time = None
+        self.write_queue = WriteQueue(
+            self.config.value_int("write_queue_size", default=32, min=0)
+        )
+        self.writer_thread = None
+        self.rx_data = bytearray()
         if not self.use_simulator:
             self.ser = None
             self.port = self.config.value_str("port", required=True)
@@ -156,34 +521,86 @@ class Serial(Component):
             except Exception as e:
                 self.log.error(f"Cannot close the serial port {self.port}. {str(e)}")
             self.ser = None
+        del self.rx_data[:]
+
+    def metrics(self):
+        """
+        Return the metrics of the serial buffer and the write queue.
+        """
+        return Map(buffer=self.buffer.metrics(), write_queue=self.write_queue.metrics())
 
-    def writeline(self, line):
+    def writeline(self, line, priority="normal", on_write=None):
+        """
+        Queue a single line of string to be written to the serial port by the writer thread.
+        The `priority` is the priority lane of the line (`high`, `normal` or `low`) and
+        the `on_write` is an optional function called just before the line is written.
+        """
+        self.log.debug(f"Queuing write to serial: {line}, priority={priority}")
+        dropped = self.write_queue.put(line, priority, on_write)
+        if dropped is not None:
+            self.log.warning(
+                f"The serial write queue is full, a command with {dropped[5]} priority was dropped."
+            )
+
+    def write(self, line):
         """
         Write a single line of string to the seiral port. It convers the string to bytes using
         the defined `encoding` and adds a LF at the end.
         """
         self.log.debug(f"Writing to serial: {line}")
         try:
-            current_time = time.time()
-            # wait the minimum_write_delay
-            if (
-                self.last_write_time is not None
-                and current_time - self.last_write_time < self.minimum_write_delay
-            ):
-                waiting_time = self.minimum_write_delay - (
-                    current_time - self.last_write_time
-                )
-                self.log.debug(f"Too frequent writes, waiting {waiting_time}.")
-                time.sleep(waiting_time)
             self.ser.write(bytes(line + "\n", ENCODING))
             self.last_write_time = time.time()
         except Exception as e:
             self.log.error(str(e))
 
+    def call_on_write(self, on_write, line):
+        """
+        Call the `on_write` function of the line. An error of the function is logged and
+        the line is written anyway, so that the writer keeps running.
+        """
+        if on_write is not None:
+            try:
+                on_write()
+            except Exception as e:
+                self.log.error(
+                    f"Error occurred before writing the line {line} to serial. {str(e)}"
+                )
+
+    def writer(self, exit_event):
+        """
+        The writer worker that writes lines from the write queue to the serial port. It waits
+        the `minimum_write_delay` between two writes and then writes the line with the highest
+        priority, so that commands with a higher priority can overtake waiting commands.
+        """
+        try:
+            while not exit_event.is_set():
+                if not self.write_queue.wait(timeout=1):
+                    continue
+                # wait the minimum_write_delay
+                if self.last_write_time is not None:
+                    waiting_time = self.minimum_write_delay - (
+                        time.time() - self.last_write_time
+                    )
+                    if waiting_time > 0:
+                        self.log.debug(f"Too frequent writes, waiting {waiting_time}.")
+                        if exit_event.wait(waiting_time):
+                            break
+                item = self.write_queue.pop()
+                if item is not None:
+                    _, _, _, line, on_write, _ = item
+                    self.call_on_write(on_write, line)
+                    self.write(line)
+                    self.log.debug(
+                        f"The serial write queue metrics: {self.write_queue.metrics()}"
+                    )
+        finally:
+            self.log.info("Serial writer ended.")
+
     def worker(self, exit_event):
         """
-        The main worker of the serial object that reads data from the serial port and
-        puts them to the queue `buffer`. Althoguh the `worker` method (that only reads
+        The main worker of the serial object that reads all data available in the serial port
+        and puts complete lines to the queue `buffer`. Althoguh the `worker` method (that only reads
         the data from the serial port) can run in parallel with the `writeline` method,
         due to the "global interpreter lock" they both should be thread-safe.
         """
@@ -191,7 +608,11 @@ class Serial(Component):
         try:
             while not exit_event.is_set():
                 try:
-                    x = self.ser.readline()
+                    if isinstance(self.ser, Simulator):
+                        data = self.ser.readline() + b"\n"
+                    else:
+                        # wait for the first byte up to the timeout and take all that arrived
+                        data = self.ser.read(max(1, self.ser.in_waiting))
                 except Exception as e:
                     self.log.error(
                         f"Error occured while reading data from the serial port. {str(e)}"
@@ -199,34 +620,178 @@ class Serial(Component):
                     self.close()
                     self.open(exit_event)
                     continue
-                try:
-                    data_str = x.decode(ENCODING).strip("\r\n").strip()
-                    if data_str != "":
-                        self.log.debug(f"Received data from serial: {data_str}")
-                        self.buffer.put(data_str)
-                except UnicodeDecodeError as e:
-                    self.log.error(str(e))
+                self.received(data)
+        finally:
+            self.close()
+            self.log.info("Serial worker ended.")
+
+    def put_line(self, x):
+        """
+        Decode a line read from the serial port and put it to the `buffer` when it is not empty.
+        """
+        try:
+            data_str = x.decode(ENCODING).strip("\r\n").strip()
+        except UnicodeDecodeError as e:
+            self.log.error(str(e))
+            return
+        if data_str != "":
+            self.log.debug(f"Received data from serial: {data_str}")
+            self.buffer.put(data_str)
+
+    def received(self, data):
+        """
+        Append the data read from the serial port to the receive buffer and put complete lines
+        to the `buffer`. The complete lines are decoded in a single batch and then removed from
+        the receive buffer that is reused for subsequent reads.
+        """
+        rx = self.rx_data
+        rx += data
+        end = rx.rfind(b"\n")
+        if end < 0:
+            if len(rx) > MAX_LINE_LENGTH:
+                self.log.error(
+                    f"No line end in {len(rx)} bytes read from serial, the data were discarded."
+                )
+                del rx[:]
+            return
+        view = memoryview(rx)
+        try:
+            lines = str(view[:end], ENCODING).split("\n")
+        except UnicodeDecodeError:
+            lines = None
+        finally:
+            view.release()
+        if lines is None:
+            # decode the lines one by one so that only the invalid lines are skipped
+            for x in rx[:end].split(b"\n"):
+                self.put_line(x)
+        else:
+            for line in lines:
+                line = line.strip()
+                if line != "":
+                    self.log.debug(f"Received data from serial: {line}")
+                    self.buffer.put(line)
+        del rx[: end + 1]
+
+    def read_ready(self, failed):
+        """
+        Read the data available in the serial port and put complete lines to the `buffer`. This
+        is called by the event loop of the asyncio runtime when the serial port is readable, the
+        `failed` event is set when the data cannot be read.
+        """
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except Exception as e:
+            self.log.error(
+                f"Error occured while reading data from the serial port. {str(e)}"
+            )
+            failed.set()
+            return
+        self.received(data)
+
+    async def worker_async(self, exit_event, stop):
+        """
+        The worker of the serial object for the asyncio runtime. The file descriptor of the
+        serial port is watched by the event loop that calls `read_ready` when data arrive. The
+        simulator does not have a file descriptor, its lines are thus read in the executor.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            while not stop.is_set():
+                if self.ser is None:
+                    await loop.run_in_executor(None, self.open, exit_event)
+                    if self.ser is None:
+                        break
+                if isinstance(self.ser, Simulator):
+                    self.put_line(await loop.run_in_executor(None, self.ser.readline))
                     continue
-                else:
-                    # this is necessary to allow other threads to run too
-                    exit_event.wait(0.2)
+                failed = asyncio.Event()
+                fd = self.ser.fileno()
+                loop.add_reader(fd, self.read_ready, failed)
+                try:
+                    await wait_any(stop, failed)
+                finally:
+                    loop.remove_reader(fd)
+                if failed.is_set():
+                    self.close()
         finally:
             self.close()
             self.log.info("Serial worker ended.")
 
+    async def writer_async(self, stop):
+        """
+        The writer of the serial object for the asyncio runtime. It works the same way as the
+        `writer` but it waits for lines in the write queue and for the `minimum_write_delay`
+        in the event loop.
+        """
+        loop = asyncio.get_event_loop()
+        ready = asyncio.Event()
+        self.write_queue.on_put = lambda: loop.call_soon_threadsafe(ready.set)
+        try:
+            while not stop.is_set():
+                if len(self.write_queue) == 0:
+                    ready.clear()
+                    await wait_any(stop, ready)
+                    continue
+                # wait the minimum_write_delay
+                if self.last_write_time is not None:
+                    waiting_time = self.minimum_write_delay - (
+                        time.time() - self.last_write_time
+                    )
+                    if waiting_time > 0:
+                        self.log.debug(f"Too frequent writes, waiting {waiting_time}.")
+                        if await wait_event(stop, waiting_time):
+                            break
+                item = self.write_queue.pop()
+                if item is not None:
+                    _, _, _, line, on_write, _ = item
+                    self.call_on_write(on_write, line)
+                    if isinstance(self.ser, Simulator):
+                        # the simulator blocks until it responds
+                        await loop.run_in_executor(None, self.write, line)
+                    else:
+                        self.write(line)
+                    self.log.debug(
+                        f"The serial write queue metrics: {self.write_queue.metrics()}"
+                    )
+        finally:
+            self.write_queue.on_put = None
+            self.log.info("Serial writer ended.")
+
     def start(self, exit_event):
         """
-        Start the worker thread of the serial object. If the simulator is used, this also starts
-        the worker thread of the simulator object.
+        Start the worker and writer threads of the serial object. If the simulator is used, this
+        also starts the worker thread of the simulator object.
         """
+        self.buffer.exit_event = exit_event
         super().start(exit_event)
+        self.writer_thread = threading.Thread(
+            target=self.writer, args=(exit_event,), daemon=True
+        )
+        self.writer_thread.start()
         if self.use_simulator and isinstance(self.ser, Simulator):
             self.ser.start(exit_event)
 
     def join(self):
         """
-        Join the worker thread and simulator thread if it exists.
+        Join the worker and writer threads and simulator thread if it exists.
         """
         super().join()
+        if self.writer_thread is not None and self.writer_thread.is_alive():
+            self.writer_thread.join()
         if self.use_simulator and isinstance(self.ser, Simulator):
             self.ser.join()
+
+    def is_alive(self):
+        """
+        Return True when the worker and writer threads and the simulator thread are running.
+        """
+        return (
+            super().is_alive()
+            and self.writer_thread is not None
+            and self.writer_thread.is_alive()
+            and (
+                not (self.use_simulator and isinstance(self.ser, Simulator))
+                or self.ser.is_alive()
+            )
+        )
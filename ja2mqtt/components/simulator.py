@@ -204,3 +204,6 @@ class Simulator:
     def join(self):
         if self.thread is not None and self.thread.is_alive():
             self.thread.join()
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas@vitvar.com
+
+from __future__ import absolute_import, unicode_literals
+
+import glob
+import logging
+import os
+import struct
+import threading
+import time
+
+from ja2mqtt.utils import Map
+
+# header of a record: time of the message, length of the payload, length of the topic, flags
+RECORD_HEADER = struct.Struct(">dIHB")
+FLAG_RETAIN = 1
+
+SEGMENT_PATTERN = "segment-%08d.spool"
+
+
+class Spool:
+    """
+    Spool is an append-only store of MQTT messages on disk. The MQTT client appends the messages
+    it publishes while it is not connected to the broker and replays them in order when it connects.
+    The messages are written to segment files of `segment_size` bytes. The oldest segments are removed
+    when the spool exceeds `max_size` bytes, and messages older than `max_age` seconds are not replayed.
+    The segments that were not replayed are replayed after ja2mqtt restarts.
+    """
+
+    def __init__(self, config):
+        self.log = logging.getLogger("spool")
+        self.directory = config.get_dir_path(config.value_str("dir", required=True))
+        self.segment_size = config.value_int("segment_size", default=1048576, min=1024)
+        self.max_size = config.value_int("max_size", default=67108864, min=0)
+        self.max_age = config.value("max_age", default=86400, required=False)
+        self.replay_rate = config.value_int("replay_rate", default=100, min=0)
+        self.lock = threading.RLock()
+        os.makedirs(self.directory, exist_ok=True)
+
+        # segments on disk from the oldest, the last segment is appended when it is open
+        self.segments = []
+        for path in sorted(glob.glob(os.path.join(self.directory, "segment-*.spool"))):
+            if os.path.getsize(path) == 0:
+                os.remove(path)
+                continue
+            self.segments.append(
+                Map(
+                    path=path,
+                    seq=int(os.path.basename(path)[8:-6]),
+                    size=os.path.getsize(path),
+                    time=os.path.getmtime(path),
+                )
+            )
+        self.file = None
+        self.reader = None
+        self.read_pos = 0
+        self.size = sum(x.size for x in self.segments)
+
+        # metrics
+        self.appended = 0
+        self.replayed = 0
+        self.expired = 0
+        self.dropped_segments = 0
+
+        if self.size > 0:
+            self.log.info(
+                f"The spool in {self.directory} has {len(self.segments)} segments "
+                + f"with {self.size} bytes to be replayed."
+            )
+
+    def pending(self):
+        """
+        Return True if there are messages that were not replayed.
+        """
+        return self.size - self.read_pos > 0
+
+    def _open_segment(self):
+        seq = self.segments[-1].seq + 1 if len(self.segments) > 0 else 1
+        path = os.path.join(self.directory, SEGMENT_PATTERN % seq)
+        self.file = open(path, "ab")
+        self.segments.append(Map(path=path, seq=seq, size=0, time=time.time()))
+
+    def _close_segment(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _remove_segment(self):
+        segment = self.segments.pop(0)
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        self.size -= segment.size
+        self.read_pos = 0
+        try:
+            os.remove(segment.path)
+        except FileNotFoundError:
+            pass
+
+    def _enforce_limits(self):
+        """
+        Remove the oldest segments when the spool exceeds `max_size` bytes or when
+        all messages of the segment are older than `max_age` seconds.
+        """
+        now = time.time()
+        while len(self.segments) > 1:
+            segment = self.segments[0]
+            if self.max_size > 0 and self.size > self.max_size:
+                self.dropped_segments += 1
+                self.log.warning(
+                    f"The spool exceeds {self.max_size} bytes, the oldest segment {segment.path} "
+                    + "was removed and its messages will not be replayed."
+                )
+            elif self.max_age and now - segment.time > self.max_age:
+                self.log.info(
+                    f"The messages in the segment {segment.path} expired, the segment was removed."
+                )
+            else:
+                break
+            self._remove_segment()
+
+    def append(self, topic, payload, retain=False):
+        """
+        Append the message to the spool.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        topic = topic.encode("utf-8")
+        now = time.time()
+        record = (
+            RECORD_HEADER.pack(
+                now, len(payload), len(topic), FLAG_RETAIN if retain else 0
+            )
+            + topic
+            + payload
+        )
+        with self.lock:
+            if self.file is not None and self.segments[-1].size >= self.segment_size:
+                self._close_segment()
+            if self.file is None:
+                self._open_segment()
+            self.file.write(record)
+            self.file.flush()
+            self.segments[-1].size += len(record)
+            self.segments[-1].time = now
+            self.size += len(record)
+            self.appended += 1
+            self._enforce_limits()
+
+    def replay(self, publish, max_messages):
+        """
+        Replay at most `max_messages` oldest messages by calling `publish(topic, payload, retain)`.
+        When `publish` returns False, the message was not published and the replay stops.
+        Return the number of replayed messages.
+        """
+        count = 0
+        with self.lock:
+            self._enforce_limits()
+            now = time.time()
+            while count < max_messages and self.pending():
+                # the segment that is appended is closed so it can be read,
+                # the next message will be appended to a new segment
+                if len(self.segments) == 1:
+                    self._close_segment()
+                if self.reader is None:
+                    self.reader = open(self.segments[0].path, "rb")
+                    self.reader.seek(self.read_pos)
+                header = self.reader.read(RECORD_HEADER.size)
+                record = None
+                if len(header) == RECORD_HEADER.size:
+                    t, payload_len, topic_len, flags = RECORD_HEADER.unpack(header)
+                    data = self.reader.read(topic_len + payload_len)
+                    if len(data) == topic_len + payload_len:
+                        record = (t, data[:topic_len], data[topic_len:], flags)
+                if record is None:
+                    # the end of the segment or an incomplete record after a crash
+                    self._remove_segment()
+                    continue
+                t, topic, payload, flags = record
+                if self.max_age and now - t > self.max_age:
+                    self.expired += 1
+                elif not publish(
+                    topic.decode("utf-8"), payload, bool(flags & FLAG_RETAIN)
+                ):
+                    self.reader.seek(self.read_pos)
+                    break
+                else:
+                    self.replayed += 1
+                    count += 1
+                self.read_pos += RECORD_HEADER.size + len(topic) + len(payload)
+            if not self.pending() and len(self.segments) > 0 and self.file is None:
+                self._remove_segment()
+        return count
+
+    def metrics(self):
+        with self.lock:
+            return Map(
+                segments=len(self.segments),
+                size=self.size - self.read_pos,
+                appended=self.appended,
+                replayed=self.replayed,
+                expired=self.expired,
+                dropped_segments=self.dropped_segments,
+            )
+
+    def close(self):
+        with self.lock:
+            if self.reader is not None:
+                self.reader.close()
+                self.reader = None
+            self._close_segment()
@@ -3,14 +3,20 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import copy
+import hashlib
 import io
 import json
 import logging
 import logging.config
 import os
 import re
+import stat
 import sys
+import tempfile
+import time
 import warnings
+from contextlib import contextmanager
 from threading import Event
 
 import click
@@ -28,6 +34,7 @@ warnings.filterwarnings("ignore", category=DeprecationWarning)
 import imp
 from functools import reduce
 
+from . import __version__
 from .utils import (
     Map,
     PythonExpression,
@@ -43,15 +50,34 @@ from .utils import (
 ENVNAME_PATTERN = "[A-Z0-9_]+"
 ENVPARAM_PATTERN = "\$\{%s\}" % ENVNAME_PATTERN
 
+# compiled patterns of variable names, strings with variables and variables in strings
+ENVNAME_REGEX = re.compile(f"^{ENVNAME_PATTERN}$")
+ENVVALUE_REGEX = re.compile(r".*%s.*" % ENVPARAM_PATTERN)
+ENVPARAM_REGEX = re.compile("(%s)" % ENVPARAM_PATTERN)
+
 # consolidated variables supplied via env file and environment variables
 ENV = {}
 
+# variables used by the configuration file that is being read and their values
+ENV_USED = {}
+
 DEBUG = str2bool(os.getenv("JA2MQTT_DEBUG", "False"))
 ANSI_COLORS = not str2bool(os.getenv("JA2MQTT_NO_ANSI", "False"))
 CONFIG_FILE = os.getenv("JA2MQTT_CONFIG", None)
 CONFIG_ENV = os.getenv("JA2MQTT_ENV", None)
 
-env_variables = ["JA2MQTT_DEBUG", "JA2MQTT_NO_ANSI", "JA2MQTT_CONFIG", "JA2MQTT_ENV"]
+# directory of the cache of parsed configuration files, the cache is disabled when empty
+CACHE_DIR = os.getenv(
+    "JA2MQTT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ja2mqtt")
+)
+
+env_variables = [
+    "JA2MQTT_DEBUG",
+    "JA2MQTT_NO_ANSI",
+    "JA2MQTT_CONFIG",
+    "JA2MQTT_ENV",
+    "JA2MQTT_CACHE_DIR",
+]
 
 ENCODING = "ascii"
 
@@ -61,11 +87,56 @@ exit_event = Event()
 # valid schema versions
 SCHEMA_VERSIONS = ["1.0"]
 
+# format of entries in the configuration cache, entries of other formats are not used
+CACHE_FORMAT = 2
+
+# tags of strings in the parsed configuration tree, environment variables and Python
+# expressions are resolved after the tree is parsed or read from the cache
+ENV_TAG = "!env"
+PY_TAG = "!py"
+
+# durations of startup phases in seconds by names of the phases
+TIMINGS = {}
+
+# durations of nested phases of the phases that are being measured
+_timings_nested = []
+
+
+@contextmanager
+def timing(phase):
+    """
+    Add the time spent in the block to the duration of the startup `phase`. The time
+    of phases nested in the block is not added to the `phase`.
+    """
+    start_time = time.perf_counter()
+    _timings_nested.append(0)
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start_time
+        TIMINGS[phase] = TIMINGS.get(phase, 0) + duration - _timings_nested.pop()
+        if _timings_nested:
+            _timings_nested[-1] += duration
+
+
+def format_timings(timings=None):
+    """
+    Return a string with durations of the startup phases in milliseconds.
+    """
+    timings = TIMINGS if timings is None else timings
+    phases = [f"{k}={v * 1000:.1f}ms" for k, v in timings.items()]
+    return " ".join(phases + [f"total={sum(timings.values()) * 1000:.1f}ms"])
+
 
 class Jinja2TemplateLoader(jinja2.BaseLoader):
+    def __init__(self):
+        # templates loaded by the loader
+        self.files = []
+
     def get_source(self, environment, template):
         if not os.path.exists(template):
             raise jinja2.TemplateNotFound(template)
+        self.files.append(os.path.realpath(template))
         with open(template, "r", encoding="utf-8") as f:
             source = f.read()
         return source, template, lambda: True
@@ -83,9 +154,9 @@ class Jinja2Template(io.BytesIO):
     def __init__(self, file, scope=None, strip_blank_lines=False):
         super(Jinja2Template, self).__init__(None)
         self.name = file
-        env = jinja2.Environment(
-            loader=Jinja2TemplateLoader(), trim_blocks=True, lstrip_blocks=True
-        )
+        loader = Jinja2TemplateLoader()
+        self.files = loader.files
+        env = jinja2.Environment(loader=loader, trim_blocks=True, lstrip_blocks=True)
         if scope is not None:
             env.globals.update(scope)
         try:
@@ -138,42 +209,172 @@ def init_env(env_file, sep="=", comment="#"):
                 if l and not l.startswith(comment):
                     key_value = l.split(sep)
                     key = key_value[0].strip()
-                    if not re.match(f"^{ENVNAME_PATTERN}$", key):
+                    if not ENVNAME_REGEX.match(key):
                         raise Exception(f"Invalid variable name '{key}'.")
                     value = sep.join(key_value[1:]).strip().strip("\"'")
                     env[key] = value
     return env
 
 
+def value_digest(value):
+    """
+    Return the digest of the string value.
+    """
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+def file_digest(file):
+    """
+    Return the digest of the content of the file or None when the file does not exist.
+    """
+    try:
+        with open(file, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+class ConfigCache:
+    """
+    ConfigCache keeps parsed configuration files in the `cache_dir` directory, so that the
+    files do not need to be rendered and parsed again on the next start. An entry of a file is
+    valid when the contents of the file and the templates it includes, the values of environment
+    variables it uses, and the versions of ja2mqtt and Python are the same as when the entry
+    was written. An entry also keeps digests of schemas the configuration is valid against.
+
+    Entries are JSON files with the parsed tree before environment variables are replaced, so
+    that values of variables are not written to the cache, only their digests. The cache is only
+    used when the directory is owned by the user and other users cannot write to it, as strings
+    of Python expressions in the entries are evaluated.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.version = (CACHE_FORMAT, __version__, sys.version)
+
+    def path(self, config_file, use_template, scope):
+        """
+        Return the path of the entry for the file. Only data of the `scope`, such as the topology,
+        are used by templates, functions of the scope are not part of the key.
+        """
+        data = {k: v for k, v in (scope or {}).items() if not callable(v)}
+        key = json.dumps([config_file, use_template, data], sort_keys=True, default=str)
+        return os.path.join(self.cache_dir, value_digest(key) + ".json")
+
+    def is_private(self):
+        """
+        Return True when the cache directory is owned by the user and other users cannot write to it.
+        """
+        try:
+            st = os.stat(self.cache_dir)
+        except OSError:
+            return False
+        if hasattr(os, "getuid") and st.st_uid != os.getuid():
+            return False
+        return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+    def load(self, path):
+        """
+        Return the entry in the `path` or None when it does not exist or it is not valid.
+        """
+        if not self.is_private():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except Exception:
+            return None
+        if entry.get("version") != list(self.version):
+            return None
+        for file, digest in entry["files"].items():
+            if file_digest(file) != digest:
+                return None
+        for name, digest in entry["env"].items():
+            if name not in ENV or value_digest(ENV[name]) != digest:
+                return None
+        return entry
+
+    def store(self, path, entry):
+        """
+        Write the entry to the `path`. The cache is only an optimization and errors are ignored.
+        Trees that JSON cannot represent, such as trees with dates or keys that are not strings,
+        are not written.
+        """
+        entry["version"] = self.version
+        try:
+            data = json.dumps(entry)
+            if json.loads(data)["tree"] != entry["tree"]:
+                return
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            if not self.is_private():
+                return
+            fd, tmp_file = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_file, path)
+        except Exception:
+            pass
+
+
 def read_config(config_file, env_file, use_template, scope=None):
+    """
+    Read the configuration file. Return a tuple `(config, config_file, config_dir, entry)` where
+    `entry` is the entry of the file in the configuration cache or None when the cache is disabled.
+    """
     if not (os.path.exists(config_file)):
         raise Exception(f"The configuration file {config_file} does not exist!")
     if env_file and not (os.path.exists(env_file)):
         raise Exception(f"The environment file {env_file} does not exist!")
 
     # init yaml reader
-    global ENV
-    ENV = init_env(env_file)
-    yaml.add_implicit_resolver("!env", re.compile(r".*%s.*" % ENVPARAM_PATTERN))
-    yaml.add_constructor("!env", env_constructor)
-    yaml.add_constructor("!py", py_constructor)
+    global ENV, ENV_USED
+    with timing("env"):
+        ENV = init_env(env_file)
+    ENV_USED = {}
 
     config_file = os.path.realpath(config_file)
-    stream = (
-        open(config_file, "r", encoding="utf-8")
-        if not use_template
-        else Jinja2Template(config_file, scope, strip_blank_lines=True)
-    )
+    config_dir = os.path.dirname(config_file)
+    cache = ConfigCache(CACHE_DIR) if CACHE_DIR else None
+    if cache is not None:
+        with timing("cache"):
+            cache_path = cache.path(config_file, use_template, scope)
+            entry = cache.load(cache_path)
+        if entry is not None:
+            with timing("cache"):
+                config = resolve_tree(entry["tree"])
+            entry["path"] = cache_path
+            return config, config_file, config_dir, entry
+
+    with timing("render"):
+        stream = (
+            open(config_file, "r", encoding="utf-8")
+            if not use_template
+            else Jinja2Template(config_file, scope, strip_blank_lines=True)
+        )
     try:
-        config = yaml.load(stream, Loader=yaml.FullLoader)
+        with timing("parse"):
+            tree = yaml.load(stream, Loader=YAML_LOADER)
+            config = resolve_tree(tree)
     except Exception as e:
         raise Exception(
             f"Error when reading the configuration file {config_file}: {str(e)}"
         )
     finally:
         stream.close()
-    config_dir = os.path.dirname(config_file)
-    return config, config_file, config_dir
+
+    entry = None
+    if cache is not None:
+        files = [config_file] + (stream.files if use_template else [])
+        entry = dict(
+            tree=tree,
+            files={x: file_digest(x) for x in files},
+            env={k: value_digest(v) for k, v in ENV_USED.items()},
+            valid=[],
+        )
+        with timing("cache"):
+            cache.store(cache_path, entry)
+        entry["path"] = cache_path
+    return config, config_file, config_dir, entry
 
 
 def replace_env_variable(value):
@@ -181,38 +382,81 @@ def replace_env_variable(value):
     Replace all environment varaibles in a string privided in `value` parameter
     with values of variable in `ENV` global variable.
     """
-    params = list(set(re.findall("(%s)" % ENVPARAM_PATTERN, value)))
-    if len(params) > 0:
-        for k in params:
-            env_value = ENV.get(k[2:-1])
-            if env_value is None:
-                raise Exception(f"The environment variable {k} does not exist!")
-            else:
-                value = value.replace(k, env_value)
-    return value
+
+    def _replace(match):
+        k = match.group(1)
+        env_value = ENV.get(k[2:-1])
+        if env_value is None:
+            raise Exception(f"The environment variable {k} does not exist!")
+        ENV_USED[k[2:-1]] = env_value
+        return env_value
+
+    if "${" not in value:
+        return value
+    return ENVPARAM_REGEX.sub(_replace, value)
 
 
 def env_constructor(loader, node):
     """
     A constructor for environment varaibles provided in the yaml configuration file.
-    It populates strings that contain environment variables in a form `${var_name}` with
-    their values.
+    Strings that contain environment variables in a form `${var_name}` are tagged
+    and `resolve_tree` populates them with values of the variables.
     """
-    return replace_env_variable(node.value)
+    return {ENV_TAG: node.value}
 
 
 def py_constructor(loader, node):
     """
     A constructor for Python expression in the yaml configuration file. The python expression
-    must be prefixed by `!py` directive. The result is the `PythonExpression` object.
+    must be prefixed by `!py` directive. The string is tagged and `resolve_tree` creates
+    the `PythonExpression` object.
     """
-    try:
-        return PythonExpression(replace_env_variable(node.value))
-    except Exception as e:
-        raise Exception(
-            'Cannot create python expression from string "%s". %s'
-            % (node.value, str(e))
-        )
+    return {PY_TAG: node.value}
+
+
+def resolve_tree(value):
+    """
+    Return the parsed configuration tree where environment variables in strings tagged by
+    `env_constructor` are replaced with their values and strings tagged by `py_constructor`
+    are replaced with `PythonExpression` objects.
+    """
+    if isinstance(value, dict):
+        if len(value) == 1 and ENV_TAG in value:
+            return replace_env_variable(value[ENV_TAG])
+        if len(value) == 1 and PY_TAG in value:
+            try:
+                return PythonExpression(replace_env_variable(value[PY_TAG]))
+            except Exception as e:
+                raise Exception(
+                    'Cannot create python expression from string "%s". %s'
+                    % (value[PY_TAG], str(e))
+                )
+        return {k: resolve_tree(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve_tree(x) for x in value]
+    return value
+
+
+class ConfigLoader(yaml.FullLoader):
+    """
+    The loader of configuration files with the `!py` and `!env` tags. The tags are registered
+    only in this loader and only once, the global loaders of PyYAML are not changed.
+    """
+
+
+class CConfigLoader(getattr(yaml, "CFullLoader", yaml.FullLoader)):
+    """
+    The loader of configuration files that uses the libyaml parser when PyYAML is built with it.
+    """
+
+
+for loader_class in (ConfigLoader, CConfigLoader):
+    loader_class.add_implicit_resolver("!env", ENVVALUE_REGEX, None)
+    loader_class.add_constructor("!env", env_constructor)
+    loader_class.add_constructor("!py", py_constructor)
+
+# the loader of yaml files
+YAML_LOADER = CConfigLoader
 
 
 class Config:
@@ -233,17 +477,21 @@ class Config:
         Read and parse the configuration from the yaml file and initializes the logging.
         """
         self.schema = None
+        self.schema_file = None
         self.log_level = log_level
+        self.panel_name = None
         if not (os.path.exists(file)):
             raise Exception(f"The configuration file {file} does not exist!")
-        self.raw_config, self.config_file, self.config_dir = read_config(
-            file, env, use_template=use_template, scope=scope
-        )
+        (
+            self.raw_config,
+            self.config_file,
+            self.config_dir,
+            self.cache_entry,
+        ) = read_config(file, env, use_template=use_template, scope=scope)
         self.root = self.get_part(None)
         if schema:
-            self.schema = read_config(
-                get_schema_file(schema), None, use_template=False
-            )[0]
+            self.schema_file = get_schema_file(schema)
+            self.schema = read_config(self.schema_file, None, use_template=False)[0]
 
     def check_dupplicates(self, path):
         _path = path.split(".")
@@ -279,9 +527,23 @@ class Config:
                 __python_expr_or_str_or_number=__python_expr_or_str_or_number,
             )
         )
-        ConfigValidator = extend(Draft7Validator, type_checker=type_checker)
-        validator = ConfigValidator(self.schema)
-        errors = list(validator.iter_errors(self.raw_config))
+        # the configuration from the cache may have been validated against the same schema
+        schema_digest = (
+            file_digest(self.schema_file) if self.cache_entry is not None else None
+        )
+        if schema_digest is not None and schema_digest in self.cache_entry["valid"]:
+            errors = []
+        else:
+            with timing("validate"):
+                ConfigValidator = extend(Draft7Validator, type_checker=type_checker)
+                validator = ConfigValidator(self.schema)
+                errors = list(validator.iter_errors(self.raw_config))
+            if not errors and schema_digest is not None:
+                with timing("cache"):
+                    self.cache_entry["valid"].append(schema_digest)
+                    ConfigCache(CACHE_DIR).store(
+                        self.cache_entry["path"], self.cache_entry
+                    )
 
         if errors:
             if throw_ex:
@@ -290,11 +552,38 @@ class Config:
                 )
             return False, errors
         else:
-            self.check_dupplicates("topology.section.code")
-            self.check_dupplicates("topology.peripheral.pos")
-            self.check_dupplicates("simulator.sections.code")
+            self.check_dupplicates("panels.name")
+            for panel in self.panels():
+                for path in ("ja2mqtt", "serial", "topology"):
+                    if panel.panel_name is not None and panel(path, None) is None:
+                        raise Exception(
+                            f"The property '{path}' does not exist for the panel '{panel.panel_name}'!"
+                        )
+                panel.check_dupplicates("topology.section.code")
+                panel.check_dupplicates("topology.peripheral.pos")
+                panel.check_dupplicates("simulator.sections.code")
             return True, None
 
+    def panels(self):
+        """
+        Return a list of configurations of Jablotron panels. When the `panels` property exists,
+        the configuration of a panel is the main configuration where the properties of the panel,
+        such as `ja2mqtt`, `serial` and `topology`, replace the properties of the main configuration.
+        Otherwise, the list only contains the main configuration.
+        """
+        panels = self.raw_config.get("panels")
+        if not panels:
+            return [self]
+        result = []
+        for panel in panels:
+            c = copy.copy(self)
+            c.raw_config = {k: v for k, v in self.raw_config.items() if k != "panels"}
+            c.raw_config.update(panel)
+            c.root = c.get_part(None)
+            c.panel_name = panel.get("name")
+            result.append(c)
+        return result
+
     def get_dir_path(self, path, base_dir=None, check=False):
         """
         Return the full directory of the path with `config_dir` as the base directory.
@@ -393,6 +682,20 @@ class ConfigPart:
             )
         return v
 
+    def value_float(self, path, default=None, min=None, max=None, required=False):
+        v = self.value(path, default=default, type=float, required=required)
+        if min is not None and v < min:
+            raise Exception(
+                "The property %s value %s must be greater or equal to %s!"
+                % (self.path(path), v, min)
+            )
+        if max is not None and v > max:
+            raise Exception(
+                "The property %s value %s must be less or equal to %s!"
+                % (self.path(path), v, max)
+            )
+        return v
+
     def value_bool(self, path, default=None, required=False):
         return self.value(path, default=default, type=bool, required=required)
 
@@ -3,6 +3,7 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import asyncio
 import random
 import re
 import string
@@ -144,6 +145,127 @@ def deep_eval(data, scope, raise_ex=False):
     return data
 
 
+def json_key(key):
+    """
+    Return the JSON representation of a dictionary key as produced by `json.dumps`.
+    """
+    return json.dumps({key: None})[1:-7]
+
+
+class JSONEmitter:
+    """
+    JSONEmitter compiles a data template, i.e. a dictionary that may contain Python expressions,
+    to a JSON emitter. Static parts of the template are serialized to JSON at compile time and
+    only the Python expressions are evaluated when the JSON string is emitted. The result is
+    the same as `json.dumps(deep_eval(template, scope))` without copying or modifying the template.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.items = []
+        for key, value in template.items():
+            static, fn = self.compile(value)
+            if fn is None:
+                self.items.append((key, f"{json_key(key)}: {static}", None))
+            else:
+                self.items.append((key, f"{json_key(key)}: ", fn))
+
+    @classmethod
+    def compile(cls, value):
+        """
+        Compile the value to a tuple `(static, fn)`, where `static` is the JSON string of
+        the value when the value does not contain Python expressions, and `fn` is a function
+        that emits the JSON string of the value for a scope otherwise.
+        """
+        if callable(getattr(value, "eval", None)):
+
+            def _expr(scope):
+                try:
+                    v = value.eval(scope)
+                except Exception:
+                    v = None
+                return json.dumps(v)
+
+            return None, _expr
+
+        if isinstance(value, dict):
+            items = [(json_key(k),) + cls.compile(v) for k, v in value.items()]
+            if all(fn is None for _, _, fn in items):
+                return json.dumps(value), None
+            return None, lambda scope: "{%s}" % ", ".join(
+                f"{k}: {static if fn is None else fn(scope)}" for k, static, fn in items
+            )
+
+        if isinstance(value, list):
+            items = [cls.compile(v) for v in value]
+            if all(fn is None for _, fn in items):
+                return json.dumps(value), None
+            return None, lambda scope: "[%s]" % ", ".join(
+                static if fn is None else fn(scope) for static, fn in items
+            )
+
+        return json.dumps(value), None
+
+    def parts(self, scope, data=None):
+        """
+        Return a list of `(key, json)` tuples of the properties emitted for the scope,
+        where `json` is the JSON string of the property. The properties in `data` are
+        emitted first and they take precedence over the properties of the template
+        with the same name.
+        """
+        parts = []
+        if data:
+            parts = [(k, f"{json_key(k)}: {json.dumps(v)}") for k, v in data.items()]
+        for key, static, fn in self.items:
+            if data and key in data:
+                continue
+            parts.append((key, static if fn is None else static + fn(scope)))
+        return parts
+
+    @classmethod
+    def evaluate(cls, value, scope):
+        """
+        Return the value with Python expressions evaluated for the scope. Unlike `deep_eval`,
+        the value is not modified.
+        """
+        if callable(getattr(value, "eval", None)):
+            try:
+                return value.eval(scope)
+            except Exception:
+                return None
+        if isinstance(value, dict):
+            return {k: cls.evaluate(v, scope) for k, v in value.items()}
+        if isinstance(value, list):
+            return [cls.evaluate(v, scope) for v in value]
+        return value
+
+    def values(self, scope, data=None):
+        """
+        Return a list of `(key, value)` tuples of the properties emitted for the scope
+        in the same order as `parts`, with values that are not serialized to JSON.
+        """
+        values = list(data.items()) if data else []
+        for key, value in self.template.items():
+            if data and key in data:
+                continue
+            values.append((key, self.evaluate(value, scope)))
+        return values
+
+    @classmethod
+    def join(cls, parts):
+        """
+        Join the properties returned by `parts` to the JSON string.
+        """
+        return "{%s}" % ", ".join(x for _, x in parts)
+
+    def emit(self, scope, data=None):
+        """
+        Emit the JSON string for the scope. The properties in `data` are emitted first
+        and they take precedence over the properties of the template with the same name.
+        """
+        return self.join(self.parts(scope, data))
+
+
 def deep_find(dic, keys, default=None, type=None, delim="."):
     val = reduce(
         lambda di, key: di.get(key, default) if isinstance(di, dict) else default,
@@ -214,18 +336,20 @@ class PathDef:
     def __init__(self, path_def):
         self.path_def = path_def
 
-    def params(self, path):
-        path_re = self.path_def
-
         # find all params in path_def
-        params_def = re.findall("(\{[a-zA-Z0-9_\.]+\})", self.path_def)
+        self.params_def = re.findall("(\{[a-zA-Z0-9_\.]+\})", self.path_def)
 
         # create re pattern by replacing parameters in path_def with pattern to match parameter values
-        for p_def in params_def:
+        path_re = self.path_def
+        for p_def in self.params_def:
             path_re = path_re.replace(p_def, "([a-zA-Z\-0-9\._]+)")
+        self.re = re.compile("^" + path_re + "$")
+
+    def params(self, path):
+        params_def = self.params_def
 
         # get params values
-        res = re.findall("^" + path_re + "$", path)
+        res = self.re.findall(path)
         values = []
         for x in res:
             if type(x) is tuple:
@@ -261,6 +385,69 @@ class PathDef:
         return new_path
 
 
+class TimerWheel:
+    """
+    TimerWheel is a hashed timing wheel for expiring keys. The keys are stored in slots by their
+    deadlines with a resolution of `tick` seconds. The `expire` method only visits the slots of ticks
+    elapsed since its last call, so the cost of expiry does not depend on the number of stored keys.
+    """
+
+    def __init__(self, tick=0.1, slots=256):
+        self.tick = tick
+        self.slots = [dict() for x in range(slots)]
+        self.current = None
+
+    def slot(self, deadline):
+        return self.slots[int(deadline / self.tick) % len(self.slots)]
+
+    def add(self, key, deadline):
+        self.slot(deadline)[key] = deadline
+
+    def remove(self, key, deadline):
+        self.slot(deadline).pop(key, None)
+
+    def expire(self, now):
+        """
+        Remove and return the keys whose deadline is less than or equal to `now`.
+        """
+        t = int(now / self.tick)
+        if self.current is None:
+            self.current = t
+        start = max(self.current, t - len(self.slots) + 1)
+        expired = []
+        for x in range(start, t + 1):
+            slot = self.slots[x % len(self.slots)]
+            for key in [k for k, deadline in slot.items() if deadline <= now]:
+                del slot[key]
+                expired.append(key)
+        self.current = t
+        return expired
+
+
+async def wait_event(event, timeout=None):
+    """
+    Wait for the asyncio `event` to be set. Return True if the event is set or False when
+    the `timeout` expires.
+    """
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def wait_any(*events):
+    """
+    Wait until any of the asyncio `events` is set.
+    """
+    waiters = [asyncio.ensure_future(e.wait()) for e in events]
+    try:
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for w in waiters:
+            w.cancel()
+
+
 def remove_ansi_escape(text):
     ansi_escape = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
     return ansi_escape.sub("", text)
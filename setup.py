@@ -29,7 +29,7 @@ exec(open(version_file).read())
 install_requires = [
     'click>=8.0.4',
     'Jinja2>=3.0.3',
-    'paho-mqtt>=1.6.1',
+    'paho-mqtt>=1.6.1,<2.0',
     'pyserial>=3.5',
     'PyYAML>=6.0',
     'jsonschema>=4.0.0',
@@ -47,6 +47,10 @@ setup(
     packages=find_packages(exclude=['tests.*', 'tests']),
     include_package_data=True,
     install_requires=install_requires,
+    extras_require={
+        'cbor': ['cbor2>=5.4.0'],
+        'msgpack': ['msgpack>=1.0.0'],
+    },
     python_requires='>=3.6.0',
     classifiers=[
         'Development Status :: 5 - Production/Stable',